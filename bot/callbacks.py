@@ -0,0 +1,193 @@
+"""
+Маршрутизация нажатий на inline-кнопки
+
+callback_data кнопки имеет вид "<префикс>" или "<префикс>:<поле>:<поле>...".
+Обработчик выбирается по префиксу одним поиском в словаре. Если полей не
+хватает (состояние кнопки сложнее пары значений) или они не помещаются в
+64 байта Telegram, состояние кладётся в хранилище на сервере, а в кнопку
+попадает короткий ключ: "<префикс>:~<ключ>".
+
+Повторные нажатия на ту же кнопку (двойной тап, нетерпеливый игрок) в течение
+dedup_window отбрасываются, а кнопки с once=True срабатывают один раз - так
+один запрошенный ГМ бросок не превращается в два.
+"""
+
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from telegram import InlineKeyboardButton, Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Лимит Telegram на callback_data
+MAX_CALLBACK_DATA = 64
+
+SEPARATOR = ":"
+STATE_MARKER = "~"
+
+
+@dataclass
+class CallbackPayload:
+    """Данные нажатой кнопки"""
+    args: List[str] = field(default_factory=list)  # поля из callback_data
+    state: Any = None  # состояние из хранилища, если кнопка на него ссылается
+
+
+Handler = Callable[[Update, ContextTypes.DEFAULT_TYPE, CallbackPayload], Awaitable[Any]]
+
+
+class CallbackStore:
+    """Состояние кнопок на сервере: короткий ключ -> значение, с TTL и вытеснением старых"""
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self.expired = 0
+
+    def put(self, value: Any) -> str:
+        key = secrets.token_urlsafe(6)  # 8 символов
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return key
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if time.monotonic() > expires:
+            del self._entries[key]
+            self.expired += 1
+            return None
+        return value
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@dataclass
+class _Route:
+    handler: Handler
+    once: bool = False
+
+
+class CallbackRouter:
+    """Таблица обработчиков кнопок по префиксу callback_data"""
+
+    def __init__(self, store: Optional[CallbackStore] = None, dedup_window: float = 3.0,
+                 max_remembered: int = 10000):
+        """
+        Args:
+            store: Хранилище состояния кнопок
+            dedup_window: Сколько секунд после нажатия повтор считается дублем
+            max_remembered: Сколько нажатий помнить для отсева дублей и once-кнопок
+        """
+        self.store = store or CallbackStore()
+        self.dedup_window = dedup_window
+        self.max_remembered = max_remembered
+        self._routes: Dict[str, _Route] = {}
+        # (пользователь, сообщение, callback_data) -> время нажатия; None - обработка ещё идёт
+        self._recent: "OrderedDict[Hashable, Optional[float]]" = OrderedDict()
+        self._used: "OrderedDict[Hashable, None]" = OrderedDict()  # сработавшие once-кнопки
+
+        self.dispatched: Dict[str, int] = {}
+        self.duplicates = 0
+        self.unknown = 0
+        self.stale = 0
+
+    def route(self, prefix: str, handler: Handler, once: bool = False):
+        """Зарегистрировать обработчик кнопок с префиксом"""
+        if SEPARATOR in prefix:
+            raise ValueError(f"Префикс не может содержать '{SEPARATOR}': {prefix}")
+        self._routes[prefix] = _Route(handler, once)
+
+    def data(self, prefix: str, *fields: Any, state: Any = None) -> str:
+        """callback_data для кнопки; состояние или длинные поля уходят в хранилище"""
+        if prefix not in self._routes:
+            raise KeyError(f"Нет обработчика для префикса {prefix}")
+        if state is None:
+            if self.fits_inline(prefix, *fields):
+                return SEPARATOR.join([prefix, *(str(value) for value in fields)])
+            state = list(fields)
+        return f"{prefix}{SEPARATOR}{STATE_MARKER}{self.store.put(state)}"
+
+    @staticmethod
+    def fits_inline(prefix: str, *fields: Any) -> bool:
+        """Поля помещаются в саму callback_data - кнопка не зависит от хранилища (и его TTL)"""
+        values = [str(value) for value in fields]
+        data = SEPARATOR.join([prefix, *values])
+        return (len(data.encode()) <= MAX_CALLBACK_DATA
+                and not any(SEPARATOR in value or value.startswith(STATE_MARKER) for value in values))
+
+    def button(self, text: str, prefix: str, *fields: Any, state: Any = None) -> InlineKeyboardButton:
+        return InlineKeyboardButton(text, callback_data=self.data(prefix, *fields, state=state))
+
+    def _parse(self, data: str) -> Tuple[Optional[_Route], str, CallbackPayload]:
+        prefix, _, rest = data.partition(SEPARATOR)
+        route = self._routes.get(prefix)
+        if route is None:
+            return None, prefix, CallbackPayload()
+        if rest.startswith(STATE_MARKER):
+            state = self.store.get(rest[len(STATE_MARKER):])
+            if state is None:
+                self.stale += 1
+                return None, prefix, CallbackPayload()
+            if isinstance(state, list):
+                return route, prefix, CallbackPayload(args=[str(value) for value in state])
+            return route, prefix, CallbackPayload(state=state)
+        return route, prefix, CallbackPayload(args=rest.split(SEPARATOR) if rest else [])
+
+    def _remember(self, table: OrderedDict, key: Hashable, value: Any):
+        table[key] = value
+        table.move_to_end(key)
+        while len(table) > self.max_remembered:
+            table.popitem(last=False)
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик CallbackQueryHandler: найти маршрут, отсеять дубли и вызвать"""
+        query = update.callback_query
+        route, prefix, payload = self._parse(query.data or "")
+        if route is None:
+            self.unknown += 1
+            await query.answer("⌛ Кнопка устарела - вызови команду заново", show_alert=True)
+            return
+
+        message_id = query.message.message_id if query.message else query.inline_message_id
+        key = (query.from_user.id, message_id, query.data)
+        if route.once and key in self._used:
+            self.duplicates += 1
+            await query.answer("✅ Уже сделано")
+            return
+        if key in self._recent:
+            pressed = self._recent[key]
+            if pressed is None or time.monotonic() - pressed < self.dedup_window:
+                self.duplicates += 1
+                await query.answer("⏳ Уже обрабатываю")
+                return
+
+        self._remember(self._recent, key, None)
+        await query.answer()
+        try:
+            await route.handler(update, context, payload)
+        finally:
+            self._remember(self._recent, key, time.monotonic())
+        if route.once:
+            self._remember(self._used, key, None)
+        self.dispatched[prefix] = self.dispatched.get(prefix, 0) + 1
+
+    def get_stats(self) -> Dict:
+        return {
+            "dispatched": dict(self.dispatched),
+            "duplicates": self.duplicates,
+            "unknown": self.unknown,
+            "stale": self.stale,
+            "stored_states": len(self.store),
+            "expired_states": self.store.expired
+        }
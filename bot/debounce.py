@@ -0,0 +1,249 @@
+"""
+Склейка быстрых сообщений игрока в одно действие
+
+Игроки часто пишут действие двумя-тремя сообщениями подряд ("Подхожу к двери" -
+"и прислушиваюсь" - "меч наготове"). Без склейки это три запроса к ГМ и три
+разрозненных ответа. MessageDebouncer копит сообщения одного игрока, пока они
+приходят чаще, чем раз в window секунд (но не дольше max_wait), и отдаёт их
+одним действием. Пока сообщения копятся и ГМ отвечает, поддерживается индикатор
+"печатает".
+
+Обработчик апдейта не ждёт окна: сообщение кладётся в пачку, и обработчик сразу
+завершается - иначе очередь чата (bot.updates) не пропустила бы следующее
+сообщение до конца ожидания. Пачки копятся по игроку, а отдаются ГМ по очереди
+"хода" (turn) - для бота это чат: два игрока одного стола не обращаются к ГМ
+с одной сессией одновременно. Апдейт чата, который не склеивается (команда,
+кнопка), сначала вызывает drain - накопленные действия отправляются и
+обрабатываются раньше него, как в очереди чата.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Batch:
+    """Сообщения, ждущие склейки"""
+    texts: List[str]
+    opened: float
+    callback: Callable[[str], Awaitable]
+    turn: Hashable
+    keepalive: Optional[asyncio.Task] = None
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+@dataclass
+class _Turn:
+    """Очередь действий одного хода (чата) к ГМ"""
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    tasks: Set[asyncio.Task] = field(default_factory=set)  # пачки, которые ждут или обрабатываются
+
+
+class MessageDebouncer:
+    """Окно склейки сообщений для каждого игрока"""
+
+    def __init__(self, window: float = 1.5, max_wait: float = 4.0, max_messages: int = 5,
+                 keepalive_interval: float = 4.5, separator: str = "\n"):
+        """
+        Args:
+            window: Сколько секунд ждать следующего сообщения; 0 - склейка выключена
+            max_wait: Сколько секунд максимум копить сообщения с первого в пачке
+            max_messages: После стольких сообщений пачка отправляется сразу
+            keepalive_interval: Как часто повторять индикатор "печатает" (в клиенте он гаснет через 5 с)
+            separator: Чем соединять сообщения пачки
+        """
+        self.window = window
+        self.max_wait = max_wait
+        self.max_messages = max_messages
+        self.keepalive_interval = keepalive_interval
+        self.separator = separator
+
+        self._batches: Dict[Hashable, _Batch] = {}
+        self._turns: Dict[Hashable, _Turn] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.messages = 0
+        self.batches = 0
+        self.batch_sizes: Counter = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def submit(self, key: Hashable, text: str, callback: Callable[[str], Awaitable],
+               keepalive: Optional[Callable[[], Awaitable]] = None, turn: Optional[Hashable] = None):
+        """
+        Добавить сообщение в пачку игрока
+
+        Args:
+            key: Чей это ввод (например, чат и пользователь)
+            text: Текст сообщения
+            callback: Что сделать со склеенным текстом; берётся из последнего сообщения пачки
+            keepalive: Индикатор активности (send_action), повторяется до конца обработки
+            turn: Очередь, в которой пачка отдаётся (например, чат); по умолчанию key
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.messages += 1
+
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch([text], now, callback, key if turn is None else turn)
+            if keepalive:
+                batch.keepalive = self._spawn(self._keep_alive(keepalive))
+        else:
+            batch.texts.append(text)
+            batch.callback = callback
+            batch.timer.cancel()
+
+        if len(batch.texts) >= self.max_messages or now - batch.opened >= self.max_wait:
+            self._flush(key)
+        else:
+            delay = min(self.window, batch.opened + self.max_wait - now)
+            batch.timer = loop.call_later(delay, self._flush, key)
+
+    def _spawn(self, coroutine) -> asyncio.Task:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _keep_alive(self, keepalive: Callable[[], Awaitable]):
+        while True:
+            try:
+                await keepalive()
+            except Exception as e:
+                logger.debug(f"Индикатор активности не отправлен: {e}")
+            await asyncio.sleep(self.keepalive_interval)
+
+    def _flush(self, key: Hashable):
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer:
+            batch.timer.cancel()
+        self.batches += 1
+        self.batch_sizes[len(batch.texts)] += 1
+
+        turn = self._turns.get(batch.turn)
+        if turn is None:
+            turn = self._turns[batch.turn] = _Turn()
+        turn.tasks.add(self._spawn(self._run(key, batch, turn)))
+
+    async def _run(self, key: Hashable, batch: _Batch, turn: _Turn):
+        try:
+            # Следующая пачка хода уходит ГМ только после ответа на предыдущую
+            async with turn.lock:
+                await batch.callback(self.separator.join(batch.texts))
+        except Exception as e:
+            logger.error(f"Ошибка обработки действия {key}: {e}")
+        finally:
+            if batch.keepalive:
+                batch.keepalive.cancel()
+            turn.tasks.discard(asyncio.current_task())
+            if not turn.tasks:
+                del self._turns[batch.turn]
+
+    async def drain(self, turn: Hashable):
+        """Отправить накопленные пачки хода и дождаться, пока они обработаются"""
+        for key in [key for key, batch in self._batches.items() if batch.turn == turn]:
+            self._flush(key)
+        pending = self._turns.get(turn)
+        if pending:
+            # wait, а не gather: отмена ждущего не должна отменять сами действия
+            await asyncio.wait(set(pending.tasks))
+
+    async def close(self):
+        """Отправить накопленные пачки и дождаться их обработки"""
+        for key in list(self._batches):
+            self._flush(key)
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict:
+        return {
+            "window": self.window,
+            "messages": self.messages,
+            "batches": self.batches,
+            "saved_calls": self.messages - self.batches - sum(len(b.texts) for b in self._batches.values()),
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "pending": len(self._batches)
+        }
+
+    def render_text(self) -> str:
+        """Короткая сводка для админ-команды"""
+        stats = self.get_stats()
+        if not self.enabled:
+            return "✂️ Склейка сообщений выключена"
+        return (f"✂️ Склейка ({self.window:g} с): сообщений {stats['messages']}, действий {stats['batches']}, "
+                f"сэкономлено запросов к ГМ {stats['saved_calls']}")
+
+
+# Реплей: сколько запросов к ГМ экономит окно склейки на потоке, похожем на боевой
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+
+    # Модель темпа игры: доля действий, написанных несколькими сообщениями, и паузы
+    # внутри и между действиями (секунды)
+    SPLIT_SHARE = {1: 0.65, 2: 0.25, 3: 0.10}
+    INNER_GAP = (0.4, 2.5)  # между частями одного действия
+    THINK_TIME = (8.0, 40.0)  # между действиями (читает ответ ГМ, думает)
+
+    def player_timeline(rng: random.Random, actions: int) -> List[float]:
+        """Времена сообщений одного игрока"""
+        times, now = [], 0.0
+        for _ in range(actions):
+            parts = rng.choices(list(SPLIT_SHARE), weights=list(SPLIT_SHARE.values()))[0]
+            for part in range(parts):
+                if part:
+                    now += rng.uniform(*INNER_GAP)
+                times.append(now)
+            now += rng.uniform(*THINK_TIME)
+        return times
+
+    async def replay(window: float, players: int, actions: int, speedup: float, seed: int = 7):
+        rng = random.Random(seed)
+        timelines = [player_timeline(rng, actions) for _ in range(players)]
+        debouncer = MessageDebouncer(window=window / speedup, max_wait=4.0 / speedup)
+        calls = []
+        delays = []  # сколько последнее сообщение пачки ждало отправки ГМ
+
+        async def player(index: int, times: List[float]):
+            started = time.perf_counter()
+            for at in times:
+                await asyncio.sleep(max(0.0, started + at / speedup - time.perf_counter()))
+                sent = time.perf_counter()
+
+                async def call(text: str, sent: float = sent):
+                    calls.append(text)
+                    delays.append((time.perf_counter() - sent) * speedup)
+
+                if debouncer.enabled:
+                    debouncer.submit(index, f"сообщение {at:.1f}", call)
+                else:
+                    await call(f"сообщение {at:.1f}")
+
+        await asyncio.gather(*(player(i, times) for i, times in enumerate(timelines)))
+        await debouncer.close()
+        messages = sum(len(times) for times in timelines)
+        delays.sort()
+        return messages, len(calls), delays[len(delays) // 2], delays[int(len(delays) * 0.95)]
+
+    async def main(players: int = 40, actions: int = 30):
+        speedup = 50.0
+        print(f"{players} игроков по {actions} действий (время ускорено в {speedup:.0f} раз)")
+        for window in (0.0, 1.0, 1.5, 2.0, 3.0):
+            messages, calls, p50, p95 = await replay(window, players, actions, speedup)
+            saved = messages - calls
+            print(f"окно {window:.1f} с: сообщений {messages}, запросов к ГМ {calls} "
+                  f"(сэкономлено {saved}, {saved / messages:.0%}), "
+                  f"добавленная задержка p50={p50:.2f} с p95={p95:.2f} с")
+
+    asyncio.run(main(*(int(arg) for arg in sys.argv[1:3])))
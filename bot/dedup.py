@@ -0,0 +1,130 @@
+"""
+Отсев повторно доставленных апдейтов
+
+После переподключения polling или повтора вебхука (Telegram повторяет запрос,
+если не дождался ответа) тот же update_id может прийти второй раз - это второй
+запрос к ГМ, второй бросок и двойной урон. UpdateDeduplicator стоит перед всеми
+обработчиками (группа -2) и помнит последние capacity идентификаторов:
+кольцевой буфер задаёт порядок вытеснения, множество - проверку за O(1).
+Память постоянна: capacity целых чисел в списке и во множестве.
+
+Апдейт, уже вытесненный из окна, не отличить от нового; поэтому побочные
+эффекты действий дополнительно несут ключ идемпотентности (GameSession.claim_effect).
+"""
+
+import logging
+from typing import Dict, Hashable, List, Optional, Set
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """Скользящее окно последних update_id: кольцевой буфер + множество"""
+
+    def __init__(self, capacity: int = 4096):
+        """
+        Args:
+            capacity: Сколько последних апдейтов помнить
+        """
+        self.capacity = capacity
+        self._ring: List[Optional[Hashable]] = [None] * capacity
+        self._position = 0
+        self._seen: Set[Hashable] = set()
+
+        self.checked = 0
+        self.duplicates = 0
+
+    def seen(self, key: Hashable) -> bool:
+        """Был ли ключ в окне; новый ключ запоминается (вытесняя самый старый)"""
+        self.checked += 1
+        if key in self._seen:
+            self.duplicates += 1
+            return True
+        evicted = self._ring[self._position]
+        if evicted is not None:
+            self._seen.discard(evicted)
+        self._ring[self._position] = key
+        self._seen.add(key)
+        self._position = (self._position + 1) % self.capacity
+        return False
+
+    async def check(self, update: object, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик TypeHandler: повторный апдейт дальше не идёт"""
+        if isinstance(update, Update) and self.seen(update.update_id):
+            logger.warning(f"Апдейт {update.update_id} доставлен повторно, пропускаем")
+            raise ApplicationHandlerStop
+
+    @property
+    def hit_rate(self) -> float:
+        return self.duplicates / self.checked if self.checked else 0.0
+
+    def get_stats(self) -> Dict:
+        return {
+            "capacity": self.capacity,
+            "tracked": len(self._seen),
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "hit_rate": round(self.hit_rate, 4)
+        }
+
+    def render_text(self) -> str:
+        """Короткая сводка для админ-команды"""
+        stats = self.get_stats()
+        return (f"🔁 Повторные апдейты: {stats['duplicates']} из {stats['checked']} "
+                f"({self.hit_rate:.2%}), окно {stats['capacity']}")
+
+
+# Бенчмарк: стоимость проверки и память окна против OrderedDict (как в других LRU бота)
+if __name__ == "__main__":
+    import random
+    import time
+    import tracemalloc
+    from collections import OrderedDict
+
+    class OrderedDictWindow:
+        def __init__(self, capacity: int):
+            self.capacity = capacity
+            self._seen: "OrderedDict[Hashable, None]" = OrderedDict()
+
+        def seen(self, key: Hashable) -> bool:
+            if key in self._seen:
+                return True
+            self._seen[key] = None
+            if len(self._seen) > self.capacity:
+                self._seen.popitem(last=False)
+            return False
+
+    def stream(updates: int, duplicate_share: float, seed: int = 11) -> List[int]:
+        """update_id подряд; часть апдейтов доставляется повторно вскоре после первой доставки"""
+        rng = random.Random(seed)
+        ids = []
+        for update_id in range(updates):
+            ids.append(update_id)
+            if rng.random() < duplicate_share:
+                ids.append(update_id - rng.randint(0, 100))
+        return ids
+
+    def measure(window, ids: List[int]):
+        started = time.perf_counter()
+        duplicates = sum(window.seen(update_id) for update_id in ids)
+        elapsed = time.perf_counter() - started
+        return elapsed / len(ids) * 1e9, duplicates
+
+    def window_memory(factory, capacity: int) -> int:
+        tracemalloc.start()
+        window = factory(capacity)
+        for update_id in range(capacity * 2):
+            window.seen(update_id)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size
+
+    ids = stream(500_000, 0.01)
+    capacity = 4096
+    for name, factory in (("кольцо + множество", UpdateDeduplicator), ("OrderedDict", OrderedDictWindow)):
+        nanos, duplicates = measure(factory(capacity), ids)
+        memory = window_memory(factory, capacity)
+        print(f"{name:19}: {nanos:5.0f} нс на апдейт, дублей {duplicates}, память окна {memory / 1024:.0f} КБ")
@@ -0,0 +1,243 @@
+"""
+Локальный фейковый Telegram Bot API для бенчмарков бота
+
+Понимает запросы python-telegram-bot (getMe, getUpdates с long polling,
+setWebhook, sendMessage, editMessageText и т.п.) и позволяет подкладывать
+апдейты, которые бот получит через getUpdates. Может имитировать flood
+control: при превышении лимитов отправки отвечает 429 с retry_after. Направьте на него бота:
+Application.builder().base_url(f"{url}/bot")...
+
+    python -m bot.fake_telegram --port 8081
+    curl -d '{"chat_id": 1, "text": "/start"}' http://127.0.0.1:8081/inject
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+FAKE_BOT = {
+    "id": 100000001,
+    "is_bot": True,
+    "first_name": "Daggerheart Test",
+    "username": "daggerheart_test_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False
+}
+
+
+@dataclass
+class FakeTelegramStats:
+    """Счётчики сервера"""
+    requests: int = 0
+    get_updates: int = 0
+    delivered_updates: int = 0
+    sent_messages: int = 0
+    edited_messages: int = 0
+    flood_errors: int = 0  # ответы 429
+    methods: Dict[str, int] = field(default_factory=dict)
+
+
+# Методы, на которые действуют лимиты частоты отправки
+LIMITED_METHODS = {"sendMessage", "editMessageText", "sendChatAction"}
+
+
+class FakeTelegramServer:
+    """Фейковый Bot API на aiohttp"""
+
+    def __init__(self, chat_limit: Optional[int] = None, global_limit: Optional[int] = None):
+        """
+        Args:
+            chat_limit: Сколько отправок в секунду разрешено в один чат (None - без лимита)
+            global_limit: Сколько отправок в секунду разрешено боту всего
+        """
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self._sent_times: Dict[Any, deque] = {}  # чат (или None - все чаты) -> времена отправок
+        self.stats = FakeTelegramStats()
+        self.webhook: Dict[str, Any] = {}
+        self._updates: List[Dict] = []
+        self._new_updates: Optional[asyncio.Event] = None  # создаётся в цикле событий сервера
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/stats", self.handle_stats)
+        app.router.add_post("/inject", self.handle_inject)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> str:
+        """Запустить сервер в текущем цикле событий; возвращает адрес сервера"""
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f"http://{host}:{self._runner.addresses[0][1]}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def make_message_update(self, chat_id: int, text: str, user_id: Optional[int] = None,
+                            chat_type: str = "private") -> Dict:
+        """Апдейт с текстовым сообщением в формате Bot API"""
+        user_id = user_id or chat_id
+        update_id = next(self._update_ids)
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": chat_type},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"Игрок {user_id}"},
+                "text": text
+            }
+        }
+
+    def inject(self, update: Dict):
+        """Положить апдейт в очередь getUpdates"""
+        self._updates.append(update)
+        if self._new_updates:
+            self._new_updates.set()
+
+    @staticmethod
+    async def _params(request: web.Request) -> Dict:
+        """Параметры метода: JSON или форма (PTB кодирует вложенные значения в JSON)"""
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    def _message(self, chat_id: Any, text: str, message_id: Optional[int] = None) -> Dict:
+        return {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private" if int(chat_id) > 0 else "group"},
+            "from": FAKE_BOT,
+            "text": text
+        }
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        try:
+            params = await self._params(request)
+        except ConnectionResetError:
+            # Клиент оборвал запрос (например, остановка polling)
+            return web.Response(status=499)
+        self.stats.requests += 1
+        self.stats.methods[method] = self.stats.methods.get(method, 0) + 1
+
+        if method in LIMITED_METHODS and self._flooded(params.get("chat_id")):
+            self.stats.flood_errors += 1
+            return web.json_response({
+                "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1}
+            }, status=429)
+
+        if method == "getMe":
+            result: Any = FAKE_BOT
+        elif method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method == "setWebhook":
+            self.webhook = {"url": params.get("url", ""), "secret_token": params.get("secret_token")}
+            result = True
+        elif method == "deleteWebhook":
+            self.webhook = {}
+            result = True
+        elif method == "getWebhookInfo":
+            result = {"url": self.webhook.get("url", ""), "has_custom_certificate": False,
+                      "pending_update_count": len(self._updates)}
+        elif method == "sendMessage":
+            self.stats.sent_messages += 1
+            result = self._message(params["chat_id"], params.get("text", ""))
+        elif method == "editMessageText":
+            self.stats.edited_messages += 1
+            result = self._message(params.get("chat_id", 1), params.get("text", ""), params.get("message_id"))
+        else:
+            result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+    def _flooded(self, chat_id: Any) -> bool:
+        """Превышен ли лимит отправок за последнюю секунду (как flood control Telegram)"""
+        now = time.monotonic()
+        limits = ((None, self.global_limit), (chat_id, self.chat_limit))
+        for key, limit in limits:
+            if limit is None:
+                continue
+            times = self._sent_times.setdefault(key, deque())
+            while times and now - times[0] > 1.0:
+                times.popleft()
+            if len(times) >= limit:
+                return True
+        for key, limit in limits:
+            if limit is not None:
+                self._sent_times[key].append(now)
+        return False
+
+    async def _get_updates(self, params: Dict) -> List[Dict]:
+        """getUpdates с long polling: ждём апдейты до timeout секунд"""
+        self.stats.get_updates += 1
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        # Подтверждённые (update_id < offset) больше не отдаём
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            if self._new_updates is None:
+                self._new_updates = asyncio.Event()
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        batch = self._updates[:limit]
+        self.stats.delivered_updates += len(batch)
+        return batch
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats.__dict__)
+
+    async def handle_inject(self, request: web.Request) -> web.Response:
+        """Подложить сообщение извне: {"chat_id": 1, "text": "/start"}"""
+        params = await request.json()
+        update = self.make_message_update(int(params["chat_id"]), params["text"])
+        self.inject(update)
+        return web.json_response(update)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--chat-limit", type=int, help="отправок в секунду в один чат до ответа 429")
+    parser.add_argument("--global-limit", type=int, help="отправок в секунду всего до ответа 429")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeTelegramServer(args.chat_limit, args.global_limit)
+    print(f"🧪 Фейковый Telegram Bot API: http://{args.host}:{args.port}/bot")
+    web.run_app(server.build_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Заранее собранные клавиатуры и тексты сообщений
+
+Меню /start, /help, /game, карточки персонажа и кнопки под ответами ГМ одинаковы
+для всех игроков, поэтому InlineKeyboardMarkup и длинные тексты собираются
+один раз при запуске (объекты Telegram неизменяемы, их можно отдавать всем).
+В тексты подставляется только имя игрока - склейкой заранее разрезанного
+шаблона. Клавиатуры под ответом ГМ с запрошенными бросками кэшируются по набору
+(характеристика, сложность) - если данные бросков целиком в callback_data: кнопка,
+ссылающаяся на ключ хранилища, после его TTL перестала бы работать у всех.
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+
+from bot.callbacks import CallbackRouter
+from deepseek.effects import TRAIT_KEYS
+
+RULES_URL = "https://ru.daggerheart.su/rule"
+
+WELCOME_TEMPLATE = """
+🗡️ Добро пожаловать в Daggerheart Bot, {name}!
+
+Я помогу тебе играть в Daggerheart с ИИ Гейммастером на базе DeepSeek.
+
+🎮 Основные команды:
+/game - Начать новую игру или продолжить
+/character - Информация о персонаже
+/session - Статус игровой сессии
+/roll - Бросить кости
+/help - Подробная помощь
+
+Готов к приключениям? 🎲
+        """
+
+HELP_TEXT = """
+📖 Подробная помощь по Daggerheart Bot
+
+🎮 **Основные команды:**
+/start - Главное меню
+/game - Управление игрой
+/character - Информация о персонаже
+/session - Статус сессии
+/roll [характеристика] - Бросок костей
+
+🎲 **Броски костей:**
+/roll strength - Бросок силы
+/roll agility - Бросок ловкости
+/roll finesse - Бросок точности
+/roll instinct - Бросок интуиции
+/roll presence - Бросок присутствия
+/roll knowledge - Бросок знаний
+
+🎭 **Как играть:**
+1. Создай персонажа в Mini App
+2. Пиши свои действия обычными сообщениями
+3. ИИ Гейммастер отреагирует на твои действия
+4. Используй /roll когда нужны проверки
+5. Следи за Hope и Fear
+
+📚 **Правила:** https://ru.daggerheart.su/rule
+🐛 **Проблемы?** Напиши @support или попробуй /start
+        """
+
+NO_CHARACTER_TEXT = """
+🎮 **Создание персонажа**
+
+У тебя еще нет персонажа! Нажми кнопку ниже, чтобы открыть создание персонажа в Mini App.
+
+В интерфейсе ты сможешь:
+✨ Выбрать класс и происхождение
+🎯 Распределить характеристики
+⚔️ Получить стартовое снаряжение
+🃏 Выбрать способности
+
+После создания персонажа возвращайся сюда!
+            """
+
+ROLL_MENU_TEXT = "🎲 **Выбери характеристику для броска:**"
+
+ROLL_COMMAND_TEXT = (
+    "🎲 **Выбери характеристику для броска:**\n\n"
+    "Или используй: `/roll [характеристика]`\n"
+    "Например: `/roll strength`"
+)
+
+# Запрошенные ГМ броски: (характеристика, сложность) в порядке появления в ответе
+RollRequests = Tuple[Tuple[str, int], ...]
+
+MAX_DIFFICULTY = 30
+
+
+def roll_request(trait: Any, difficulty: Any) -> Optional[Tuple[str, int]]:
+    """
+    Проверенный бросок (характеристика, сложность) - из эффекта ГМ или полей кнопки
+
+    Returns:
+        None, если характеристика неизвестна или сложность не целое число от 1 до MAX_DIFFICULTY
+    """
+    if trait not in TRAIT_KEYS or isinstance(difficulty, (bool, float)):
+        return None
+    try:
+        difficulty = int(difficulty)
+    except (TypeError, ValueError):
+        return None
+    if not 1 <= difficulty <= MAX_DIFFICULTY:
+        return None
+    return trait, difficulty
+
+
+class StaticUI:
+    """Клавиатуры и тексты, собранные при запуске бота"""
+
+    def __init__(self, callbacks: CallbackRouter, webapp_url: str, max_roll_keyboards: int = 256):
+        """
+        Args:
+            callbacks: Маршрутизатор кнопок (обработчики уже зарегистрированы)
+            webapp_url: Адрес Mini App
+            max_roll_keyboards: Сколько разных наборов запрошенных бросков кэшировать
+        """
+        self.callbacks = callbacks
+        webapp = WebAppInfo(url=webapp_url)
+
+        self.start_markup = InlineKeyboardMarkup([
+            [callbacks.button("🎮 Начать игру", "start_game")],
+            [InlineKeyboardButton("🎯 Открыть Mini App", web_app=webapp)],
+            [InlineKeyboardButton("📚 Правила", url=RULES_URL)]
+        ])
+        # Кнопки Mini App в групповых чатах Telegram не принимает
+        self.group_start_markup = InlineKeyboardMarkup([
+            [callbacks.button("🎮 Начать игру", "start_game")],
+            [InlineKeyboardButton("📚 Правила", url=RULES_URL)]
+        ])
+        self.no_character_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🎨 Создать персонажа", web_app=webapp)],
+            [InlineKeyboardButton("📖 Правила создания", url=RULES_URL)]
+        ])
+        self.game_markup = InlineKeyboardMarkup([
+            [callbacks.button("🎲 Бросить кости", "quick_roll")],
+            [callbacks.button("📊 Статус сессии", "session_status")],
+            [InlineKeyboardButton("🎨 Редактировать персонажа", web_app=webapp)]
+        ])
+        self.character_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🎨 Редактировать", web_app=webapp)],
+            [callbacks.button("🎲 Бросить кости", "quick_roll")]
+        ])
+        self.table_markup = InlineKeyboardMarkup([
+            [callbacks.button("➕ Присоединиться", "join_table")],
+            [callbacks.button("🎲 Бросить кости", "quick_roll"),
+             callbacks.button("📊 Статус", "session_status")]
+        ])
+        self.roll_menu_markup = InlineKeyboardMarkup([
+            [callbacks.button("💪 Сила", "roll", "strength"),
+             callbacks.button("🤸 Ловкость", "roll", "agility")],
+            [callbacks.button("🎯 Точность", "roll", "finesse"),
+             callbacks.button("👁️ Интуиция", "roll", "instinct")],
+            [callbacks.button("👑 Присутствие", "roll", "presence"),
+             callbacks.button("📚 Знания", "roll", "knowledge")]
+        ])
+        self._gm_reply_footer = (
+            callbacks.button("🎲 Бросок", "quick_roll"),
+            callbacks.button("📊 Статус", "session_status")
+        )
+        self._cached_gm_reply_markup = lru_cache(maxsize=max_roll_keyboards)(self._build_gm_reply_markup)
+        self.uncached_roll_keyboards = 0
+
+        self._welcome_head, _, self._welcome_tail = WELCOME_TEMPLATE.partition("{name}")
+
+    def welcome_text(self, name: str) -> str:
+        return self._welcome_head + name + self._welcome_tail
+
+    def gm_reply_markup(self, rolls: RollRequests) -> InlineKeyboardMarkup:
+        """Кнопки под ответом ГМ; из кэша, если они не ссылаются на хранилище кнопок"""
+        if all(self.callbacks.fits_inline("gm_roll", trait, difficulty) for trait, difficulty in rolls):
+            return self._cached_gm_reply_markup(rolls)
+        self.uncached_roll_keyboards += 1
+        return self._build_gm_reply_markup(rolls)
+
+    def _build_gm_reply_markup(self, rolls: RollRequests) -> InlineKeyboardMarkup:
+        """Кнопки под ответом ГМ: запрошенные броски и общие действия"""
+        keyboard = [
+            [self.callbacks.button(f"🎲 Бросить {trait} ({difficulty})", "gm_roll", trait, difficulty)]
+            for trait, difficulty in rolls
+        ]
+        keyboard.append(list(self._gm_reply_footer))
+        return InlineKeyboardMarkup(keyboard)
+
+    def get_stats(self) -> Dict:
+        info = self._cached_gm_reply_markup.cache_info()
+        return {"roll_keyboards": info.currsize, "hits": info.hits, "misses": info.misses,
+                "uncached": self.uncached_roll_keyboards}
+
+
+# Бенчмарк: сборка клавиатур и текстов на каждый апдейт против заранее собранных
+if __name__ == "__main__":
+    import time
+    import tracemalloc
+
+    from bot.callbacks import CallbackPayload
+
+    WEBAPP_URL = "https://example.org/app"
+
+    async def noop(update, context, payload: CallbackPayload):
+        pass
+
+    router = CallbackRouter()
+    for prefix in ("start_game", "quick_roll", "session_status", "roll", "gm_roll", "join_table"):
+        router.route(prefix, noop)
+
+    def per_update(name: str, rolls: RollRequests):
+        """Как раньше в обработчиках: всё собирается заново"""
+        welcome = f"""
+🗡️ Добро пожаловать в Daggerheart Bot, {name}!
+""" + WELCOME_TEMPLATE[WELCOME_TEMPLATE.index("!") + 1:]
+        start = InlineKeyboardMarkup([
+            [router.button("🎮 Начать игру", "start_game")],
+            [InlineKeyboardButton("🎯 Открыть Mini App", web_app=WebAppInfo(url=WEBAPP_URL))],
+            [InlineKeyboardButton("📚 Правила", url=RULES_URL)]
+        ])
+        game = InlineKeyboardMarkup([
+            [router.button("🎲 Бросить кости", "quick_roll")],
+            [router.button("📊 Статус сессии", "session_status")],
+            [InlineKeyboardButton("🎨 Редактировать персонажа", web_app=WebAppInfo(url=WEBAPP_URL))]
+        ])
+        keyboard = [[router.button(f"🎲 Бросить {trait} ({difficulty})", "gm_roll", trait, difficulty)]
+                    for trait, difficulty in rolls]
+        keyboard.append([router.button("🎲 Бросок", "quick_roll"), router.button("📊 Статус", "session_status")])
+        return welcome, start, game, InlineKeyboardMarkup(keyboard)
+
+    ui = StaticUI(router, WEBAPP_URL)
+
+    def cached(name: str, rolls: RollRequests):
+        return ui.welcome_text(name), ui.start_markup, ui.game_markup, ui.gm_reply_markup(rolls)
+
+    roll_sets = [(), (("agility", 12),), (("strength", 14),), (("instinct", 10), ("knowledge", 12))]
+
+    def measure(build, updates: int = 20000):
+        started = time.perf_counter()
+        for i in range(updates):
+            build(f"Игрок {i}", roll_sets[i % len(roll_sets)])
+        elapsed = time.perf_counter() - started
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        results = [build(f"Игрок {i}", roll_sets[i % len(roll_sets)]) for i in range(1000)]
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+        del results
+        return elapsed / updates * 1e6, allocated / 1000
+
+    for name, build in (("на каждый апдейт", per_update), ("заранее собранные", cached)):
+        micros, allocated = measure(build)
+        print(f"{name:18}: {micros:6.1f} мкс и {allocated / 1024:5.1f} КБ на апдейт")
+    print("Кэш клавиатур бросков:", ui.get_stats())
@@ -0,0 +1,400 @@
+"""
+Хранение user_data и chat_data бота в SQLite
+
+Реализация BasePersistence для python-telegram-bot, рассчитанная на большую базу
+пользователей:
+
+- при запуске ничего не загружается - данные пользователя или чата читаются из
+  SQLite при первом апдейте от него (refresh_user_data / refresh_chat_data),
+  поэтому время старта не зависит от числа пользователей;
+- недавно активные пользователи остаются в памяти, давно неактивные выгружаются
+  (их данные уже записаны в базу и подгрузятся при следующем апдейте); пока
+  апдейт пользователя или чата обрабатывается (begin_update/end_update, их
+  вызывает bot.updates), его данные не выгружаются - обработчик с долгим ответом
+  ГМ ещё пишет в этот словарь, и Application потом сохранит его целиком;
+- изменения, которые Application передаёт раз в update_interval, пишутся в базу
+  одной транзакцией;
+- персонаж, который сидит в живой игровой сессии, после повторной подгрузки
+  берётся из сессии, а не из базы: урон и лечение идут через сессию, и копия из
+  JSON с ними бы разошлась.
+
+Данные хранятся в JSON (персонаж - через Character.to_json), поэтому их может
+читать и процесс Mini App.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BasePersistence, PersistenceInput
+
+from game.character import Character
+from game.game_session import SessionManager
+
+logger = logging.getLogger(__name__)
+
+# Метка типа для значений, которые не сериализуются в JSON напрямую
+_TYPE_KEY = "__type__"
+
+
+def encode_data(data: Dict) -> str:
+    """user_data/chat_data -> JSON"""
+    def default(value: Any):
+        if isinstance(value, Character):
+            return {_TYPE_KEY: "character", "json": value.to_json(indent=None)}
+        if isinstance(value, (set, frozenset)):
+            return {_TYPE_KEY: "set", "items": list(value)}
+        raise TypeError(f"Не сериализуется в JSON: {type(value).__name__}")
+
+    return json.dumps(data, ensure_ascii=False, default=default)
+
+
+def decode_data(text: str) -> Dict:
+    """JSON -> user_data/chat_data"""
+    def object_hook(value: Dict):
+        kind = value.get(_TYPE_KEY)
+        if kind == "character":
+            return Character.from_json(value["json"])
+        if kind == "set":
+            return set(value["items"])
+        return value
+
+    return json.loads(text, object_hook=object_hook)
+
+
+class _LazyTable:
+    """
+    Данные одного вида (пользователей или чатов): ленивая загрузка, кэш активных
+    и буфер записей
+    """
+
+    def __init__(self, connection: sqlite3.Connection, table: str, max_cached: int, idle_seconds: float,
+                 on_load: Optional[Callable[[int, Dict], None]] = None):
+        self.connection = connection
+        self.table = table
+        self.max_cached = max_cached
+        self.idle_seconds = idle_seconds
+        self.on_load = on_load  # поправить данные, только что прочитанные из базы
+
+        self.connection.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+        # id -> (словарь, которым пользуется Application, время последнего апдейта)
+        self._cached: "OrderedDict[int, Tuple[Dict, float]]" = OrderedDict()
+        # id -> JSON для записи или None для удаления
+        self._pending: Dict[int, Optional[str]] = {}
+        # id -> сколько его апдейтов сейчас обрабатывается
+        self._busy: Dict[int, int] = {}
+
+        self.loads = 0
+        self.cache_hits = 0
+        self.unloaded = 0
+        self.writes = 0
+        self.batches = 0
+
+    def load(self, key: int) -> Optional[Dict]:
+        """Прочитать данные из буфера или базы (без кэширования)"""
+        if key in self._pending:
+            text = self._pending[key]
+        else:
+            row = self.connection.execute(f"SELECT data FROM {self.table} WHERE id = ?", (key,)).fetchone()
+            text = row[0] if row else None
+        return decode_data(text) if text else None
+
+    def refresh(self, key: int, live: Dict):
+        """Подгрузить данные в словарь Application, если их ещё нет в памяти"""
+        now = time.monotonic()
+        if key in self._cached:
+            self._cached[key] = (live, now)
+            self._cached.move_to_end(key)
+            self.cache_hits += 1
+            return
+
+        stored = self.load(key)
+        self.loads += 1
+        if stored and not live:
+            if self.on_load:
+                self.on_load(key, stored)
+            live.update(stored)
+        self._cached[key] = (live, now)
+        self._unload_idle(now)
+
+    def acquire(self, key: int):
+        """Апдейт с этим id начал обрабатываться"""
+        self._busy[key] = self._busy.get(key, 0) + 1
+
+    def release(self, key: int):
+        """Апдейт обработан: время простоя считается с этого момента"""
+        count = self._busy.get(key, 0) - 1
+        if count > 0:
+            self._busy[key] = count
+            return
+        self._busy.pop(key, None)
+        if key in self._cached:
+            live, _ = self._cached[key]
+            self._cached[key] = (live, time.monotonic())
+            self._cached.move_to_end(key)
+
+    def _unload_idle(self, now: float):
+        """Выгрузить из памяти давно неактивных сверх max_cached"""
+        excess = len(self._cached) - self.max_cached
+        for key, (live, last_active) in list(self._cached.items()):
+            if excess <= 0:
+                break
+            # Недавно активных не трогаем: Application могла ещё не передать их изменения;
+            # дальше по порядку только более свежие
+            if now - last_active < self.idle_seconds:
+                break
+            # Апдейт ещё обрабатывается или изменения не записаны - словарь в работе
+            if key in self._busy or key in self._pending:
+                continue
+            del self._cached[key]
+            # Application держит ссылку на этот словарь - очищаем его, при следующем
+            # апдейте данные снова подгрузятся из базы
+            live.clear()
+            self.unloaded += 1
+            excess -= 1
+
+    def update(self, key: int, data: Dict):
+        self._pending[key] = encode_data(data)
+
+    def drop(self, key: int):
+        self._pending[key] = None
+        self._cached.pop(key, None)
+
+    def write_pending(self):
+        """Записать накопленные изменения одной транзакцией"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        now = time.time()
+        try:
+            with self.connection:
+                self.connection.execute("BEGIN")
+                self.connection.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} (id, data, updated_at) VALUES (?, ?, ?)",
+                    [(key, text, now) for key, text in pending.items() if text is not None]
+                )
+                self.connection.executemany(
+                    f"DELETE FROM {self.table} WHERE id = ?",
+                    [(key,) for key, text in pending.items() if text is None]
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось записать {self.table}: {e}")
+            # Более свежие изменения, пришедшие за это время, важнее
+            pending.update(self._pending)
+            self._pending = pending
+            return
+        self.writes += len(pending)
+        self.batches += 1
+
+    def get_stats(self) -> Dict:
+        return {
+            "cached": len(self._cached),
+            "pending": len(self._pending),
+            "busy": len(self._busy),
+            "loads": self.loads,
+            "cache_hits": self.cache_hits,
+            "unloaded": self.unloaded,
+            "writes": self.writes,
+            "batches": self.batches
+        }
+
+
+class SQLitePersistence(BasePersistence[Dict, Dict, Dict]):
+    """Персистентность бота в SQLite с ленивой загрузкой и пакетной записью"""
+
+    def __init__(self, connection: sqlite3.Connection, update_interval: float = 10,
+                 max_cached_users: int = 5000, max_cached_chats: int = 1000,
+                 sessions: Optional[SessionManager] = None):
+        """
+        Args:
+            connection: Соединение с базой (game.storage.get_connection)
+            update_interval: Как часто Application передаёт изменения, секунды
+            max_cached_users: Сколько пользователей держать в памяти
+            max_cached_chats: Сколько чатов держать в памяти
+            sessions: Живые игровые сессии - их персонажи важнее копий из базы
+        """
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        # Выгружать можно только тех, чьи изменения точно уже переданы
+        idle_seconds = update_interval * 2
+        self.sessions = sessions
+        self.users = _LazyTable(connection, "bot_user_data", max_cached_users, idle_seconds,
+                                on_load=self._bind_seated_character)
+        self.chats = _LazyTable(connection, "bot_chat_data", max_cached_chats, idle_seconds)
+        self._write_scheduled = False
+        self.bound_characters = 0
+
+    def _bind_seated_character(self, user_id: int, data: Dict):
+        """
+        Игрок сидит в живой сессии - в user_data должен попасть тот же объект персонажа
+
+        Пока данные игрока были выгружены, сессия продолжала менять своего персонажа
+        (урон от хода соседа по столу), а в базе осталась прежняя копия.
+        """
+        if self.sessions is None or "character" not in data:
+            return
+        for session in self.sessions.sessions.values():
+            seated = session.characters.get(str(user_id))
+            if seated is not None:
+                data["character"] = seated
+                self.bound_characters += 1
+                return
+
+    def _schedule_write(self):
+        """
+        Application передаёт изменения разных пользователей параллельно - собираем
+        их и пишем одной транзакцией на следующей итерации цикла событий
+        """
+        if self._write_scheduled:
+            return
+        self._write_scheduled = True
+        asyncio.get_running_loop().call_soon(self._write)
+
+    def _write(self):
+        self._write_scheduled = False
+        self.users.write_pending()
+        self.chats.write_pending()
+
+    # Загрузка при старте: ничего не читаем, данные подгружаются по первому апдейту
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        pass
+
+    # Подгрузка перед обработкой апдейта
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        self.users.refresh(user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        self.chats.refresh(chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+    # Изменения от Application
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        self.users.update(user_id, data)
+        self._schedule_write()
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        self.chats.update(chat_id, data)
+        self._schedule_write()
+
+    async def update_bot_data(self, data: Dict) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self.users.drop(user_id)
+        self._schedule_write()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self.chats.drop(chat_id)
+        self._schedule_write()
+
+    # Обработка апдейта (вызывает ChatOrderedUpdateProcessor)
+    def begin_update(self, update: object):
+        """Данные пользователя и чата апдейта в работе - не выгружать"""
+        user_id, chat_id = self._update_keys(update)
+        if user_id is not None:
+            self.users.acquire(user_id)
+        if chat_id is not None:
+            self.chats.acquire(chat_id)
+
+    def end_update(self, update: object):
+        user_id, chat_id = self._update_keys(update)
+        if user_id is not None:
+            self.users.release(user_id)
+        if chat_id is not None:
+            self.chats.release(chat_id)
+
+    @staticmethod
+    def _update_keys(update: object) -> Tuple[Optional[int], Optional[int]]:
+        if not isinstance(update, Update):
+            return None, None
+        user = update.effective_user
+        chat = update.effective_chat
+        return (user.id if user else None), (chat.id if chat else None)
+
+    async def flush(self) -> None:
+        """Записать всё накопленное (при остановке бота)"""
+        self._write()
+
+    def load_user_data(self, user_id: int) -> Optional[Dict]:
+        """Данные пользователя вне обработки апдейтов (админ-команды, Mini App)"""
+        return self.users.load(user_id)
+
+    def get_stats(self) -> Dict:
+        return {"users": self.users.get_stats(), "chats": self.chats.get_stats(),
+                "bound_characters": self.bound_characters}
+
+
+# Бенчмарк: время старта и загрузки по требованию на большой базе
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+
+    from game.character import create_starting_character
+    from game.storage import get_connection
+
+    async def benchmark(users: int = 100000):
+        path = os.path.join(tempfile.mkdtemp(), "persistence.db")
+        persistence = SQLitePersistence(get_connection(path), max_cached_users=1000)
+
+        traits = {"agility": 1, "strength": 2, "finesse": 0, "instinct": 1, "presence": 0, "knowledge": -1}
+        character = create_starting_character("Герой", "0", "guardian", "dwarf", traits)
+        started = time.perf_counter()
+        for user_id in range(users):
+            await persistence.update_user_data(user_id, {"session_id": f"s{user_id}", "character": character})
+        await persistence.flush()
+        print(f"Запись {users} пользователей: {time.perf_counter() - started:.2f} с "
+              f"({persistence.users.batches} транзакций)")
+
+        started = time.perf_counter()
+        restarted = SQLitePersistence(get_connection(path), max_cached_users=1000, update_interval=0)
+        await restarted.get_user_data()
+        print(f"Старт: {(time.perf_counter() - started) * 1000:.2f} мс")
+
+        timings = []
+        for user_id in range(0, users, max(1, users // 2000)):
+            live: Dict = {}
+            started = time.perf_counter()
+            await restarted.refresh_user_data(user_id, live)
+            timings.append(time.perf_counter() - started)
+            assert live["character"].name == "Герой"
+        timings.sort()
+        print(f"Первая загрузка пользователя: p50={timings[len(timings) // 2] * 1000:.3f} мс, "
+              f"p95={timings[int(len(timings) * 0.95)] * 1000:.3f} мс")
+        print("Статистика:", restarted.get_stats())
+
+    asyncio.run(benchmark(*(int(arg) for arg in sys.argv[1:2])))
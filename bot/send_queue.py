@@ -0,0 +1,444 @@
+"""
+Очередь исходящих сообщений бота
+
+Все запросы к Bot API, адресованные чату (sendMessage, editMessageText,
+sendChatAction, ...), проходят через SendQueue - ограничитель частоты для
+python-telegram-bot (BaseRateLimiter):
+
+- лимиты Telegram соблюдаются корзинами токенов: общая (~30 сообщений в
+  секунду) и своя у каждого чата (~1 в секунду, с небольшим запасом на всплеск);
+- в каждый чат одновременно уходит один запрос - сообщения не обгоняют друг
+  друга, а занятый или ограниченный чат не задерживает остальные;
+- ещё не отправленная правка сообщения заменяется более новой правкой того же
+  сообщения (до Telegram доходит только последний текст), повторный индикатор
+  "печатает" склеивается с ожидающим, устаревший - не отправляется;
+- на 429 чат ставится на паузу на retry_after, запрос повторяется;
+- ответы игрокам идут раньше фоновых запросов и рассылок.
+
+Приоритет задаётся аргументом rate_limit_args методов бота:
+bot.send_message(..., rate_limit_args=PRIORITY_BROADCAST).
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Coroutine, Deque, Dict, Hashable, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from deepseek.telemetry import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше - раньше
+PRIORITY_INTERACTIVE = 0  # ответы на действия игроков
+PRIORITY_BACKGROUND = 1  # индикаторы "печатает" и прочее служебное
+PRIORITY_BROADCAST = 2  # рассылки
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BACKGROUND: "background",
+    PRIORITY_BROADCAST: "broadcast"
+}
+
+# Запросы, которые можно склеить с ожидающим запросом того же вида
+COALESCED_ENDPOINTS = {"editMessageText", "editMessageCaption", "editMessageReplyMarkup", "sendChatAction"}
+
+# Индикатор действия живёт в клиенте 5 секунд - старше нет смысла отправлять
+CHAT_ACTION_TTL = 5.0
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше burst про запас"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд будет токен (0 - есть сейчас)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    @property
+    def full(self) -> bool:
+        return self.wait_time(time.monotonic()) == 0 and self.tokens >= self.burst
+
+
+@dataclass
+class SendJob:
+    """Запрос к Bot API, ожидающий отправки"""
+    callback: Callable[..., Coroutine[Any, Any, Any]]
+    args: Any
+    kwargs: Dict[str, Any]
+    endpoint: str
+    priority: int
+    seq: int
+    enqueued: float
+    future: asyncio.Future
+    coalesce_key: Optional[Hashable] = None
+    retries: int = 0
+
+
+@dataclass
+class ChatSendState:
+    """Очередь и лимит одного чата"""
+    bucket: TokenBucket
+    queue: Deque[SendJob] = field(default_factory=deque)
+    busy: bool = False  # запрос в этот чат уже отправляется
+    paused_until: float = 0.0  # после 429
+
+    @property
+    def idle(self) -> bool:
+        return not self.queue and not self.busy and self.bucket.full
+
+
+class SendQueue(BaseRateLimiter[int]):
+    """Ограничитель частоты исходящих запросов с приоритетами и склейкой правок"""
+
+    def __init__(self, global_rate: float = 25, global_burst: float = 5,
+                 group_rate: float = 1.0, group_burst: float = 2,
+                 private_rate: float = 1.0, private_burst: float = 2,
+                 max_retries: int = 3, max_tracked_chats: int = 1000):
+        """
+        За любую секунду корзина пропускает до rate + burst запросов - эта сумма
+        не должна превышать лимит Telegram.
+
+        Args:
+            global_rate: Запросов в секунду во все чаты
+            global_burst: Запас общей корзины
+            group_rate: Запросов в секунду в один групповой чат
+            group_burst: Запас корзины группового чата
+            private_rate: Запросов в секунду в один личный чат
+            private_burst: Запас корзины личного чата
+            max_retries: Сколько раз повторять запрос после 429
+            max_tracked_chats: Сколько неактивных чатов держать в памяти
+        """
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.group_limit = (group_rate, group_burst)
+        self.private_limit = (private_rate, private_burst)
+        self.max_retries = max_retries
+        self.max_tracked_chats = max_tracked_chats
+
+        self._chats: "OrderedDict[Union[int, str], ChatSendState]" = OrderedDict()
+        self._pending_chats: set = set()  # чаты с непустой очередью
+        self._queued: Dict[Hashable, SendJob] = {}  # ключ склейки -> ожидающий запрос
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        self.sent: Dict[str, int] = {}
+        self.merged: Dict[str, int] = {}
+        self.dropped = 0  # устаревшие индикаторы действия
+        self.retried = 0  # ответы 429
+        self.failed = 0
+        self.latency: Dict[str, Histogram] = {}  # от постановки в очередь до ответа Telegram
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for chat in self._chats.values():
+            for job in chat.queue:
+                if not job.future.done():
+                    job.future.cancel()
+            chat.queue.clear()
+        self._pending_chats.clear()
+        self._queued.clear()
+
+    @staticmethod
+    def _coalesce_key(endpoint: str, chat_id: Union[int, str], data: Dict[str, Any]) -> Optional[Hashable]:
+        if endpoint not in COALESCED_ENDPOINTS:
+            return None
+        if endpoint == "sendChatAction":
+            return endpoint, chat_id, data.get("action")
+        return endpoint, chat_id, data.get("message_id")
+
+    def _chat(self, chat_id: Union[int, str]) -> ChatSendState:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            # Отрицательные id и @username - группы и каналы
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            chat = self._chats[chat_id] = ChatSendState(TokenBucket(*(self.group_limit if is_group
+                                                                       else self.private_limit)))
+            while len(self._chats) > self.max_tracked_chats:
+                oldest_id, oldest = next(iter(self._chats.items()))
+                if not oldest.idle:
+                    break
+                del self._chats[oldest_id]
+        self._chats.move_to_end(chat_id)
+        return chat
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            # Запросы не к чату (getUpdates, answerCallbackQuery, ...) не ограничиваем
+            return await callback(*args, **kwargs)
+
+        key = self._coalesce_key(endpoint, chat_id, data)
+        queued = self._queued.get(key) if key else None
+        if queued:
+            # Ожидающий запрос ещё не ушёл - отправим вместо него новый
+            queued.callback, queued.args, queued.kwargs = callback, args, kwargs
+            self.merged[endpoint] = self.merged.get(endpoint, 0) + 1
+            return await asyncio.shield(queued.future)
+
+        if rate_limit_args is not None:
+            priority = rate_limit_args
+        elif endpoint == "sendChatAction":
+            priority = PRIORITY_BACKGROUND
+        else:
+            priority = PRIORITY_INTERACTIVE
+
+        job = SendJob(callback, args, kwargs, endpoint, priority, next(self._seq), time.monotonic(),
+                      asyncio.get_running_loop().create_future(), key)
+        self._enqueue(chat_id, job)
+        # shield: отмена одного из склеенных вызовов не отменяет отправку для остальных
+        return await asyncio.shield(job.future)
+
+    def _enqueue(self, chat_id: Union[int, str], job: SendJob, first: bool = False):
+        chat = self._chat(chat_id)
+        if first:
+            chat.queue.appendleft(job)
+        else:
+            chat.queue.append(job)
+        if job.coalesce_key:
+            self._queued[job.coalesce_key] = job
+        self._pending_chats.add(chat_id)
+
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        self._wakeup.set()
+
+    def _pick(self, now: float) -> Tuple[Optional[Union[int, str]], Optional[float]]:
+        """
+        Чат, чей запрос отправить сейчас: из готовых к отправке - с самым
+        приоритетным и давним первым запросом. Иначе - сколько ждать
+        (None - до следующего события).
+        """
+        global_wait = self.global_bucket.wait_time(now)
+        if global_wait:
+            return None, global_wait
+
+        best_id, best_rank, wait = None, None, None
+        for chat_id in self._pending_chats:
+            chat = self._chats[chat_id]
+            if chat.busy:
+                continue
+            chat_wait = max(chat.paused_until - now, chat.bucket.wait_time(now))
+            if chat_wait > 0:
+                wait = chat_wait if wait is None else min(wait, chat_wait)
+                continue
+            head = chat.queue[0]
+            rank = (head.priority, head.seq)
+            if best_rank is None or rank < best_rank:
+                best_id, best_rank = chat_id, rank
+        return best_id, wait
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            chat_id, wait = self._pick(now)
+            if chat_id is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            chat = self._chats[chat_id]
+            job = chat.queue.popleft()
+            if not chat.queue:
+                self._pending_chats.discard(chat_id)
+            if job.coalesce_key:
+                self._queued.pop(job.coalesce_key, None)
+
+            if job.endpoint == "sendChatAction" and now - job.enqueued > CHAT_ACTION_TTL:
+                # Индикатор уже погас бы - не тратим на него лимит
+                self.dropped += 1
+                if not job.future.done():
+                    job.future.set_result(True)
+                continue
+
+            self.global_bucket.take(now)
+            chat.bucket.take(now)
+            chat.busy = True
+            asyncio.ensure_future(self._send(chat_id, chat, job))
+
+    async def _send(self, chat_id: Union[int, str], chat: ChatSendState, job: SendJob):
+        try:
+            result = await job.callback(*job.args, **job.kwargs)
+        except RetryAfter as e:
+            self.retried += 1
+            chat.paused_until = time.monotonic() + float(e.retry_after)
+            logger.warning(f"429 для чата {chat_id}: пауза {e.retry_after} с")
+            if job.retries < self.max_retries:
+                job.retries += 1
+                # Поверх более новой правки того же сообщения не ставим
+                newer = self._queued.get(job.coalesce_key) if job.coalesce_key else None
+                if newer:
+                    newer.future.add_done_callback(lambda f, job=job: self._resolve_like(job, f))
+                else:
+                    self._enqueue(chat_id, job, first=True)
+            else:
+                self._fail(job, e)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            name = PRIORITY_NAMES.get(job.priority, str(job.priority))
+            self.latency.setdefault(name, Histogram()).observe(time.monotonic() - job.enqueued)
+            self.sent[job.endpoint] = self.sent.get(job.endpoint, 0) + 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            chat.busy = False
+            if self._wakeup:
+                self._wakeup.set()
+
+    @staticmethod
+    def _resolve_like(job: SendJob, source: asyncio.Future):
+        """Завершить заменённую правку так же, как заменившую её"""
+        if job.future.done():
+            return
+        if source.cancelled():
+            job.future.cancel()
+        elif source.exception():
+            job.future.set_exception(source.exception())
+        else:
+            job.future.set_result(source.result())
+
+    def _fail(self, job: SendJob, error: BaseException):
+        self.failed += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def get_stats(self) -> Dict:
+        return {
+            "queued": sum(len(chat.queue) for chat in self._chats.values()),
+            "pending_chats": len(self._pending_chats),
+            "sent": dict(self.sent),
+            "merged": dict(self.merged),
+            "dropped": self.dropped,
+            "retried": self.retried,
+            "failed": self.failed,
+            "latency": {name: histogram.to_dict() for name, histogram in self.latency.items()}
+        }
+
+    def render_text(self) -> str:
+        """Короткая сводка для админ-команды"""
+        stats = self.get_stats()
+        lines = [
+            f"📤 Отправка: {sum(stats['sent'].values())} запр., в очереди {stats['queued']} "
+            f"({stats['pending_chats']} чатов), склеено {sum(stats['merged'].values())}, "
+            f"отброшено {stats['dropped']}, 429: {stats['retried']}, ошибок {stats['failed']}"
+        ]
+        for name, latency in stats["latency"].items():
+            lines.append(f"  {name}: p50={latency['p50']}с p95={latency['p95']}с")
+        return "\n".join(lines)
+
+
+# Бенчмарк: несколько столов в группах, правки "стримингом" и рассылка - без очереди и с ней
+if __name__ == "__main__":
+    from telegram import Bot
+    from telegram.error import TelegramError
+    from telegram.ext import ExtBot
+
+    from bot.fake_telegram import FakeTelegramServer
+
+    TOKEN = "123456:benchmark"
+
+    async def table_load(bot: Bot, chat_id: int, players: int, edits: int, broadcast_to: List[int],
+                         priority_args: Dict) -> Dict:
+        errors = 0
+        latencies = []
+
+        async def timed(coroutine):
+            nonlocal errors
+            started = time.perf_counter()
+            try:
+                await coroutine
+                latencies.append(time.perf_counter() - started)
+            except TelegramError:
+                errors += 1
+
+        async def player(index: int):
+            await timed(bot.send_chat_action(chat_id, "typing"))
+            message = await bot.send_message(chat_id, f"ГМ думает над действием игрока {index}...")
+            # Ответ ГМ приходит по частям быстрее, чем чат разрешает правки
+            parts = []
+            for step in range(edits):
+                parts.append(asyncio.ensure_future(timed(
+                    bot.edit_message_text(f"Ответ ГМ, часть {step + 1}", chat_id, message.message_id)
+                )))
+                await asyncio.sleep(0.05)
+            await asyncio.gather(*parts)
+
+        async def broadcast():
+            await asyncio.gather(*(timed(bot.send_message(user_id, "📣 Новое приключение!", **priority_args))
+                                   for user_id in broadcast_to))
+
+        results = await asyncio.gather(*(player(i) for i in range(players)), broadcast(),
+                                       return_exceptions=True)
+        errors += sum(1 for result in results if isinstance(result, Exception))
+        latencies.sort()
+        return {"errors": errors, "p50": latencies[len(latencies) // 2] if latencies else None}
+
+    async def run(limited: bool):
+        fake = FakeTelegramServer(chat_limit=3, global_limit=30)
+        base_url = await fake.start(port=0)
+        queue = SendQueue() if limited else None
+        bot = ExtBot(TOKEN, base_url=f"{base_url}/bot", rate_limiter=queue)
+        priority_args = {"rate_limit_args": PRIORITY_BROADCAST} if limited else {}
+        started = time.perf_counter()
+        async with bot:
+            results = await asyncio.gather(*(
+                table_load(bot, -100 - table, players=4, edits=10,
+                           broadcast_to=list(range(1000 + table * 10, 1010 + table * 10)),
+                           priority_args=priority_args)
+                for table in range(4)
+            ))
+        elapsed = time.perf_counter() - started
+        await fake.stop()
+        errors = sum(result["errors"] for result in results)
+        print(f"{'очередь' if limited else 'напрямую':8}: {elapsed:5.1f} с, ошибок у вызывающих {errors}, "
+              f"429 от сервера {fake.stats.flood_errors}, "
+              f"сообщений {fake.stats.sent_messages}, правок {fake.stats.edited_messages}")
+        if queue:
+            print(queue.render_text())
+
+    async def main():
+        await run(limited=False)
+        await run(limited=True)
+
+    asyncio.run(main())
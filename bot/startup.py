@@ -0,0 +1,108 @@
+"""
+Профиль холодного старта
+
+Время считается от импорта этого модуля - run_bot.py импортирует его первым,
+до telegram и ГМ. Компоненты сами отмечают свою готовность (mark) - вместо
+фиксированных пауз тот, кому компонент нужен, ждёт его напрямую (так обработчики
+бота ждут фоновую загрузку ГМ).
+Первый обработанный апдейт отмечает обработчик в группе -3; в этот момент
+сводка пишется в лог, дальше она доступна в /gmstats.
+
+Запуск модуля напрямую - отчёт по времени импорта (python -X importtime):
+    python -m bot.startup [модуль]
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+STARTED = time.perf_counter()
+
+# Этапы запуска в порядке, в котором их обычно проходит бот
+PHASE_NAMES = {
+    "bot_imported": "импорт бота",
+    "bot_created": "бот собран",
+    "bot_ready": "бот инициализирован",
+    "webapp_ready": "Mini App слушает порт",
+    "gm_loaded": "ГМ загружен",
+    "first_update": "первый апдейт"
+}
+
+
+class StartupProfile:
+    """Отметки этапов запуска"""
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self._marks: Dict[str, float] = {}  # этап -> секунды от старта, в порядке отметок
+        self._lock = threading.Lock()  # отметки ставят и поток Mini App, и фоновая загрузка ГМ
+
+    def mark(self, phase: str) -> float:
+        """Отметить этап (повторная отметка ничего не меняет); секунды от старта"""
+        with self._lock:
+            if phase not in self._marks:
+                self._marks[phase] = time.perf_counter() - self.started
+            return self._marks[phase]
+
+    async def on_update(self, update: object, context) -> None:
+        """Обработчик TypeHandler: отметить первый апдейт и записать сводку"""
+        if "first_update" in self._marks:
+            return
+        self.mark("first_update")
+        logger.info(self.render_text())
+
+    def get_stats(self) -> Dict[str, float]:
+        """Этапы в миллисекундах от старта"""
+        with self._lock:
+            return {phase: round(seconds * 1000) for phase, seconds in self._marks.items()}
+
+    def render_text(self) -> str:
+        """Короткая сводка для лога и админ-команды"""
+        stats = self.get_stats()
+        if not stats:
+            return "🚀 Запуск: этапы не отмечены"
+        phases = ", ".join(f"{PHASE_NAMES.get(phase, phase)} {ms} мс"
+                           for phase, ms in sorted(stats.items(), key=lambda item: item[1]))
+        return f"🚀 Запуск: {phases}"
+
+
+startup = StartupProfile(STARTED)
+
+
+# Отчёт: самые дорогие импорты модуля (по умолчанию main) в отдельном процессе
+if __name__ == "__main__":
+    import re
+    import subprocess
+    import sys
+
+    def import_profile(module: str):
+        """(модуль, собственное время, с вложенными) в микросекундах из -X importtime"""
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                capture_output=True, text=True)
+        rows = []
+        for line in result.stderr.splitlines():
+            match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+            if match:
+                rows.append((match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3))))
+        return rows
+
+    def main(module: str = "main", top: int = 12):
+        rows = import_profile(module)
+        if not rows:
+            print(f"Не удалось импортировать {module} (нужны BOT_TOKEN и зависимости)")
+            return
+        total = next((row[2] for row in rows if row[0] == module), sum(row[1] for row in rows))
+        print(f"Импорт {module}: {total / 1000:.0f} мс, модулей {len(rows)}")
+        # Верхний уровень дерева импорта (прямые зависимости) - куда уходит время
+        print("\nПрямые зависимости (с вложенными):")
+        direct = sorted((row for row in rows if row[3] == 3), key=lambda row: row[2], reverse=True)
+        for name, _, cumulative, _ in direct[:top]:
+            print(f"  {cumulative / 1000:7.1f} мс  {name}")
+        print("\nСамые дорогие модули (собственное время):")
+        for name, own, _, _ in sorted(rows, key=lambda row: row[1], reverse=True)[:top]:
+            print(f"  {own / 1000:7.1f} мс  {name}")
+
+    main(*sys.argv[1:2])
@@ -0,0 +1,210 @@
+"""
+Игровые столы в групповых чатах
+
+Групповой чат - один стол: одна игровая сессия на всех игроков, которые сели за
+него кнопкой "Присоединиться". Сцена генерируется один раз на стол, ответ ГМ,
+результат броска и смена хода уходят одним сообщением в чат, а не каждому игроку.
+
+Личное каждому игроку - "твой ход", полученный урон и исцеление - копится и
+отправляется одним сообщением в личку пачкой (склейка из bot.debounce): за ход
+противника игрок получает одно уведомление, а не по сообщению на каждое событие.
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from telegram import Bot, Chat
+from telegram.error import TelegramError
+
+from bot.debounce import MessageDebouncer
+from bot.send_queue import PRIORITY_BACKGROUND
+from game.game_session import GameSession
+
+logger = logging.getLogger(__name__)
+
+TABLE_CHAT_TYPES = frozenset({Chat.GROUP, Chat.SUPERGROUP})
+
+# События сессии, о которых игроку пишут в личку
+PRIVATE_EVENTS = frozenset({"turn_started", "damage_dealt", "healing", "character_dying"})
+
+
+def is_table_chat(chat: Optional[Chat]) -> bool:
+    """Групповой чат - игровой стол"""
+    return chat is not None and chat.type in TABLE_CHAT_TYPES
+
+
+def table_text(session: GameSession) -> str:
+    """Сообщение стола: состав и чей ход"""
+    scene = session.current_scene
+    lines = [f"🎲 **{session.session_name}**", "",
+             f"👥 **Игроки ({len(session.characters)}/{session.max_players}):**"]
+    for player_id, character in session.characters.items():
+        marker = "👑 " if scene and scene.current_turn == player_id else "• "
+        class_name = character.character_class.name_ru if character.character_class else "Неизвестно"
+        lines.append(f"{marker}{character.name} ({class_name}) - "
+                     f"{character.current_hp}/{character.hit_points} ❤️")
+    if not session.characters:
+        lines.append("Пока никого - нажми «Присоединиться»")
+    lines += ["", "*Персонажа создают в личном чате с ботом, за стол садятся кнопкой ниже.*"]
+    return "\n".join(lines)
+
+
+class TableFanout:
+    """Рассылка событий стола: общее - строкой в ответ чату, личное - пачкой игроку"""
+
+    def __init__(self, window: float = 2.0, max_wait: float = 6.0, max_messages: int = 10,
+                 max_tables: int = 1000):
+        """
+        Args:
+            window: Сколько секунд копить личные уведомления игрока
+            max_wait: Сколько секунд максимум копить с первого уведомления
+            max_messages: После стольких уведомлений пачка отправляется сразу
+            max_tables: Сколько столов помнить (вытесняются давно неактивные)
+        """
+        self.notifier = MessageDebouncer(window=window, max_wait=max_wait, max_messages=max_messages)
+        self.max_tables = max_tables
+        # Сессия стола -> сколько событий уже разослано; LRU, как и остальные кэши бота
+        self._cursors: "OrderedDict[str, int]" = OrderedDict()
+
+        self.chat_lines = 0
+        self.notifications = 0
+        self.private_messages = 0
+        self.undelivered = 0
+
+    def track(self, session: GameSession):
+        """Начать следить за событиями стола (с текущего момента)"""
+        self._set_cursor(session.session_id, len(session.events))
+
+    def forget(self, session_id: str):
+        """Стол закрыт (сессии больше нет) - курсор не нужен"""
+        self._cursors.pop(session_id, None)
+
+    def _set_cursor(self, session_id: str, position: int):
+        self._cursors[session_id] = position
+        self._cursors.move_to_end(session_id)
+        while len(self._cursors) > self.max_tables:
+            # Давно молчащий стол: при возвращении он продолжит с текущих событий
+            self._cursors.popitem(last=False)
+
+    def collect(self, session: GameSession, bot: Bot) -> List[str]:
+        """
+        Разобрать события стола с прошлого вызова
+
+        Личные уведомления ставятся в очередь склейки, а строки для общего
+        сообщения (смена хода) возвращаются - их добавляют к ответу в чат.
+        Курсор общий для стола, поэтому событие рассылается один раз, даже
+        если действия игроков обрабатываются одновременно.
+        """
+        start = self._cursors.get(session.session_id, len(session.events))
+        events = session.events[start:]
+        self._set_cursor(session.session_id, start + len(events))
+
+        lines = []
+        for event in events:
+            if event.event_type == "turn_started":
+                lines.append(f"🔄 {event.description}")
+            if event.event_type not in PRIVATE_EVENTS or event.character_id not in session.characters:
+                continue
+            character = session.characters[event.character_id]
+            if event.event_type == "turn_started":
+                text = f"⚔️ Твой ход в «{session.session_name}»!"
+            else:
+                text = f"• {event.description} (❤️ {character.current_hp}/{character.hit_points})"
+            self.notify(bot, int(event.character_id), text)
+        self.chat_lines += len(lines)
+        return lines
+
+    def notify(self, bot: Bot, user_id: int, text: str):
+        """Личное уведомление игроку; уйдёт пачкой с соседними"""
+        self.notifications += 1
+        self.notifier.submit(user_id, text, lambda batch: self._send(bot, user_id, batch))
+
+    async def _send(self, bot: Bot, user_id: int, text: str):
+        try:
+            await bot.send_message(user_id, text, rate_limit_args=PRIORITY_BACKGROUND)
+            self.private_messages += 1
+        except TelegramError as e:
+            # Игрок не начинал личный чат с ботом или заблокировал его - стол это не ломает
+            self.undelivered += 1
+            logger.debug(f"Уведомление игроку {user_id} не доставлено: {e}")
+        except Exception as e:
+            # Сеть или уже закрытый клиент бота: уведомление теряется, остальные пачки - нет
+            self.undelivered += 1
+            logger.warning(f"Уведомление игроку {user_id} не отправлено: {e}")
+
+    async def close(self):
+        """Отправить накопленные уведомления"""
+        await self.notifier.close()
+
+    def get_stats(self) -> Dict:
+        return {
+            "tables": len(self._cursors),
+            "chat_lines": self.chat_lines,
+            "notifications": self.notifications,
+            "private_messages": self.private_messages,
+            "undelivered": self.undelivered,
+            "pending": self.notifier.get_stats()["pending"]
+        }
+
+    def render_text(self) -> str:
+        """Короткая сводка для админ-команды"""
+        stats = self.get_stats()
+        return (f"👥 Столы: {stats['tables']}, смен хода в чатах {stats['chat_lines']}, "
+                f"личных уведомлений {stats['notifications']} в {stats['private_messages']} сообщениях "
+                f"(не доставлено {stats['undelivered']})")
+
+
+# Прогон: сколько личных сообщений экономит склейка уведомлений за бой стола
+if __name__ == "__main__":
+    import asyncio
+    import random
+    import sys
+
+    from game.character import create_starting_character
+    from game.game_session import SceneType
+
+    class CountingBot:
+        """Вместо Bot API: считает отправленные сообщения"""
+
+        def __init__(self):
+            self.sent: Dict[int, int] = {}
+
+        async def send_message(self, chat_id: int, text: str, **kwargs):
+            self.sent[chat_id] = self.sent.get(chat_id, 0) + 1
+
+    async def battle(players: int, rounds: int, window: float, seed: int = 3):
+        rng = random.Random(seed)
+        session = GameSession("table", "-100", "Стол «Бенчмарк»")
+        for player in range(players):
+            hero = create_starting_character(f"Герой {player + 1}", str(player + 1), "warrior", "human",
+                                             {"agility": 2, "strength": 1, "finesse": 1, "instinct": 0,
+                                              "presence": 0, "knowledge": -1})
+            session.add_player(str(player + 1), hero)
+        session.start_session()
+        session.start_scene(SceneType.ACTION, "Засада на мосту", list(session.characters))
+
+        bot = CountingBot()
+        fanout = TableFanout(window=window, max_wait=window * 3)
+        fanout.track(session)
+        chat_messages = 0
+        for _ in range(rounds * players):
+            # Действие текущего игрока: ГМ ранит одного-двух персонажей, ход переходит дальше
+            for target in rng.sample(list(session.characters), rng.choice((1, 2))):
+                session.deal_damage_to_character(target, 1, "гоблин")
+                session.heal_character(target, 1)
+            session.next_turn()
+            fanout.collect(session, bot)
+            chat_messages += 1  # ответ ГМ со сменой хода - одно сообщение в чат
+            await asyncio.sleep(0.01)  # игроки действуют чаще, чем раз в окно склейки
+        await fanout.close()
+        return chat_messages, fanout.get_stats()
+
+    async def main(players: int = 4, rounds: int = 5):
+        print(f"Стол из {players} игроков, {rounds} раундов боя")
+        for window in (0.0, 0.02, 0.1):
+            chat_messages, stats = await battle(players, rounds, window)
+            print(f"окно {window:.2f} с: сообщений в чат {chat_messages}, личных уведомлений "
+                  f"{stats['notifications']} -> сообщений {stats['private_messages']}")
+
+    asyncio.run(main(*(int(arg) for arg in sys.argv[1:3])))
@@ -0,0 +1,284 @@
+"""
+Параллельная обработка апдейтов с сохранением порядка внутри чата
+
+По умолчанию Application обрабатывает апдейты по одному, и 10-секундный ответ ГМ
+одному игроку задерживает /roll всех остальных. ChatOrderedUpdateProcessor
+обрабатывает апдейты разных чатов параллельно (до max_concurrent_updates
+одновременно), а апдейты одного чата - строго по очереди: игровая сессия
+привязана к чату, и два действия игрока не должны обгонять друг друга.
+
+Очереди ограничены: апдейтов "в полёте" (в очередях чатов и в работе) не больше
+max_in_flight, остальные ждут на семафоре базового класса; а чат, в очереди
+которого уже max_chat_queue апдейтов, новые апдейты теряет (флуд одного чата не
+занимает место всех остальных). Потерянное не пропадает молча: нажатие кнопки
+получает всплывающий ответ, а на сообщения чат получает одно "подождите" за
+каждое переполнение очереди.
+"""
+
+import asyncio
+import inspect
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Dict, Hashable, Optional, Protocol
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import BaseUpdateProcessor
+
+from deepseek.telemetry import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Семафор базового класса берётся до do_process_update - с пределом
+# max_concurrent_updates ждущие апдейты занятого чата занимали бы слоты других
+# чатов. Поэтому он ограничивает только число апдейтов "в полёте" (по умолчанию
+# столько-то слотов на каждый), а предел параллельности - свой семафор, который
+# берётся уже после очереди чата.
+IN_FLIGHT_PER_SLOT = 8
+
+# Ответ на апдейт, не поместившийся в очередь чата
+SHED_TEXT = "⏳ Слишком много сообщений - подождите, пока ГМ ответит на предыдущие"
+
+
+class UpdateTracker(Protocol):
+    """Кому важно знать, какие апдейты сейчас в работе (например, SQLitePersistence)"""
+
+    def begin_update(self, update: object) -> None: ...
+
+    def end_update(self, update: object) -> None: ...
+
+
+@dataclass
+class ChatQueue:
+    """Очередь апдейтов одного чата"""
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    waiting: int = 0  # апдейты, ждущие окончания предыдущего
+    max_waiting: int = 0
+    processed: int = 0
+    max_wait: float = 0.0  # самое долгое ожидание своей очереди, секунды
+    last_active: float = 0.0
+    shed_notified: bool = False  # о переполнении уже написали в чат
+
+    @property
+    def idle(self) -> bool:
+        return not self.waiting and not self.lock.locked()
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Апдейты разных чатов - параллельно, одного чата - по порядку"""
+
+    def __init__(self, max_concurrent_updates: int = 64, max_tracked_chats: int = 1000,
+                 tracker: Optional[UpdateTracker] = None, max_in_flight: Optional[int] = None,
+                 max_chat_queue: int = 32):
+        """
+        Args:
+            max_concurrent_updates: Сколько апдейтов обрабатывается одновременно
+            max_tracked_chats: Для скольких неактивных чатов хранить метрики очереди
+            tracker: Получает начало и конец обработки каждого апдейта
+            max_in_flight: Сколько апдейтов одновременно в очередях чатов и в работе
+                (по умолчанию IN_FLIGHT_PER_SLOT * max_concurrent_updates)
+            max_chat_queue: Сколько апдейтов может ждать в очереди одного чата; сверх - теряются
+        """
+        self._slots_limit = max_concurrent_updates
+        super().__init__(max_concurrent_updates)
+        self.max_in_flight = max_in_flight or IN_FLIGHT_PER_SLOT * max_concurrent_updates
+        self._semaphore = asyncio.BoundedSemaphore(self.max_in_flight)
+        self.max_chat_queue = max_chat_queue
+        self.max_tracked_chats = max_tracked_chats
+        self.tracker = tracker
+        self._slots: Optional[asyncio.Semaphore] = None  # создаётся в цикле событий (initialize)
+        self._chats: "OrderedDict[Hashable, ChatQueue]" = OrderedDict()
+
+        self.active = 0
+        self.max_active = 0
+        self.processed = 0
+        self.unordered = 0  # апдейты без чата и пользователя
+        self.shed = 0  # потеряны из-за переполненной очереди чата
+        self.chat_wait = Histogram()  # ожидание предыдущих апдейтов своего чата
+        self.slot_wait = Histogram()  # ожидание свободного слота
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return self._slots_limit
+
+    async def initialize(self) -> None:
+        self._slots = asyncio.Semaphore(self._slots_limit)
+
+    async def shutdown(self) -> None:
+        pass
+
+    @staticmethod
+    def chat_key(update: object) -> Optional[Hashable]:
+        """Ключ очереди: чат апдейта, иначе пользователь; None - порядок не важен"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return ("user", update.effective_user.id)
+        return None
+
+    def _chat(self, key: Hashable) -> ChatQueue:
+        chat = self._chats.get(key)
+        if chat is None:
+            chat = self._chats[key] = ChatQueue()
+            # Забываем давно неактивные чаты; чаты с очередью не трогаем
+            while len(self._chats) > self.max_tracked_chats:
+                oldest_key, oldest = next(iter(self._chats.items()))
+                if not oldest.idle:
+                    break
+                del self._chats[oldest_key]
+        self._chats.move_to_end(key)
+        return chat
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        if self._slots is None:
+            await self.initialize()
+
+        if self.tracker is None:
+            await self._process(update, coroutine)
+            return
+        self.tracker.begin_update(update)
+        try:
+            await self._process(update, coroutine)
+        finally:
+            self.tracker.end_update(update)
+
+    async def _process(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        key = self.chat_key(update)
+        if key is None:
+            self.unordered += 1
+            await self._run(coroutine)
+            return
+
+        chat = self._chat(key)
+        if chat.waiting >= self.max_chat_queue:
+            self.shed += 1
+            logger.warning(f"Очередь чата {key} переполнена ({chat.waiting}), апдейт пропущен")
+            if inspect.iscoroutine(coroutine):
+                coroutine.close()  # не выполнялась и не будет
+            await self._notify_shed(update, chat)
+            return
+        chat.waiting += 1
+        chat.max_waiting = max(chat.max_waiting, chat.waiting)
+        arrived = time.monotonic()
+        # asyncio.Lock отдаётся ждущим в порядке очереди - порядок апдейтов чата сохраняется
+        async with chat.lock:
+            chat.waiting -= 1
+            if chat.waiting < self.max_chat_queue:
+                chat.shed_notified = False
+            waited = time.monotonic() - arrived
+            chat.max_wait = max(chat.max_wait, waited)
+            self.chat_wait.observe(waited)
+            try:
+                await self._run(coroutine)
+            finally:
+                chat.processed += 1
+                chat.last_active = time.monotonic()
+
+    async def _notify_shed(self, update: Update, chat: ChatQueue):
+        """Сказать игроку, что апдейт не обработан: кнопке - ответ, чату - одно сообщение за переполнение"""
+        try:
+            if update.callback_query:
+                await update.callback_query.answer(SHED_TEXT)
+            elif update.effective_message and not chat.shed_notified:
+                chat.shed_notified = True
+                await update.effective_message.reply_text(SHED_TEXT)
+        except TelegramError as e:
+            logger.debug(f"Не удалось сообщить о пропущенном апдейте {update.update_id}: {e}")
+
+    async def _run(self, coroutine: "Awaitable[Any]"):
+        started = time.monotonic()
+        async with self._slots:
+            self.slot_wait.observe(time.monotonic() - started)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            try:
+                await coroutine
+            finally:
+                self.active -= 1
+                self.processed += 1
+
+    def get_stats(self, top: int = 5) -> Dict:
+        """Общая загрузка и чаты с самыми длинными очередями"""
+        busiest = sorted(self._chats.items(), key=lambda item: (item[1].waiting, item[1].max_waiting),
+                         reverse=True)[:top]
+        return {
+            "max_concurrent_updates": self._slots_limit,
+            "max_in_flight": self.max_in_flight,
+            "active": self.active,
+            "max_active": self.max_active,
+            "processed": self.processed,
+            "unordered": self.unordered,
+            "shed": self.shed,
+            "waiting": sum(chat.waiting for chat in self._chats.values()),
+            "tracked_chats": len(self._chats),
+            "chat_wait": self.chat_wait.to_dict(),
+            "slot_wait": self.slot_wait.to_dict(),
+            "chats": {
+                str(key): {"waiting": chat.waiting, "max_waiting": chat.max_waiting,
+                           "processed": chat.processed, "max_wait": round(chat.max_wait, 3)}
+                for key, chat in busiest
+            }
+        }
+
+    def render_text(self) -> str:
+        """Короткая сводка для админ-команды"""
+        stats = self.get_stats()
+        lines = [
+            f"📬 Апдейты: {stats['active']}/{stats['max_concurrent_updates']} в работе "
+            f"(максимум {stats['max_active']}), ждут {stats['waiting']}, обработано {stats['processed']}, "
+            f"потеряно {stats['shed']}",
+            f"  ожидание в чате p95={stats['chat_wait']['p95']}с, слота p95={stats['slot_wait']['p95']}с"
+        ]
+        for key, chat in stats["chats"].items():
+            if chat["max_waiting"]:
+                lines.append(f"  чат {key}: ждут {chat['waiting']} (максимум {chat['max_waiting']}), "
+                             f"дольше всего {chat['max_wait']}с")
+        return "\n".join(lines)
+
+
+# Бенчмарк: столы с медленным ГМ - последовательная обработка против параллельной
+if __name__ == "__main__":
+    import sys
+
+    from telegram.ext import SimpleUpdateProcessor
+
+    def make_update(update_id: int, chat_id: int) -> Update:
+        return Update.de_json({
+            "update_id": update_id,
+            "message": {"message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "private"},
+                        "from": {"id": chat_id, "is_bot": False, "first_name": "Игрок"}, "text": "действие"}
+        }, None)
+
+    async def benchmark(processor: BaseUpdateProcessor, tables: int, per_table: int, gm_delay: float):
+        handled: Dict[int, list] = {}
+
+        async def handle(update: Update):
+            await asyncio.sleep(gm_delay)  # ответ ГМ
+            handled.setdefault(update.effective_chat.id, []).append(update.update_id)
+
+        updates = [make_update(i, i % tables) for i in range(tables * per_table)]
+        await processor.initialize()
+        started = time.perf_counter()
+        # Как Application: по задаче на апдейт в порядке поступления
+        await asyncio.gather(*(asyncio.ensure_future(processor.process_update(update, handle(update)))
+                               for update in updates))
+        elapsed = time.perf_counter() - started
+        ordered = all(ids == sorted(ids) for ids in handled.values())
+        return elapsed, ordered
+
+    async def main(per_table: int = 5, gm_delay: float = 0.05):
+        print(f"{per_table} апдейтов на стол, ответ ГМ {gm_delay * 1000:.0f} мс")
+        for tables in (1, 4, 16, 64):
+            sequential, _ = await benchmark(SimpleUpdateProcessor(1), tables, per_table, gm_delay)
+            processor = ChatOrderedUpdateProcessor(64)
+            concurrent, ordered = await benchmark(processor, tables, per_table, gm_delay)
+            total = tables * per_table
+            print(f"столов {tables:3}: по одному {total / sequential:6.1f} апд/с, "
+                  f"параллельно {total / concurrent:6.1f} апд/с, порядок в чатах {'✓' if ordered else '✗'}, "
+                  f"ожидание в чате p95={processor.chat_wait.to_dict()['p95']}с")
+
+    asyncio.run(main(*(int(arg) for arg in sys.argv[1:2])))
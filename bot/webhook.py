@@ -0,0 +1,216 @@
+"""
+Приём апдейтов Telegram через вебхук
+
+Вместо long polling Telegram сам присылает апдейты POST-запросами на наш
+HTTP-эндпоинт. Сервер на aiohttp работает в цикле событий бота: проверяет
+секретный токен (заголовок X-Telegram-Bot-Api-Secret-Token), сразу отвечает
+200 и кладёт апдейт в очередь Application - обработка идёт уже после ответа,
+поэтому Telegram не ждёт ГМ. На том же сервере (и порту) отдаётся страница
+Mini App; её API (заглушки) живёт только в webapp_server.
+
+Собственный сервер, а не Application.run_webhook: встроенному вебхуку PTB
+нужен tornado, и на одном порту с ним Mini App не разместить.
+
+Бенчмарк polling против вебхука на фейковом Bot API:
+
+    python -m bot.webhook [число апдейтов]
+"""
+
+import hmac
+import json
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+@dataclass
+class WebhookStats:
+    """Счётчики вебхука"""
+    received: int = 0
+    rejected: int = 0  # неверный секретный токен
+    invalid: int = 0  # тело не разбирается как апдейт
+
+
+class WebhookServer:
+    """HTTP-сервер вебхука (и Mini App) в цикле событий бота"""
+
+    def __init__(self, application: Application, path: str = "/telegram/webhook",
+                 secret_token: str = "", serve_webapp: bool = True):
+        """
+        Args:
+            application: Запущенное (application.start()) приложение бота
+            path: Путь эндпоинта вебхука
+            secret_token: Токен, переданный в setWebhook; пустой - без проверки
+            serve_webapp: Отдавать ли страницу Mini App на этом же сервере
+        """
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.serve_webapp = serve_webapp
+        self.stats = WebhookStats()
+        self._runner: Optional[web.AppRunner] = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/health", self.handle_health)
+        if self.serve_webapp:
+            app.router.add_get("/", self.handle_webapp)
+        return app
+
+    async def start(self, host: str = "0.0.0.0", port: int = 8080) -> web.AppRunner:
+        """Запустить сервер в текущем цикле событий"""
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Вебхук принимает апдейты на http://{host}:{port}{self.path}")
+        return self._runner
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Принять апдейт: проверить токен, положить в очередь и сразу ответить"""
+        if self.secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            self.stats.rejected += 1
+            logger.warning(f"Вебхук: неверный секретный токен от {request.remote}")
+            return web.Response(status=403)
+
+        try:
+            data = await request.json(loads=json.loads)
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            self.stats.invalid += 1
+            logger.warning(f"Вебхук: не удалось разобрать апдейт: {e}")
+            return web.Response(status=400)
+
+        self.stats.received += 1
+        # Обработка - в Application; Telegram получает ответ, не дожидаясь её
+        self.application.update_queue.put_nowait(update)
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "message": "Daggerheart WebApp is running",
+                                  "webhook": self.get_stats()})
+
+    async def handle_webapp(self, request: web.Request) -> web.Response:
+        """Главная страница Mini App"""
+        from webapp_server import WEBAPP_HTML
+        return web.Response(text=WEBAPP_HTML, content_type="text/html")
+
+    def get_stats(self) -> Dict:
+        return {**self.stats.__dict__, "queued": self.application.update_queue.qsize()}
+
+
+# Бенчмарк: задержка апдейт -> обработчик и пропускная способность polling и вебхука
+if __name__ == "__main__":
+    import asyncio
+    import sys
+    import time
+
+    import aiohttp
+    from telegram.ext import TypeHandler
+
+    from bot.fake_telegram import FakeTelegramServer
+
+    TOKEN = "123456:benchmark"
+    SECRET = "benchmark-secret"
+
+    def percentile(values, q):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+    async def benchmark(mode: str, updates: int) -> Dict:
+        fake = FakeTelegramServer()
+        base_url = await fake.start(port=0)
+        builder = Application.builder().token(TOKEN).base_url(f"{base_url}/bot")
+        if mode == "webhook":
+            builder = builder.updater(None)
+        application = builder.build()
+
+        sent: Dict[int, float] = {}
+        latencies = []
+        done = asyncio.Event()
+        expected = 0
+
+        async def on_update(update: Update, context):
+            latencies.append(time.perf_counter() - sent.pop(update.update_id))
+            if len(latencies) >= expected:
+                done.set()
+
+        application.add_handler(TypeHandler(Update, on_update))
+
+        server = WebhookServer(application, secret_token=SECRET, serve_webapp=False)
+        client = aiohttp.ClientSession()
+        webhook_url = ""
+
+        async def send(update: Dict):
+            sent[update["update_id"]] = time.perf_counter()
+            if mode == "polling":
+                fake.inject(update)
+            else:
+                async with client.post(webhook_url, json=update, headers={SECRET_HEADER: SECRET}) as response:
+                    assert response.status == 200
+
+        async def run_phase(count: int, interval: float):
+            """Отправить count апдейтов (interval=0 - залпом) и дождаться обработки"""
+            nonlocal expected
+            latencies.clear()
+            done.clear()
+            expected = count
+            batch = [fake.make_message_update(1000 + i % 50, f"действие {i}") for i in range(count)]
+            started = time.perf_counter()
+            if interval:
+                for update in batch:
+                    await send(update)
+                    await asyncio.sleep(interval)
+            else:
+                semaphore = asyncio.Semaphore(64)
+
+                async def limited(update):
+                    async with semaphore:
+                        await send(update)
+                await asyncio.gather(*(limited(update) for update in batch))
+            await asyncio.wait_for(done.wait(), 60)
+            return time.perf_counter() - started
+
+        async with application:
+            await application.start()
+            if mode == "polling":
+                await application.updater.start_polling(poll_interval=0, timeout=10)
+            else:
+                runner = await server.start(host="127.0.0.1", port=0)
+                webhook_url = f"http://127.0.0.1:{runner.addresses[0][1]}{server.path}"
+
+            await run_phase(min(200, updates), interval=0.005)
+            latency = {"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95)}
+            elapsed = await run_phase(updates, interval=0)
+
+            if mode == "polling":
+                await application.updater.stop()
+            await application.stop()
+        await server.stop()
+        await client.close()
+        await fake.stop()
+        return {"latency": latency, "throughput": updates / elapsed, "get_updates": fake.stats.get_updates}
+
+    async def main(updates: int = 2000):
+        for mode in ("polling", "webhook"):
+            result = await benchmark(mode, updates)
+            print(f"{mode:8} задержка p50={result['latency']['p50']:.2f} мс "
+                  f"p95={result['latency']['p95']:.2f} мс, "
+                  f"{result['throughput']:.0f} апдейтов/с, getUpdates: {result['get_updates']}")
+
+    asyncio.run(main(*(int(arg) for arg in sys.argv[1:2])))
@@ -1,4 +1,5 @@
 import os
+import secrets
 from dotenv import load_dotenv
 
 # Загрузка переменных окружения
@@ -11,7 +12,8 @@ if not BOT_TOKEN:
 
 # DeepSeek API
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+# Можно направить на локальный фейковый сервер: python -m deepseek.fake_server
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
 
 # Веб-приложение
 WEBAPP_URL = os.getenv("WEBAPP_URL", "https://your-replit-url.replit.dev")
@@ -20,6 +22,16 @@ if WEBAPP_URL == "https://your-replit-url.replit.dev":
     print("Добавь правильный URL в Secrets на Replit")
 PORT = int(os.getenv("PORT", 8080))
 
+# Получение апдейтов: "polling" или "webhook" (сервер вебхука на PORT отдаёт и Mini App)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_SETTINGS = {
+    "url": os.getenv("WEBHOOK_URL", WEBAPP_URL),  # публичный адрес сервера, к нему добавляется path
+    "path": "/telegram/webhook",
+    # Без WEBHOOK_SECRET токен генерируется при каждом запуске - setWebhook всё равно вызывается заново
+    "secret_token": os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32),
+    "max_connections": 40  # параллельных запросов от Telegram
+}
+
 # База данных
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///daggerheart.db")
 
@@ -35,6 +47,8 @@ GM_SETTINGS = {
     "model": "deepseek-chat",
     "temperature": 0.7,
     "max_tokens": 1000,
+    # JSON-режим: повествование + типизированный массив эффектов, разбираемый потоково
+    "structured_output": os.getenv("GM_STRUCTURED_OUTPUT", "false").lower() == "true",
     "system_prompt": """
 Ты - Гейммастер в игре Daggerheart. Твоя задача:
 1. Создавать увлекательные приключения
@@ -45,4 +59,167 @@ GM_SETTINGS = {
 
 Помни: ты создаешь историю вместе с игроками!
 """
-}
\ No newline at end of file
+}
+
+# Устойчивость клиента DeepSeek
+GM_RESILIENCE = {
+    "connect_timeout": 5,  # секунды на установку соединения
+    "attempt_timeout": 20,  # дедлайн одной попытки
+    "deadline": 45,  # общий бюджет на все попытки
+    "max_attempts": 3,
+    "retry_base_delay": 0.5,
+    "retry_max_delay": 4.0,
+    "circuit_failure_threshold": 5,
+    "circuit_reset_timeout": 30,
+    "warm_connection_ttl": 10,  # секунды, пока прогретое соединение считается живым (keep-alive 15 с)
+    # Второй запрос, если первый дольше p95 (удваивает расход токенов на медленных запросах)
+    "hedge_requests": os.getenv("GM_HEDGE_REQUESTS", "false").lower() == "true"
+}
+
+# Планировщик запросов к DeepSeek
+GM_SCHEDULER = {
+    "max_concurrency": int(os.getenv("GM_MAX_CONCURRENCY", 8)),  # одновременных запросов
+    "rate_per_second": float(os.getenv("GM_RATE_PER_SECOND", 5)),  # новых запросов в секунду
+    "burst": 10,
+    "max_queue_depth": 50,  # больше - новым действиям отвечаем «ГМ занят»
+    "per_session_quota": 3,  # запросов одной сессии в очереди и в работе
+    "max_expected_wait": 20  # секунды
+}
+
+# История разговоров с ГМ
+GM_HISTORY = {
+    "max_sessions": 500,  # сессий в памяти, остальные вытесняются по LRU
+    "max_messages": 20,  # сообщений на сессию
+    "ttl_seconds": 3600,  # без активности дольше - вытесняется
+    "spill_to_db": True,  # сбрасывать вытесненную историю в DATABASE_URL
+    "spill_ttl_seconds": 7 * 24 * 3600,  # сброшенная история без обращений дольше - удаляется
+    "prune_interval": 3600  # как часто удалять старую историю из базы
+}
+
+# Спекулятивная генерация исходов бросков
+GM_SPECULATION = {
+    "enabled": os.getenv("GM_SPECULATION", "true").lower() == "true",
+    "max_tokens": 250,  # на одно заготовленное описание исхода
+    "token_budget_per_hour": int(os.getenv("GM_SPECULATION_BUDGET", 60000)),
+    "min_probability": 0.05,  # менее вероятные исходы не генерируются заранее
+    "ttl_seconds": 300  # заготовки старше не используются
+}
+
+# Генерация сцен и другие вспомогательные запросы - дешевле основных ответов ГМ
+GM_SCENE_SETTINGS = {
+    "model": os.getenv("GM_SCENE_MODEL", GM_SETTINGS["model"]),
+    "temperature": 0.8,
+    "max_tokens": 300
+}
+
+# Скользящее краткое содержание кампании
+GM_SUMMARY = {
+    "enabled": os.getenv("GM_SUMMARY", "true").lower() == "true",
+    "checkpoint_items": int(os.getenv("GM_SUMMARY_CHECKPOINT", 8)),  # записей между сворачиваниями
+    "history_window": 6,  # сообщений истории, которые идут в промпт как есть
+    "history_block": 6,  # окно истории сдвигается целыми блоками - префикс промпта остаётся в кэше
+    "temperature": 0.3,
+    "max_pending": 64
+}
+
+# Поиск связанных прошлых событий для контекста ГМ
+GM_RETRIEVAL = {
+    "enabled": os.getenv("GM_RETRIEVAL", "true").lower() == "true",
+    "top_k": 3,  # сколько событий добавлять в промпт
+    "budget_ms": 2.0  # бюджет времени на один поиск
+}
+
+# Локальный рассказчик, если ГМ не укладывается в срок
+GM_FALLBACK = {
+    "latency_slo": float(os.getenv("GM_LATENCY_SLO", 3.0)),  # секунды до локального описания
+    "enabled": os.getenv("GM_LOCAL_NARRATOR", "true").lower() == "true"
+}
+
+# Администраторы бота (Telegram ID через запятую) - доступ к служебным командам
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+
+# Цены моделей, долларов за миллион токенов (ориентировочно, сверяйте с прайсом провайдера)
+GM_PRICING = {
+    "deepseek-chat": {"input_cache_hit": 0.07, "input_cache_miss": 0.27, "output": 1.10},
+    "deepseek-reasoner": {"input_cache_hit": 0.14, "input_cache_miss": 0.55, "output": 2.19}
+}
+
+# Телеметрия запросов к ГМ и потолок расходов сессии
+GM_TELEMETRY = {
+    "session_cost_ceiling": float(os.getenv("GM_SESSION_COST_CEILING", 0.5)),  # долларов, 0 - без потолка
+    "economy_model": os.getenv("GM_ECONOMY_MODEL", GM_SCENE_SETTINGS["model"]),
+    "economy_max_tokens": 400,  # предел ответа для сессий сверх потолка
+    "metrics_port": int(os.getenv("METRICS_PORT", 0))  # 0 - эндпоинт /metrics выключен
+}
+
+# Адаптивные параметры генерации: длина ответа по типу сцены, длине действия и загрузке
+GM_POLICY = {
+    "enabled": os.getenv("GM_ADAPTIVE_PARAMS", "true").lower() == "true",
+    "scene_profiles": {
+        "action": {"max_tokens": 350, "temperature": 0.75},  # короткие боевые раунды
+        "social": {"max_tokens": 600, "temperature": 0.8},
+        "exploration": {"max_tokens": 800, "temperature": 0.8},
+        "rest": {"max_tokens": 500, "temperature": 0.7}
+    },
+    "short_action_chars": 40,  # короткое действие - ответ на 20% короче
+    "long_action_chars": 200,  # развёрнутое действие - на 20% длиннее
+    "min_max_tokens": 200,
+    "shrink_from_load": 1.0,  # загрузка планировщика, с которой ответы начинают укорачиваться
+    "shrink_full_load": 3.0,  # загрузка, при которой ответы укорочены до min_load_factor
+    "min_load_factor": 0.5,
+    "overload_model": os.getenv("GM_OVERLOAD_MODEL", ""),  # пусто - модель под нагрузкой не меняется
+    "overload_from_load": 2.0  # с этой загрузки действия идут на overload_model
+}
+
+# Параллельная обработка апдейтов: разные чаты одновременно, один чат - по порядку
+BOT_CONCURRENCY = {
+    "max_concurrent_updates": int(os.getenv("BOT_MAX_CONCURRENT_UPDATES", 64)),
+    "max_tracked_chats": 1000,  # для скольких чатов хранить метрики очереди
+    "max_chat_queue": 32  # апдейтов в очереди одного чата, сверх - теряются (флуд)
+}
+
+# Исходящие запросы к Bot API: лимиты Telegram (за секунду уходит до rate + burst)
+BOT_SEND_QUEUE = {
+    "global_rate": 25,  # запросов в секунду во все чаты (лимит Telegram ~30)
+    "global_burst": 5,
+    "group_rate": 1.0,  # в один групповой чат
+    "group_burst": 2,
+    "private_rate": 1.0,  # в один личный чат
+    "private_burst": 2,
+    "max_retries": 3,  # повторов после 429
+    "max_tracked_chats": 1000
+}
+
+# Кнопки: состояние, не помещающееся в 64 байта callback_data, и отсев повторных нажатий
+BOT_CALLBACKS = {
+    "state_ttl": 86400,  # сколько живёт состояние кнопки, секунды
+    "max_states": 10000,
+    "dedup_window": 3.0  # повторное нажатие той же кнопки в этом окне игнорируется
+}
+
+# Склейка быстрых сообщений игрока в одно действие для ГМ
+BOT_DEBOUNCE = {
+    "window": float(os.getenv("BOT_DEBOUNCE_WINDOW", 1.5)),  # 0 - каждое сообщение отдельно
+    "max_wait": 4.0,  # дольше не копим, даже если игрок продолжает писать
+    "max_messages": 5
+}
+
+# Отсев повторно доставленных апдейтов (после переподключения или повтора вебхука)
+BOT_DEDUP = {
+    "capacity": 4096  # сколько последних update_id помнить
+}
+
+# Столы в групповых чатах: личные уведомления игрокам ("твой ход", урон) пачками
+BOT_TABLES = {
+    "window": 2.0,  # сколько секунд копить уведомления игрока
+    "max_wait": 6.0,
+    "max_messages": 10,
+    "max_tables": 1000  # сколько столов помнить, давно неактивные вытесняются
+}
+
+# Хранение user_data/chat_data бота в DATABASE_URL
+BOT_PERSISTENCE = {
+    "update_interval": 10,  # секунды между пакетными записями
+    "max_cached_users": 5000,  # активных пользователей в памяти
+    "max_cached_chats": 1000
+}
@@ -0,0 +1,262 @@
+"""
+Кэш готовых фрагментов контекста ГМ по сессиям
+
+Состав группы, состояние персонажей с пулами, сцена и недавние события
+рендерятся один раз и пересобираются, только когда меняется соответствующая
+ревизия GameSession (или растёт лог событий). На каждый ход остаётся склеить
+готовые строки.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from game.game_session import GameSession
+
+SCENE_NAMES_RU = {
+    "exploration": "Исследование",
+    "social": "Социальное взаимодействие",
+    "action": "Боевая сцена",
+    "rest": "Отдых"
+}
+
+
+def _class_name(character) -> str:
+    return character.character_class.name_ru if character.character_class else "Неизвестно"
+
+
+def render_party(session: GameSession) -> Tuple[List[Dict], str]:
+    """Неизменные данные персонажей и блок «СОСТАВ ГРУППЫ» - основа кэшируемого префикса"""
+    party = []
+    for char in session.characters.values():
+        party.append({
+            "name": char.name,
+            "class": _class_name(char),
+            "ancestry": char.ancestry.name_ru if char.ancestry else "Неизвестно",
+            "traits": {
+                "agility": char.traits.agility,
+                "strength": char.traits.strength,
+                "finesse": char.traits.finesse,
+                "instinct": char.traits.instinct,
+                "presence": char.traits.presence,
+                "knowledge": char.traits.knowledge
+            }
+        })
+
+    lines = []
+    for char in party:
+        traits = ", ".join(f"{name} {value:+d}" for name, value in char["traits"].items())
+        lines.append(f"- {char['name']} ({char['class']}, {char['ancestry']}): {traits}")
+
+    block = f"""СОСТАВ ГРУППЫ:
+{chr(10).join(lines) if lines else "- пока никого"}"""
+    return party, block
+
+
+def render_status(session: GameSession) -> Tuple[List[Dict], str]:
+    """Хиты персонажей и пулы Hope/Fear"""
+    characters = [{
+        "name": char.name,
+        "class": _class_name(char),
+        "hp": f"{char.current_hp}/{char.hit_points}"
+    } for char in session.characters.values()]
+
+    block = f"""👥 Состояние персонажей:
+{chr(10).join([f"- {char['name']} ({char['class']}) - {char['hp']} хитов" for char in characters])}
+
+🎲 Пулы:
+- Hope: {session.global_hope}
+- Fear: {session.global_fear}"""
+    return characters, block
+
+
+def render_scene(session: GameSession) -> str:
+    """Описание текущей сцены"""
+    if not session.current_scene:
+        return "Исследование"
+    scene = session.current_scene
+    return f"{SCENE_NAMES_RU.get(scene.type.value, 'Неизвестно')}: {scene.description}"
+
+
+@dataclass
+class ContextSnapshot:
+    """Готовые фрагменты контекста одной сессии и ревизии, из которых они собраны"""
+    party: List[Dict] = field(default_factory=list)
+    party_block: str = ""
+    characters: List[Dict] = field(default_factory=list)
+    status_block: str = ""
+    scene: str = ""
+    recent_events: List[str] = field(default_factory=list)
+    events_block: str = ""
+    story_summary: str = ""
+
+    roster_revision: int = -1
+    status_revision: Tuple[int, int, int] = (-1, -1, -1)
+    scene_revision: int = -1
+    events_count: int = -1
+    story_count: int = -1
+
+
+class ContextSnapshotCache:
+    """Снимки контекста по сессиям с вытеснением давно неактивных"""
+
+    def __init__(self, max_sessions: int = 500):
+        self.max_sessions = max_sessions
+        self._snapshots: "OrderedDict[str, ContextSnapshot]" = OrderedDict()
+        self.hits = 0
+        self.rebuilds = 0
+
+    def get(self, session: GameSession) -> ContextSnapshot:
+        """Снимок с актуальными фрагментами (устаревшие пересобираются)"""
+        snapshot = self._snapshots.get(session.session_id)
+        if snapshot is None:
+            snapshot = ContextSnapshot()
+            self._snapshots[session.session_id] = snapshot
+            while len(self._snapshots) > self.max_sessions:
+                self._snapshots.popitem(last=False)
+        self._snapshots.move_to_end(session.session_id)
+
+        rebuilt = False
+        if snapshot.roster_revision != session.roster_revision:
+            snapshot.party, snapshot.party_block = render_party(session)
+            snapshot.roster_revision = session.roster_revision
+            rebuilt = True
+
+        status_revision = (session.roster_revision, session.hp_revision, session.pools_revision)
+        if snapshot.status_revision != status_revision:
+            snapshot.characters, snapshot.status_block = render_status(session)
+            snapshot.status_revision = status_revision
+            rebuilt = True
+
+        if snapshot.scene_revision != session.scene_revision:
+            snapshot.scene = render_scene(session)
+            snapshot.scene_revision = session.scene_revision
+            rebuilt = True
+
+        # Логи только растут, поэтому их длина и есть ревизия
+        if snapshot.events_count != len(session.events):
+            snapshot.recent_events = [event.description for event in session.events[-5:]]
+            snapshot.events_block = "\n".join(f"• {event}" for event in snapshot.recent_events[-3:])
+            snapshot.events_count = len(session.events)
+            rebuilt = True
+
+        if snapshot.story_count != len(session.story_log):
+            snapshot.story_summary = " ".join(session.story_log[-3:]) if session.story_log else "Начало приключения"
+            snapshot.story_count = len(session.story_log)
+            rebuilt = True
+
+        if rebuilt:
+            self.rebuilds += 1
+        else:
+            self.hits += 1
+        return snapshot
+
+    def discard(self, session_id: str):
+        self._snapshots.pop(session_id, None)
+
+    def get_stats(self) -> Dict:
+        total = self.hits + self.rebuilds
+        return {
+            "sessions": len(self._snapshots),
+            "hits": self.hits,
+            "rebuilds": self.rebuilds,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+
+# Микробенчмарк: сессия на 6 игроков с длинным логом событий
+if __name__ == "__main__":
+    import time
+
+    from game.character import create_starting_character
+    from game.game_session import SceneType
+
+    def legacy_render(session: GameSession, player_id: str) -> Tuple[str, str]:
+        """Прежний путь: словари персонажей, словарь сцен и рендер заново на каждый вызов"""
+        all_characters = []
+        party = []
+        for pid, char in session.characters.items():
+            all_characters.append({
+                "name": char.name,
+                "class": char.character_class.name_ru if char.character_class else "Неизвестно",
+                "hp": f"{char.current_hp}/{char.hit_points}",
+                "is_current_player": pid == player_id
+            })
+            party.append({
+                "name": char.name,
+                "class": char.character_class.name_ru if char.character_class else "Неизвестно",
+                "ancestry": char.ancestry.name_ru if char.ancestry else "Неизвестно",
+                "traits": {
+                    "agility": char.traits.agility,
+                    "strength": char.traits.strength,
+                    "finesse": char.traits.finesse,
+                    "instinct": char.traits.instinct,
+                    "presence": char.traits.presence,
+                    "knowledge": char.traits.knowledge
+                }
+            })
+        scene_types = {
+            "exploration": "Исследование",
+            "social": "Социальное взаимодействие",
+            "action": "Боевая сцена",
+            "rest": "Отдых"
+        }
+        scene = f"{scene_types.get(session.current_scene.type.value, 'Неизвестно')}: {session.current_scene.description}"
+        recent_events = [event.description for event in session.events[-5:]]
+        story_summary = " ".join(session.story_log[-3:]) if session.story_log else "Начало приключения"
+
+        lines = []
+        for char in party:
+            traits = ", ".join(f"{name} {value:+d}" for name, value in char["traits"].items())
+            lines.append(f"- {char['name']} ({char['class']}, {char['ancestry']}): {traits}")
+        party_block = f"СОСТАВ ГРУППЫ:\n{chr(10).join(lines)}"
+        message = f"""🎭 Сцена: {scene}
+
+👥 Состояние персонажей:
+{chr(10).join([f"- {char['name']} ({char['class']}) - {char['hp']} хитов" for char in all_characters])}
+
+🎲 Пулы:
+- Hope: {session.global_hope}
+- Fear: {session.global_fear}
+
+📖 Краткая история: {story_summary}
+
+🕐 Недавние события:
+{chr(10).join([f"• {event}" for event in recent_events[-3:]])}"""
+        return party_block, message
+
+    def cached_render(cache: ContextSnapshotCache, session: GameSession) -> Tuple[str, str]:
+        snapshot = cache.get(session)
+        message = (f"🎭 Сцена: {snapshot.scene}\n\n{snapshot.status_block}\n\n"
+                   f"📖 Краткая история: {snapshot.story_summary}\n\n🕐 Недавние события:\n{snapshot.events_block}")
+        return snapshot.party_block, message
+
+    traits = {"agility": 1, "strength": 2, "finesse": 0, "instinct": 1, "presence": 0, "knowledge": -1}
+    classes = ["guardian", "warrior", "ranger", "rogue", "seraph", "sorcerer"]
+    session = GameSession("bench", "gm")
+    for i, class_name in enumerate(classes):
+        session.add_player(f"p{i}", create_starting_character(f"Герой {i}", f"p{i}", class_name, "human", traits))
+    session.start_session()
+    session.start_scene(SceneType.ACTION, "Засада на мосту", list(session.characters))
+    for i in range(20000):
+        session.add_story_event(f"Событие {i}: отряд продвигается дальше")
+
+    iterations = 20000
+    for scenario, mutate in [("без изменений", None),
+                             ("урон каждый ход", lambda n: session.deal_damage_to_character(f"p{n % 6}", 0))]:
+        for name in ("legacy", "snapshot"):
+            cache = ContextSnapshotCache()
+            started = time.perf_counter()
+            for n in range(iterations):
+                if mutate:
+                    mutate(n)
+                if name == "legacy":
+                    legacy_render(session, "p0")
+                else:
+                    cached_render(cache, session)
+            elapsed = time.perf_counter() - started
+            print(f"{scenario:>16} / {name:>8}: {elapsed / iterations * 1e6:7.2f} мкс на вызов")
+
+    cache = ContextSnapshotCache()
+    assert cached_render(cache, session)[0] == legacy_render(session, "p0")[0]
+    print(f"\nСобытий в логе: {len(session.events)}, кэш: {cache.get_stats()}")
@@ -0,0 +1,177 @@
+"""
+Извлечение игровых эффектов из текстовых ответов ГМ
+
+Все шаблоны собраны в одно скомпилированное регулярное выражение с именованными
+альтернативами, поэтому ответ сканируется один раз. Названия характеристик
+(русские в любом падеже или английские) приводятся к ключам CharacterTrait.
+"""
+
+import re
+from typing import Dict, List, Optional
+
+# Ключи характеристик, которые ожидает Character.make_action_roll
+TRAIT_KEYS = ("agility", "strength", "finesse", "instinct", "presence", "knowledge")
+
+# Названия характеристик для игрока
+TRAIT_NAMES_RU = {
+    "strength": "сила", "agility": "ловкость", "finesse": "точность",
+    "instinct": "интуиция", "presence": "присутствие", "knowledge": "знания"
+}
+
+# Основы слов -> ключ характеристики (окончания отбрасываются при поиске)
+TRAIT_STEMS = {
+    "agility": ["agility", "ловкост"],
+    "strength": ["strength"],
+    "finesse": ["finesse", "точност", "изящ"],
+    "instinct": ["instinct", "интуици", "инстинкт"],
+    "presence": ["presence", "присутстви", "харизм", "обаяни"],
+    "knowledge": ["knowledge", "знани", "интеллект"]
+}
+
+# Короткие названия - только точными формами: основа "сил" совпала бы
+# с "сильнее", "сильный", "силуэт"
+TRAIT_FORMS = {
+    "strength": ["сила", "силы", "силе", "силу", "силой", "сил"]
+}
+
+# Индекс псевдонимов: основа -> ключ
+TRAIT_ALIAS_INDEX: Dict[str, str] = {
+    stem: trait for trait, stems in TRAIT_STEMS.items() for stem in stems
+}
+_STEM_LENGTHS = sorted({len(stem) for stem in TRAIT_ALIAS_INDEX}, reverse=True)
+
+# Точные формы проверяются до основ
+TRAIT_FORM_INDEX: Dict[str, str] = {
+    form: trait for trait, forms in TRAIT_FORMS.items() for form in forms
+}
+
+# Слова, с которых начинается каждая альтернатива шаблона ниже
+_TRIGGER_WORDS = ("брось", "сделай", "проверка", "трачу", "использую",
+                  "получает", "наносит", "восстанавливает", "исцеляет", "лечит")
+
+# Единый шаблон для текста в нижнем регистре: имя внешней группы определяет тип
+# эффекта (match.lastgroup). Опережающая проверка первой буквы и граница слова
+# позволяют движку пропускать неподходящие позиции, не перебирая альтернативы.
+EFFECT_PATTERN = re.compile(
+    r"(?<!\w)(?=[" + "".join(sorted({word[0] for word in _TRIGGER_WORDS})) + r"])(?:"
+    r"(?P<roll>брось\s+(?P<roll_trait>\w+)\s+против\s+сложности\s+(?P<roll_difficulty>\d+))"
+    r"|(?P<check>сделай\s+проверку\s+(?P<check_trait>\w+)\s+\((?P<check_difficulty>\d+)\))"
+    r"|(?P<short_check>проверка\s+(?P<short_trait>\w+):\s*(?P<short_difficulty>\d+))"
+    r"|(?P<fear>(?:трачу|использую)\s+(?P<fear_amount>\d+)\s+fear)"
+    r"|(?P<damage>(?:получает|наносит)\s+(?P<damage_amount>\d+)\s+урона)"
+    r"|(?P<heal>(?:восстанавливает|исцеляет|лечит)\s+(?:на\s+)?(?P<heal_amount>\d+)\s+хит)"
+    r")"
+)
+
+# Имена групп с характеристикой и сложностью для каждого вида запроса броска
+_ROLL_GROUPS = {
+    "roll": ("roll_trait", "roll_difficulty"),
+    "check": ("check_trait", "check_difficulty"),
+    "short_check": ("short_trait", "short_difficulty")
+}
+
+
+def resolve_trait(word: str) -> Optional[str]:
+    """Привести название характеристики (рус./англ., любой падеж) к ключу CharacterTrait"""
+    word = word.lower()
+
+    if word in TRAIT_FORM_INDEX:
+        return TRAIT_FORM_INDEX[word]
+    if word in TRAIT_ALIAS_INDEX:
+        return TRAIT_ALIAS_INDEX[word]
+
+    for length in _STEM_LENGTHS:
+        if length <= len(word):
+            trait = TRAIT_ALIAS_INDEX.get(word[:length])
+            if trait:
+                return trait
+    return None
+
+
+def extract_game_effects(text: str) -> List[Dict]:
+    """
+    Найти в ответе ГМ запросы бросков, траты Fear, урон и лечение за один проход
+
+    Returns:
+        Список эффектов в порядке появления в тексте
+    """
+    effects = []
+
+    for match in EFFECT_PATTERN.finditer(text.lower()):
+        kind = match.lastgroup
+
+        if kind in _ROLL_GROUPS:
+            trait_group, difficulty_group = _ROLL_GROUPS[kind]
+            trait = resolve_trait(match.group(trait_group))
+            if not trait:
+                # "Сделай проверку сильнее (14)" - не запрос броска: бросать нечего
+                continue
+            effects.append({
+                "type": "request_roll",
+                "trait": trait,
+                "difficulty": int(match.group(difficulty_group)),
+                "description": f"Требуется проверка: {TRAIT_NAMES_RU[trait]}"
+            })
+
+        elif kind == "fear":
+            amount = int(match.group("fear_amount"))
+            effects.append({
+                "type": "spend_fear",
+                "amount": amount,
+                "description": f"ГМ тратит {amount} Fear"
+            })
+
+        elif kind == "damage":
+            damage = int(match.group("damage_amount"))
+            effects.append({
+                "type": "damage",
+                "amount": damage,
+                "description": f"Урон: {damage}"
+            })
+
+        elif kind == "heal":
+            amount = int(match.group("heal_amount"))
+            effects.append({
+                "type": "heal",
+                "amount": amount,
+                "description": f"Исцеление: {amount}"
+            })
+
+    return effects
+
+
+# Бенчмарк пропускной способности
+if __name__ == "__main__":
+    import time
+
+    from deepseek.samples import RECORDED_GM_REPLIES
+
+    def legacy_extract(text: str) -> List[Dict]:
+        """Прежняя реализация: восемь некомпилированных шаблонов в трёх циклах"""
+        effects = []
+        for pattern in [r"[Бб]рось\s+(\w+)\s+против\s+сложности\s+(\d+)",
+                        r"[Сс]делай\s+проверку\s+(\w+)\s+\((\d+)\)",
+                        r"[Пп]роверка\s+(\w+):\s*(\d+)"]:
+            for trait, difficulty in re.findall(pattern, text, re.IGNORECASE):
+                effects.append({"type": "request_roll", "trait": trait.lower(),
+                                "difficulty": int(difficulty)})
+        for pattern in [r"[Тт]рачу\s+(\d+)\s+Fear", r"[Ии]спользую\s+(\d+)\s+Fear"]:
+            for amount in re.findall(pattern, text):
+                effects.append({"type": "spend_fear", "amount": int(amount)})
+        for pattern in [r"получает\s+(\d+)\s+урона", r"наносит\s+(\d+)\s+урона"]:
+            for damage in re.findall(pattern, text):
+                effects.append({"type": "damage", "amount": int(damage)})
+        return effects
+
+    corpus = RECORDED_GM_REPLIES * 200
+    corpus_bytes = sum(len(reply.encode("utf-8")) for reply in corpus)
+
+    for name, extractor in [("legacy", legacy_extract), ("single-pass", extract_game_effects)]:
+        re.purge()  # сбрасываем кэш шаблонов re перед каждым прогоном
+        start = time.perf_counter()
+        found = sum(len(extractor(reply)) for reply in corpus)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>12}: {len(corpus) / elapsed:10.0f} ответов/с, "
+              f"{corpus_bytes / elapsed / 1e6:6.1f} МБ/с, эффектов: {found}")
+
+    print("\nПример:", extract_game_effects("Брось силу против сложности 14"))
@@ -0,0 +1,265 @@
+"""
+Локальный DeepSeek/OpenAI-совместимый сервер chat/completions для нагрузочных прогонов
+
+Отвечает заготовленными репликами ГМ (с запросами бросков, уроном и т.п.), умеет
+потоковый и обычный режимы, настраиваемые задержки, скорость выдачи токенов и
+долю ошибок. Направьте на него бота: DEEPSEEK_API_URL=http://127.0.0.1:8090/v1/chat/completions
+
+    python -m deepseek.fake_server --port 8090 --latency lognormal:0.8,0.4 --token-rate 60 --error-rate 0.05
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import random
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from deepseek.effects import extract_game_effects
+from deepseek.samples import RECORDED_GM_REPLIES
+
+logger = logging.getLogger(__name__)
+
+
+def parse_latency(spec: str) -> Tuple[str, List[float]]:
+    """
+    Разобрать описание распределения задержки
+
+    Форматы: fixed:0.5, uniform:0.2,1.5, lognormal:<медиана>,<сигма>, exp:<среднее>
+    """
+    name, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    expected = {"fixed": 1, "uniform": 2, "lognormal": 2, "exp": 1}
+    if name not in expected or len(values) != expected[name]:
+        raise ValueError(f"Неверное распределение задержки: {spec}")
+    return name, values
+
+
+def sample_latency(distribution: Tuple[str, List[float]]) -> float:
+    """Случайная задержка в секундах"""
+    name, params = distribution
+    if name == "fixed":
+        return params[0]
+    if name == "uniform":
+        return random.uniform(params[0], params[1])
+    if name == "lognormal":
+        median, sigma = params
+        return random.lognormvariate(0, sigma) * median
+    return random.expovariate(1 / params[0])
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов"""
+    return max(1, len(text) // 4)
+
+
+@dataclass
+class FakeServerConfig:
+    """Поведение фейкового сервера"""
+    latency: Tuple[str, List[float]] = ("fixed", [0.0])  # до первого байта
+    token_rate: float = 0.0  # токенов в секунду, 0 - мгновенно
+    error_rate: float = 0.0  # доля ответов с ошибкой
+    error_statuses: Tuple[int, ...] = (429, 500, 503)
+    hang_rate: float = 0.0  # доля запросов, которые «зависают» на hang_seconds
+    hang_seconds: float = 60.0
+    replies: List[str] = field(default_factory=lambda: list(RECORDED_GM_REPLIES))
+    shuffle: bool = True
+
+
+@dataclass
+class FakeServerStats:
+    """Счётчики сервера"""
+    requests: int = 0
+    streamed: int = 0
+    errors: int = 0
+    hangs: int = 0
+    completion_tokens: int = 0
+
+
+class FakeDeepSeekServer:
+    """Фейковый chat/completions сервер на aiohttp"""
+
+    def __init__(self, config: Optional[FakeServerConfig] = None):
+        self.config = config or FakeServerConfig()
+        self.stats = FakeServerStats()
+        self._replies = itertools.cycle(self.config.replies)
+        # Имитация кэша префикса у провайдера: хэши уже виденных префиксов сообщений
+        self._prefix_cache: "OrderedDict[str, int]" = OrderedDict()
+        self._runner: Optional[web.AppRunner] = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle_completion)
+        app.router.add_post("/chat/completions", self.handle_completion)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8090) -> str:
+        """Запустить сервер в текущем цикле событий; возвращает URL chat/completions"""
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        actual_port = self._runner.addresses[0][1]
+        return f"http://{host}:{actual_port}/v1/chat/completions"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def _next_reply(self) -> str:
+        if self.config.shuffle:
+            return random.choice(self.config.replies)
+        return next(self._replies)
+
+    def _prompt_usage(self, messages: List[Dict]) -> Dict:
+        """Посчитать токены промпта и «попадания» в кэш по самому длинному виденному префиксу"""
+        digest = hashlib.sha256()
+        total = 0
+        cached = 0
+        prefixes = []
+        for message in messages:
+            content = str(message.get("content", ""))
+            digest.update(f"{message.get('role')}:{content}".encode("utf-8"))
+            total += estimate_tokens(content)
+            key = digest.hexdigest()
+            prefixes.append((key, total))
+            if key in self._prefix_cache:
+                cached = total
+
+        for key, tokens in prefixes:
+            self._prefix_cache[key] = tokens
+            self._prefix_cache.move_to_end(key)
+        while len(self._prefix_cache) > 10000:
+            self._prefix_cache.popitem(last=False)
+
+        return {
+            "prompt_tokens": total,
+            "prompt_cache_hit_tokens": cached,
+            "prompt_cache_miss_tokens": total - cached
+        }
+
+    def _render_reply(self, payload: Dict) -> str:
+        reply = self._next_reply()
+        if (payload.get("response_format") or {}).get("type") == "json_object":
+            return json.dumps({"effects": extract_game_effects(reply), "narration": reply},
+                              ensure_ascii=False)
+        return reply
+
+    async def handle_completion(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.stats.requests += 1
+
+        await asyncio.sleep(sample_latency(self.config.latency))
+
+        if random.random() < self.config.hang_rate:
+            self.stats.hangs += 1
+            await asyncio.sleep(self.config.hang_seconds)
+
+        if random.random() < self.config.error_rate:
+            self.stats.errors += 1
+            status = random.choice(self.config.error_statuses)
+            headers = {"Retry-After": "1"} if status == 429 else None
+            return web.json_response({"error": {"message": "injected failure", "code": status}},
+                                     status=status, headers=headers)
+
+        reply = self._render_reply(payload)
+        usage = self._prompt_usage(payload.get("messages", []))
+        usage["completion_tokens"] = estimate_tokens(reply)
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        self.stats.completion_tokens += usage["completion_tokens"]
+
+        if payload.get("stream"):
+            return await self._stream_reply(request, payload, reply, usage)
+
+        if self.config.token_rate:
+            await asyncio.sleep(usage["completion_tokens"] / self.config.token_rate)
+
+        return web.json_response({
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "deepseek-chat"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        })
+
+    async def _stream_reply(self, request: web.Request, payload: Dict, reply: str,
+                            usage: Dict) -> web.StreamResponse:
+        self.stats.streamed += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        # Примерно по токену (4 символа) на событие
+        pieces = [reply[i:i + 4] for i in range(0, len(reply), 4)]
+        delay = 1 / self.config.token_rate if self.config.token_rate else 0
+
+        for piece in pieces:
+            event = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "model": payload.get("model", "deepseek-chat"),
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+            }
+            await response.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if delay:
+                await asyncio.sleep(delay)
+
+        final = {"id": chunk_id, "object": "chat.completion.chunk", "choices": [
+            {"index": 0, "delta": {}, "finish_reason": "stop"}
+        ]}
+        await response.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            await response.write(f"data: {json.dumps({'id': chunk_id, 'choices': [], 'usage': usage})}\n\n"
+                                 .encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats.__dict__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый DeepSeek chat/completions сервер")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", default="fixed:0.3",
+                        help="fixed:S | uniform:A,B | lognormal:MEDIAN,SIGMA | exp:MEAN")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="токенов в секунду (0 - мгновенно)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--replies", help="JSON-файл со списком реплик вместо встроенных")
+    args = parser.parse_args()
+
+    config = FakeServerConfig(
+        latency=parse_latency(args.latency),
+        token_rate=args.token_rate,
+        error_rate=args.error_rate,
+        hang_rate=args.hang_rate
+    )
+    if args.replies:
+        with open(args.replies, encoding="utf-8") as f:
+            config.replies = json.load(f)
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeDeepSeekServer(config)
+    print(f"🧪 Фейковый DeepSeek: http://{args.host}:{args.port}/v1/chat/completions")
+    web.run_app(server.build_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
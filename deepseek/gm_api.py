@@ -5,11 +5,29 @@
 import json
 import logging
 import asyncio
-from typing import Dict, List, Optional, Any
+import time
+from typing import Dict, List, Optional, Any, Tuple, Callable, Awaitable, AsyncIterator
 import aiohttp
-from dataclasses import dataclass
-
-from config import DEEPSEEK_API_KEY, DEEPSEEK_API_URL, GM_SETTINGS
+from dataclasses import dataclass, field
+
+from config import (
+    DEEPSEEK_API_KEY, DEEPSEEK_API_URL, GM_SETTINGS, GM_RESILIENCE, GM_SCHEDULER, GM_HISTORY,
+    GM_SPECULATION, GM_SCENE_SETTINGS, GM_SUMMARY, GM_RETRIEVAL, GM_PRICING, GM_TELEMETRY, GM_POLICY
+)
+from deepseek.effects import TRAIT_KEYS, extract_game_effects
+from deepseek.structured import IncrementalGMParser, STRUCTURED_OUTPUT_INSTRUCTIONS
+from deepseek.resilience import (
+    GMAPIError, CircuitBreaker, ResilientCaller, RetryPolicy
+)
+from deepseek.scheduler import LLMScheduler, Priority
+from deepseek.history import ConversationHistoryStore, HistorySpill
+from deepseek.retrieval import RetrievalIndex
+from deepseek.context_cache import ContextSnapshotCache
+from deepseek.narrator import LocalNarrator
+from deepseek.policy import GenerationParams, GenerationPolicy
+from deepseek.speculation import RollSpeculator, classify_roll, roll_action_text
+from deepseek.summarizer import StorySummarizer, SUMMARY_SYSTEM_PROMPT, format_summary_request
+from deepseek.telemetry import GMTelemetry, classify_outcome, parse_prompt_cache_usage
 from game.game_session import GameSession
 from game.character import Character
 
@@ -27,6 +45,34 @@ class GMContext:
     global_hope: int
     global_fear: int
     player_action: str
+    party: List[Dict] = field(default_factory=list)  # неизменные данные персонажей
+    campaign_summary: str = ""  # краткое содержание всего, что выпало из окна истории
+    related_events: List[str] = field(default_factory=list)  # прошлые события, связанные с действием
+    # Готовые фрагменты из ContextSnapshotCache
+    party_block: str = ""
+    status_block: str = ""
+    events_block: str = ""
+
+
+@dataclass
+class PrefixCacheStats:
+    """Статистика кэша префикса промпта на стороне провайдера"""
+    requests: int = 0
+    cached_tokens: int = 0
+    uncached_tokens: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.cached_tokens + self.uncached_tokens
+        return self.cached_tokens / total if total else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "cached_tokens": self.cached_tokens,
+            "uncached_tokens": self.uncached_tokens,
+            "hit_rate": round(self.hit_rate, 3)
+        }
 
 
 class DaggerheartGM:
@@ -38,15 +84,127 @@ class DaggerheartGM:
         self.model = GM_SETTINGS.get("model", "deepseek-chat")
         self.temperature = GM_SETTINGS.get("temperature", 0.7)
         self.max_tokens = GM_SETTINGS.get("max_tokens", 1000)
+        self.structured_output = GM_SETTINGS.get("structured_output", False)
 
         # Базовый промпт системы
         self.system_prompt = self._build_system_prompt()
 
         # История взаимодействий для поддержания контекста
-        self.conversation_history: Dict[str, List[Dict]] = {}
+        self.conversation_history = ConversationHistoryStore(
+            max_sessions=GM_HISTORY["max_sessions"],
+            max_messages=GM_HISTORY["max_messages"],
+            ttl_seconds=GM_HISTORY["ttl_seconds"],
+            spill=self._create_history_spill(),
+            spill_ttl_seconds=GM_HISTORY["spill_ttl_seconds"],
+            prune_interval=GM_HISTORY["prune_interval"]
+        )
+
+        # Статистика кэша префикса по сессиям
+        self.prefix_cache_stats: Dict[str, PrefixCacheStats] = {}
+
+        # HTTP-клиент переиспользуется между запросами (создаётся в цикле событий)
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        self._closed = False
+        self._warmup_task: Optional[asyncio.Task] = None
+        self._warmed_at = 0.0
+        self.resilience = ResilientCaller(
+            policy=RetryPolicy(
+                max_attempts=GM_RESILIENCE["max_attempts"],
+                base_delay=GM_RESILIENCE["retry_base_delay"],
+                max_delay=GM_RESILIENCE["retry_max_delay"]
+            ),
+            breaker=CircuitBreaker(
+                failure_threshold=GM_RESILIENCE["circuit_failure_threshold"],
+                reset_timeout=GM_RESILIENCE["circuit_reset_timeout"]
+            ),
+            attempt_timeout=GM_RESILIENCE["attempt_timeout"],
+            deadline=GM_RESILIENCE["deadline"],
+            hedge=GM_RESILIENCE["hedge_requests"]
+        )
+
+        # Общая очередь запросов: лимиты параллельности и частоты, справедливость между сессиями
+        self.scheduler = LLMScheduler(**GM_SCHEDULER)
+
+        # Заготовки описаний исходов запрошенных бросков
+        self.speculator = RollSpeculator(
+            max_tokens=GM_SPECULATION["max_tokens"],
+            token_budget_per_hour=GM_SPECULATION["token_budget_per_hour"],
+            min_probability=GM_SPECULATION["min_probability"],
+            ttl_seconds=GM_SPECULATION["ttl_seconds"]
+        ) if GM_SPECULATION["enabled"] else None
+
+        # Краткое содержание кампании вместо всё растущей истории
+        self.history_window = GM_SUMMARY["history_window"]
+        self.history_block = GM_SUMMARY["history_block"]
+        self.summarizer = StorySummarizer(
+            self._summarize,
+            checkpoint_items=GM_SUMMARY["checkpoint_items"],
+            max_pending=GM_SUMMARY["max_pending"],
+            max_sessions=GM_HISTORY["max_sessions"]
+        ) if GM_SUMMARY["enabled"] else None
+
+        # Описание без LLM - когда API не отвечает или не укладывается в срок
+        self.narrator = LocalNarrator()
+
+        # Готовые фрагменты контекста, пересобираются только при изменении сессии
+        self.context_cache = ContextSnapshotCache(max_sessions=GM_HISTORY["max_sessions"])
+
+        # Поиск по всей истории сессии: NPC, места и события, о которых говорит игрок
+        self.retrieval = RetrievalIndex(
+            max_sessions=GM_HISTORY["max_sessions"],
+            limit=GM_RETRIEVAL["top_k"],
+            budget_ms=GM_RETRIEVAL["budget_ms"]
+        ) if GM_RETRIEVAL["enabled"] else None
+
+        # Задержки, токены и расходы по запросам; сессии сверх потолка расходов
+        # переводятся на экономичные настройки
+        self.telemetry = GMTelemetry(
+            GM_PRICING,
+            session_cost_ceiling=GM_TELEMETRY["session_cost_ceiling"],
+            max_sessions=GM_HISTORY["max_sessions"]
+        )
+
+        # Длина ответа и модель по типу сцены, длине действия, загрузке и расходам сессии
+        self.policy = GenerationPolicy(
+            GenerationParams(self.model, self.max_tokens, self.temperature),
+            GM_POLICY["scene_profiles"],
+            self.scheduler,
+            self.telemetry,
+            economy_model=GM_TELEMETRY["economy_model"],
+            economy_max_tokens=GM_TELEMETRY["economy_max_tokens"],
+            short_action_chars=GM_POLICY["short_action_chars"],
+            long_action_chars=GM_POLICY["long_action_chars"],
+            min_max_tokens=GM_POLICY["min_max_tokens"],
+            shrink_from_load=GM_POLICY["shrink_from_load"],
+            shrink_full_load=GM_POLICY["shrink_full_load"],
+            min_load_factor=GM_POLICY["min_load_factor"],
+            overload_model=GM_POLICY["overload_model"],
+            overload_from_load=GM_POLICY["overload_from_load"],
+            enabled=GM_POLICY["enabled"]
+        )
+
+    @staticmethod
+    def _create_history_spill() -> Optional[HistorySpill]:
+        """Хранилище для вытесненной истории, если включено"""
+        if not GM_HISTORY["spill_to_db"]:
+            return None
+
+        from game.storage import get_connection
+        try:
+            return HistorySpill(get_connection())
+        except Exception as e:
+            logger.error(f"Сброс истории в базу недоступен: {e}")
+            return None
 
     def _build_system_prompt(self) -> str:
         """Создать системный промпт для ГМ"""
+        prompt = self._base_system_prompt()
+        if self.structured_output:
+            prompt += STRUCTURED_OUTPUT_INSTRUCTIONS
+        return prompt
+
+    def _base_system_prompt(self) -> str:
+        """Базовый текст системного промпта"""
         return """Ты - опытный Гейммастер в игре Daggerheart, настольной ролевой игре от Critical Role.
 
 ТВОЯ РОЛЬ:
@@ -88,8 +246,9 @@ class DaggerheartGM:
 
 Всегда помни: цель - создать незабываемую историю вместе с игроками!"""
 
-    async def process_player_action(self, session: GameSession, player_id: str,
-                                    action: str) -> Dict[str, Any]:
+    async def process_player_action(self, session: GameSession, player_id: str, action: str,
+                                    on_effect: Optional[Callable[[Dict], Awaitable[None]]] = None
+                                    ) -> Dict[str, Any]:
         """
         Обработать действие игрока и сгенерировать ответ ГМ
 
@@ -97,246 +256,525 @@ class DaggerheartGM:
             session: Игровая сессия
             player_id: ID игрока
             action: Действие игрока
+            on_effect: Вызывается для каждого эффекта; в JSON-режиме - сразу по мере
+                разбора потока, ещё до окончания повествования
 
         Returns:
             Dict с ответом ГМ и возможными игровыми эффектами
         """
         try:
+            if self.speculator:
+                # Игрок сделал что-то другое - заготовленные исходы броска больше не нужны
+                self.speculator.discard(session.session_id)
+
             # Собираем контекст
             context = self._build_context(session, player_id, action)
+            params = self.policy.for_action(session, action)
 
-            # Генерируем ответ ГМ
-            gm_response = await self._generate_gm_response(context)
-
-            # Обрабатываем игровые эффекты
-            effects = self._parse_game_effects(gm_response, session)
+            if self.structured_output:
+                # Эффекты приходят и применяются по ходу потока
+                gm_response, effects = await self._generate_structured_response(
+                    context, session, on_effect, params
+                )
+            else:
+                # Генерируем ответ ГМ
+                gm_response = await self._generate_gm_response(context, params)
 
-            # Сохраняем в историю
-            self._update_conversation_history(session.session_id, action, gm_response)
+                # Обрабатываем игровые эффекты
+                effects = self._parse_game_effects(gm_response, session)
+                if on_effect:
+                    for effect in effects:
+                        await on_effect(effect)
 
-            return {
-                "success": True,
-                "gm_response": gm_response,
-                "effects": effects,
-                "context": {
-                    "hope": session.global_hope,
-                    "fear": session.global_fear,
-                    "scene": context.current_scene
-                }
-            }
+            return self._finish_action(session, player_id, action, context, gm_response, effects)
 
         except Exception as e:
             logger.error(f"Ошибка обработки действия: {e}")
             return {
                 "success": False,
                 "error": str(e),
-                "fallback_response": self._get_fallback_response()
+                "fallback_response": self.narrator.narrate(session, player_id, action)
             }
 
-    def _build_context(self, session: GameSession, player_id: str, action: str) -> GMContext:
-        """Построить контекст для ГМ"""
-        character = session.characters.get(player_id)
-        character_info = {}
-
-        if character:
-            character_info = {
-                "name": character.name,
-                "class": character.character_class.name_ru if character.character_class else "Неизвестно",
-                "ancestry": character.ancestry.name_ru if character.ancestry else "Неизвестно",
-                "hp": f"{character.current_hp}/{character.hit_points}",
-                "traits": {
-                    "agility": character.traits.agility,
-                    "strength": character.traits.strength,
-                    "finesse": character.traits.finesse,
-                    "instinct": character.traits.instinct,
-                    "presence": character.traits.presence,
-                    "knowledge": character.traits.knowledge
-                }
-            }
+    async def narrate_roll_result(self, session: GameSession, player_id: str, trait: str,
+                                  difficulty: int, roll_result: Dict,
+                                  on_effect: Optional[Callable[[Dict], Awaitable[None]]] = None
+                                  ) -> Dict[str, Any]:
+        """
+        Описать результат броска, запрошенного ГМ
 
-        # Информация о всех персонажах в сессии
-        all_characters = []
-        for pid, char in session.characters.items():
-            all_characters.append({
-                "name": char.name,
-                "class": char.character_class.name_ru if char.character_class else "Неизвестно",
-                "hp": f"{char.current_hp}/{char.hit_points}",
-                "is_current_player": pid == player_id
-            })
+        Если исход был сгенерирован заранее, ответ отдаётся без нового запроса к API,
+        иначе бросок обрабатывается как обычное действие игрока.
 
-        # Текущая сцена
-        scene_description = "Исследование"
-        if session.current_scene:
-            scene_types = {
-                "exploration": "Исследование",
-                "social": "Социальное взаимодействие",
-                "action": "Боевая сцена",
-                "rest": "Отдых"
+        Args:
+            roll_result: Результат Character.make_action_roll
+        """
+        outcome = classify_roll(roll_result)
+        action = roll_action_text(trait, difficulty, outcome)
+
+        if self.speculator:
+            raw_reply = await self.speculator.take(session.session_id, player_id, trait, difficulty, outcome)
+            if raw_reply is not None:
+                try:
+                    context = self._build_context(session, player_id, action)
+                    gm_response, effects = await self._accept_reply(raw_reply, session, on_effect)
+                    return self._finish_action(session, player_id, action, context, gm_response, effects)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки заготовленного исхода: {e}")
+
+        return await self.process_player_action(session, player_id, action, on_effect)
+
+    def _finish_action(self, session: GameSession, player_id: str, action: str, context: GMContext,
+                       gm_response: str, effects: List[Dict]) -> Dict[str, Any]:
+        """Сохранить ход в историю, заготовить исходы запрошенного броска и собрать результат"""
+        if not gm_response.strip():
+            # Ответ без описания (оборван или пуст) - игрок всё равно должен увидеть, что произошло
+            gm_response = self.narrator.narrate(session, player_id, action)
+        # Сохраняем в историю
+        self._update_conversation_history(session.session_id, action, gm_response)
+        if self.summarizer:
+            self.summarizer.observe_story(session.session_id, session.story_log)
+
+        if self.speculator:
+            roll = next((effect for effect in effects if effect["type"] == "request_roll"), None)
+            if roll:
+                self._speculate_roll(session, player_id, roll)
+
+        return {
+            "success": True,
+            "gm_response": gm_response,
+            "effects": effects,
+            "context": {
+                "hope": session.global_hope,
+                "fear": session.global_fear,
+                "scene": context.current_scene,
+                "prefix_cache_hit_rate": self.get_prefix_cache_stats(session.session_id)["hit_rate"]
             }
-            scene_description = f"{scene_types.get(session.current_scene.type.value, 'Неизвестно')}: {session.current_scene.description}"
+        }
+
+    def _speculate_roll(self, session: GameSession, player_id: str, roll: Dict):
+        """Начать фоновую генерацию вероятных исходов броска (после записи хода в историю)"""
+        character = session.characters.get(player_id)
+        if not character or roll["trait"] not in TRAIT_KEYS:
+            return
+
+        # Заготовки делаются только на свободной ёмкости: они должны стартовать сразу, а
+        # не стоять в очереди, и половина свободных слотов остаётся действиям игроков
+        limit = self.scheduler.spare_capacity() // 2
+        if limit == 0:
+            self.speculator.stats.skipped_capacity += 1
+            return
+        if self.telemetry.over_ceiling(session.session_id):
+            self.speculator.stats.skipped_budget += 1
+            return
+
+        async def generate(action: str) -> str:
+            # Заготовка подменяет обычный ответ, поэтому и параметры те же, но не длиннее бюджета заготовок
+            context = self._build_context(session, player_id, action)
+            params = self.policy.for_action(session, action, speculative=True)
+            params.max_tokens = min(params.max_tokens, self.speculator.max_tokens)
+            return await self._request_completion(
+                session.session_id, self._build_messages(context), params,
+                priority=Priority.BACKGROUND, json_mode=self.structured_output, kind="speculation"
+            )
+
+        self.speculator.schedule(
+            session.session_id, player_id, roll["trait"],
+            character.traits.get_trait_value(roll["trait"]), roll["difficulty"], generate, limit
+        )
+
+    async def _accept_reply(self, raw_reply: str, session: GameSession,
+                            on_effect: Optional[Callable[[Dict], Awaitable[None]]]) -> Tuple[str, List[Dict]]:
+        """Разобрать полностью полученный ответ ГМ и передать его эффекты в on_effect"""
+        if self.structured_output:
+            parser = IncrementalGMParser()
+            parser.feed(raw_reply)
+            reply = parser.finish()
+            gm_response = reply.narration
+            effects = [effect for effect in reply.effects if self._effect_allowed(effect, session)]
+        else:
+            gm_response = raw_reply
+            effects = self._parse_game_effects(raw_reply, session)
+
+        if on_effect:
+            for effect in effects:
+                await on_effect(effect)
+        return gm_response, effects
 
-        # Недавние события
-        recent_events = [event.description for event in session.events[-5:]]
+    def _build_context(self, session: GameSession, player_id: str, action: str) -> GMContext:
+        """Построить контекст для ГМ из готовых фрагментов снимка сессии"""
+        snapshot = self.context_cache.get(session)
+        character = session.characters.get(player_id)
 
-        # Краткая история сессии
-        story_summary = " ".join(session.story_log[-3:]) if session.story_log else "Начало приключения"
+        # Связанные с действием события из всей истории (кроме уже попавших в промпт)
+        related_events = []
+        if self.retrieval:
+            related_events = self._find_related_events(session, action, snapshot.recent_events)
 
         return GMContext(
             session_id=session.session_id,
-            current_scene=scene_description,
-            active_characters=all_characters,
-            recent_events=recent_events,
-            story_summary=story_summary,
+            current_scene=snapshot.scene,
+            active_characters=snapshot.characters,
+            recent_events=snapshot.recent_events,
+            story_summary=snapshot.story_summary,
             global_hope=session.global_hope,
             global_fear=session.global_fear,
-            player_action=f"{character_info.get('name', 'Игрок')}: {action}"
+            player_action=f"{character.name if character else 'Игрок'}: {action}",
+            party=snapshot.party,
+            campaign_summary=self.summarizer.get(session.session_id) if self.summarizer else "",
+            related_events=related_events,
+            party_block=snapshot.party_block,
+            status_block=snapshot.status_block,
+            events_block=snapshot.events_block
         )
 
-    async def _generate_gm_response(self, context: GMContext) -> str:
+    def _find_related_events(self, session: GameSession, action: str, recent_events: List[str]) -> List[str]:
+        """Доиндексировать новые записи сессии и найти прошлые события по тексту действия"""
+        offset = self.retrieval.events_offset(session.session_id)
+        self.retrieval.sync(session.session_id, session.story_log,
+                            (event.description for event in session.events[offset:]), len(session.events))
+
+        visible = set(recent_events) | set(session.story_log[-3:])
+        visible.update(message["content"] for message in self._prompt_history(session.session_id)
+                       if message["role"] == "assistant")
+        return self.retrieval.search(session.session_id, action, exclude=visible)
+
+    async def _generate_gm_response(self, context: GMContext, params: GenerationParams) -> str:
         """Сгенерировать ответ ГМ через DeepSeek API"""
+        return await self._request_completion(context.session_id, self._build_messages(context), params)
+
+    async def _generate_structured_response(
+            self, context: GMContext, session: GameSession,
+            on_effect: Optional[Callable[[Dict], Awaitable[None]]],
+            params: GenerationParams) -> Tuple[str, List[Dict]]:
+        """Сгенерировать ответ в JSON-режиме, разбирая поток инкрементально"""
+        parser = IncrementalGMParser()
+        effects = []
+
+        async def accept(effect: Dict):
+            if self._effect_allowed(effect, session):
+                effects.append(effect)
+                if on_effect:
+                    await on_effect(effect)
 
-        # Формируем сообщения для API
+        stream = self._stream_completion(
+            context.session_id, self._build_messages(context), params, json_mode=True
+        )
+        try:
+            async for delta in stream:
+                for kind, value in parser.feed(delta):
+                    if kind == "effect":
+                        await accept(value)
+        finally:
+            # Если разбор или on_effect упали, генератор сам не завершится: слот планировщика
+            # и HTTP-ответ освобождаются только при его закрытии
+            await stream.aclose()
+
+        reply = parser.finish()
+        if not reply.structured:
+            # Модель ответила обычным текстом - эффекты найдены текстовым разбором
+            for effect in reply.effects:
+                await accept(effect)
+
+        return reply.narration, effects
+
+    def _build_messages(self, context: GMContext) -> List[Dict]:
+        """Собрать сообщения для API"""
+
+        # Порядок важен для кэша префикса у провайдера: сначала идут части, которые
+        # побайтово совпадают от хода к ходу (системный промпт с правилами и состав
+        # группы), затем история, и только в конце - изменчивая ситуация и действие.
         messages = [
             {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": self._format_context_message(context)}
+            {"role": "system", "content": self._format_party_message(context)}
         ]
 
-        # Добавляем историю разговора если есть
-        if context.session_id in self.conversation_history:
-            history = self.conversation_history[context.session_id][-6:]  # последние 6 сообщений
-            messages.extend(history)
-
-        # Добавляем текущее действие
-        messages.append({"role": "user", "content": context.player_action})
+        # Сводка меняется только на контрольных точках, поэтому тоже почти всегда в кэше
+        if context.campaign_summary:
+            messages.append({
+                "role": "system",
+                "content": f"КРАТКОЕ СОДЕРЖАНИЕ КАМПАНИИ:\n{context.campaign_summary}"
+            })
 
-        # Отправляем запрос к DeepSeek
-        async with aiohttp.ClientSession() as session:
-            headers = {
+        # Добавляем историю разговора если есть
+        messages.extend(self._prompt_history(context.session_id))
+
+        # Текущая ситуация и действие игрока - одним последним сообщением
+        messages.append({
+            "role": "user",
+            "content": f"{self._format_context_message(context)}\n\n{context.player_action}"
+        })
+
+        return messages
+
+    async def _get_http_session(self) -> aiohttp.ClientSession:
+        """HTTP-сессия с таймаутами соединения и чтения"""
+        if self._closed:
+            # Иначе запоздавшая фоновая задача откроет сессию, которую уже никто не закроет
+            raise RuntimeError("ГМ остановлен, HTTP-сессия закрыта")
+        if self._http_session is None or self._http_session.closed:
+            timeout = aiohttp.ClientTimeout(
+                connect=GM_RESILIENCE["connect_timeout"],
+                sock_read=GM_RESILIENCE["attempt_timeout"]
+            )
+            self._http_session = aiohttp.ClientSession(timeout=timeout, headers={
                 "Authorization": f"Bearer {self.api_key}",
                 "Content-Type": "application/json"
-            }
+            }, trace_configs=[self.telemetry.trace_config()])
+        return self._http_session
 
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "temperature": self.temperature,
-                "max_tokens": self.max_tokens,
-                "stream": False
-            }
+    def warmup(self):
+        """
+        Заранее открыть соединение с API (DNS, TCP, TLS) в фоне
 
-            async with session.post(self.api_url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data["choices"][0]["message"]["content"]
-                else:
-                    error_text = await response.text()
-                    raise Exception(f"API Error {response.status}: {error_text}")
+        Вызывается, когда запрос к ГМ вот-вот понадобится: рукопожатие идёт
+        параллельно с отправкой сообщений в Telegram, и первый ответ ГМ не ждёт его.
+        """
+        if self._closed or (self._warmup_task and not self._warmup_task.done()):
+            return
+        if time.monotonic() - self._warmed_at < GM_RESILIENCE["warm_connection_ttl"]:
+            return  # соединение ещё в пуле
+        self._warmup_task = asyncio.ensure_future(self._warmup())
+
+    async def _warmup(self):
+        # Самый лёгкий запрос к тому же хосту; ответ не важен - важно соединение в пуле
+        models_url = self.api_url.rsplit("/chat/completions", 1)[0] + "/models"
+        try:
+            http_session = await self._get_http_session()
+            async with http_session.get(models_url) as response:
+                await response.read()
+            self._warmed_at = time.monotonic()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.info(f"Не удалось заранее открыть соединение с API ГМ: {e}")
+
+    async def close(self):
+        """Остановить фоновые задачи (прогрев, заготовки бросков, сводки) и закрыть HTTP-сессию"""
+        self._closed = True
+        if self._warmup_task and not self._warmup_task.done():
+            self._warmup_task.cancel()
+            await asyncio.gather(self._warmup_task, return_exceptions=True)
+        if self.speculator:
+            await self.speculator.close()
+        if self.summarizer:
+            await self.summarizer.close()
+        if self._http_session and not self._http_session.closed:
+            await self._http_session.close()
+
+    def _build_payload(self, messages: List[Dict], params: GenerationParams,
+                       stream: bool = False, json_mode: bool = False) -> Dict:
+        """Тело запроса chat/completions"""
+        payload = {
+            "model": params.model,
+            "messages": messages,
+            "temperature": params.temperature,
+            "max_tokens": params.max_tokens,
+            "stream": stream
+        }
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+
+    @staticmethod
+    async def _raise_for_status(response: aiohttp.ClientResponse):
+        """Превратить неуспешный ответ в GMAPIError"""
+        if response.status == 200:
+            return
+
+        error_text = await response.text()
+        retry_after = response.headers.get("Retry-After")
+        try:
+            retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            retry_after = None
+        raise GMAPIError(response.status, error_text, retry_after)
+
+    async def _request_completion(self, session_id: str, messages: List[Dict], params: GenerationParams,
+                                  priority: Priority = Priority.ACTION, json_mode: bool = False,
+                                  kind: str = "action") -> str:
+        """Отправить запрос к DeepSeek и вернуть текст ответа"""
+        payload = self._build_payload(messages, params, json_mode=json_mode)
+        trace = self.telemetry.start(session_id, kind, params.model)
+
+        async def attempt() -> Dict:
+            http_session = await self._get_http_session()
+            async with http_session.post(self.api_url, json=payload, trace_request_ctx=trace) as response:
+                await self._raise_for_status(response)
+                return await response.json()
+
+        usage = None
+        error = None
+        try:
+            # Слот занимается на весь запрос, включая повторы
+            async with self.scheduler.slot(session_id, priority):
+                trace.mark_dispatched()
+                data = await self.resilience.call(attempt)
+            usage = data.get("usage")
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.telemetry.finish(trace, classify_outcome(error), usage)
+
+        self._record_prefix_cache_usage(session_id, usage)
+        return data["choices"][0]["message"]["content"]
+
+    async def _stream_completion(self, session_id: str, messages: List[Dict], params: GenerationParams,
+                                 json_mode: bool = False, kind: str = "action") -> AsyncIterator[str]:
+        """Потоковый запрос к DeepSeek (SSE): отдаёт фрагменты текста ответа"""
+        payload = self._build_payload(messages, params, stream=True, json_mode=json_mode)
+        trace = self.telemetry.start(session_id, kind, params.model)
+
+        async def open_stream() -> aiohttp.ClientResponse:
+            http_session = await self._get_http_session()
+            response = await http_session.post(self.api_url, json=payload, trace_request_ctx=trace)
+            try:
+                await self._raise_for_status(response)
+            except GMAPIError:
+                response.release()
+                raise
+            return response
+
+        usage = None
+        error = None
+        try:
+            async with self.scheduler.slot(session_id, Priority.ACTION):
+                trace.mark_dispatched()
+                # Дедлайн ограничивает весь ответ, а не только установку потока
+                expires_at = time.monotonic() + self.resilience.deadline
+                # Повторяем только установку потока: после первых байт ответ уже уходит игроку
+                response = await self.resilience.call(open_stream, hedge=False, defer_success=True)
+                failure = None
+                try:
+                    while True:
+                        remaining = expires_at - time.monotonic()
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError
+                        raw_line = await asyncio.wait_for(response.content.readline(), timeout=remaining)
+                        if not raw_line:
+                            raise aiohttp.ClientPayloadError("поток ответа оборвался до [DONE]")
+
+                        line = raw_line.decode("utf-8").strip()
+                        if not line.startswith("data:"):
+                            continue
+
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+
+                        chunk = json.loads(data)
+                        if chunk.get("usage"):
+                            usage = chunk["usage"]
+                            self._record_prefix_cache_usage(session_id, usage)
+
+                        for choice in chunk.get("choices", []):
+                            content = (choice.get("delta") or {}).get("content")
+                            if content:
+                                yield content
+                except (asyncio.TimeoutError, aiohttp.ClientError, ConnectionError, ValueError) as e:
+                    # Обрыв, зависание или мусор посреди ответа - тоже отказ API для предохранителя
+                    failure = self.resilience.record_stream_failure(e)
+                    raise failure from e
+                finally:
+                    if failure is None:
+                        self.resilience.record_stream_success()
+                    response.release()
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.telemetry.finish(trace, classify_outcome(error), usage)
+
+    def _record_prefix_cache_usage(self, session_id: str, usage: Optional[Dict]):
+        """Учесть попадания в кэш префикса из блока usage"""
+        cached, uncached = parse_prompt_cache_usage(usage)
+        stats = self.prefix_cache_stats.setdefault(session_id, PrefixCacheStats())
+        stats.requests += 1
+        stats.cached_tokens += cached
+        stats.uncached_tokens += uncached
+
+    def get_prefix_cache_stats(self, session_id: str) -> Dict:
+        """Статистика кэша префикса для сессии (hit_rate - доля закэшированных токенов)"""
+        return self.prefix_cache_stats.get(session_id, PrefixCacheStats()).to_dict()
+
+    def get_resilience_stats(self) -> Dict:
+        """Состояние предохранителя, счётчики повторов/таймаутов и перцентили задержки"""
+        return self.resilience.get_stats()
+
+    def get_speculation_stats(self) -> Dict:
+        """Счётчики заготовок исходов бросков: попадания, промахи, расход бюджета"""
+        return self.speculator.get_stats() if self.speculator else {"enabled": False}
+
+    def _format_party_message(self, context: GMContext) -> str:
+        """Неизменная часть контекста - состав группы"""
+        return context.party_block
 
     def _format_context_message(self, context: GMContext) -> str:
         """Форматировать контекстное сообщение"""
-        message = f"""ТЕКУЩАЯ СИТУАЦИЯ:
+        related = ""
+        if context.related_events:
+            related = "\n🔎 Связанное из прошлого:\n" + "\n".join(
+                f"• {event[:300]}" for event in context.related_events
+            ) + "\n"
 
-🎭 Сцена: {context.current_scene}
+        return f"""ТЕКУЩАЯ СИТУАЦИЯ:
 
-👥 Персонажи в игре:
-{chr(10).join([f"- {char['name']} ({char['class']}) - {char['hp']} хитов" for char in context.active_characters])}
+🎭 Сцена: {context.current_scene}
 
-🎲 Пулы:
-- Hope: {context.global_hope}
-- Fear: {context.global_fear}
+{context.status_block}
 
 📖 Краткая история: {context.story_summary}
 
 🕐 Недавние события:
-{chr(10).join([f"• {event}" for event in context.recent_events[-3:]])}
-
-Что происходит дальше?"""
-
-        return message
+{context.events_block}
+{related}
+ДЕЙСТВИЕ ИГРОКА:"""
 
     def _parse_game_effects(self, gm_response: str, session: GameSession) -> List[Dict]:
         """Извлечь игровые эффекты из ответа ГМ"""
-        effects = []
-
-        # Простые паттерны для извлечения эффектов
-        import re
-
-        # Поиск запросов бросков
-        roll_patterns = [
-            r"[Бб]рось\s+(\w+)\s+против\s+сложности\s+(\d+)",
-            r"[Сс]делай\s+проверку\s+(\w+)\s+\((\d+)\)",
-            r"[Пп]роверка\s+(\w+):\s*(\d+)"
-        ]
+        return [effect for effect in extract_game_effects(gm_response)
+                if self._effect_allowed(effect, session)]
 
-        for pattern in roll_patterns:
-            matches = re.findall(pattern, gm_response, re.IGNORECASE)
-            for match in matches:
-                trait, difficulty = match
-                effects.append({
-                    "type": "request_roll",
-                    "trait": trait.lower(),
-                    "difficulty": int(difficulty),
-                    "description": f"Требуется проверка {trait}"
-                })
-
-        # Поиск трат Fear
-        fear_patterns = [
-            r"[Тт]рачу\s+(\d+)\s+Fear",
-            r"[Ии]спользую\s+(\d+)\s+Fear"
-        ]
-
-        for pattern in fear_patterns:
-            matches = re.findall(pattern, gm_response)
-            for match in matches:
-                amount = int(match)
-                if session.global_fear >= amount:
-                    effects.append({
-                        "type": "spend_fear",
-                        "amount": amount,
-                        "description": f"ГМ тратит {amount} Fear"
-                    })
-
-        # Поиск урона
-        damage_patterns = [
-            r"получает\s+(\d+)\s+урона",
-            r"наносит\s+(\d+)\s+урона"
-        ]
+    def _effect_allowed(self, effect: Dict, session: GameSession) -> bool:
+        """Проверить, может ли эффект быть применён в текущем состоянии сессии"""
+        # ГМ не может потратить больше Fear, чем есть в пуле
+        if effect["type"] == "spend_fear" and session.global_fear < effect["amount"]:
+            return False
+        return True
 
-        for pattern in damage_patterns:
-            matches = re.findall(pattern, gm_response)
-            for match in matches:
-                damage = int(match)
-                effects.append({
-                    "type": "damage",
-                    "amount": damage,
-                    "description": f"Урон: {damage}"
-                })
-
-        return effects
+    def _prompt_history(self, session_id: str) -> List[Dict]:
+        """История, которая идёт в промпт: окно сдвигается блоками, чтобы не сбивать кэш префикса"""
+        return self.conversation_history.tail(session_id, self.history_window, self.history_block)
 
     def _update_conversation_history(self, session_id: str, player_action: str, gm_response: str):
         """Обновить историю разговора"""
-        if session_id not in self.conversation_history:
-            self.conversation_history[session_id] = []
-
-        history = self.conversation_history[session_id]
-        history.append({"role": "user", "content": player_action})
-        history.append({"role": "assistant", "content": gm_response})
-
-        # Ограничиваем историю последними 20 сообщениями
-        if len(history) > 20:
-            self.conversation_history[session_id] = history[-20:]
-
-    def _get_fallback_response(self) -> str:
-        """Запасной ответ при ошибке API"""
-        fallback_responses = [
-            "Что-то загадочное происходит... (ГМ временно недоступен)",
-            "Твое действие разворачивается интересным образом... (Подождите, ГМ думает)",
-            "Окружающий мир замирает в ожидании... (Технические трудности)",
-            "Судьба задумалась над твоим поступком... (ГМ скоро вернется)"
+        new_messages = [
+            {"role": "user", "content": player_action},
+            {"role": "assistant", "content": gm_response}
+        ]
+        shown = self._prompt_history(session_id) if self.summarizer else []
+        self.conversation_history.append(session_id, new_messages)
+        if self.retrieval:
+            self.retrieval.add(session_id, gm_response, "gm")
+
+        if self.summarizer:
+            # Блок, который только что вышел из окна истории промпта, уходит в сводку
+            left = len(shown) + len(new_messages) - len(self._prompt_history(session_id))
+            self.summarizer.add_messages(session_id, shown[:left])
+
+    async def _summarize(self, session_id: str, summary: str, items: List[str]) -> str:
+        """Обновить краткое содержание кампании (фоновый запрос на настройках сцен)"""
+        messages = [
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": format_summary_request(summary, items)}
         ]
-        import random
-        return random.choice(fallback_responses)
+        params = self.policy.economize(session_id, GenerationParams(
+            GM_SCENE_SETTINGS["model"], GM_SCENE_SETTINGS["max_tokens"], GM_SUMMARY["temperature"], "summary"
+        ))
+        return await self._request_completion(
+            session_id, messages, params, priority=Priority.BACKGROUND, kind="summary"
+        )
 
     async def generate_scene_description(self, session: GameSession, scene_type: str,
                                          location: str = "") -> str:
@@ -357,25 +795,16 @@ class DaggerheartGM:
                 {"role": "user", "content": context}
             ]
 
-            async with aiohttp.ClientSession() as http_session:
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                }
-
-                payload = {
-                    "model": self.model,
-                    "messages": messages,
-                    "temperature": 0.8,
-                    "max_tokens": 300
-                }
-
-                async with http_session.post(self.api_url, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data["choices"][0]["message"]["content"]
-                    else:
-                        return f"Вы оказываетесь в новой локации... (ошибка генерации сцены)"
+            params = self.policy.for_scene(session.session_id, GenerationParams(
+                GM_SCENE_SETTINGS["model"], GM_SCENE_SETTINGS["max_tokens"], GM_SCENE_SETTINGS["temperature"],
+                "scene"
+            ))
+            try:
+                return await self._request_completion(
+                    session.session_id, messages, params, priority=Priority.SCENE, kind="scene"
+                )
+            except GMAPIError:
+                return f"Вы оказываетесь в новой локации... (ошибка генерации сцены)"
 
         except Exception as e:
             logger.error(f"Ошибка генерации сцены: {e}")
@@ -383,8 +812,36 @@ class DaggerheartGM:
 
     def clear_session_history(self, session_id: str):
         """Очистить историю сессии"""
-        if session_id in self.conversation_history:
-            del self.conversation_history[session_id]
+        self.conversation_history.clear(session_id)
+        self.prefix_cache_stats.pop(session_id, None)
+        if self.speculator:
+            self.speculator.discard(session_id)
+        if self.summarizer:
+            self.summarizer.discard(session_id)
+        if self.retrieval:
+            self.retrieval.discard(session_id)
+        self.context_cache.discard(session_id)
+        self.telemetry.forget(session_id)
+
+    def get_history_stats(self) -> Dict:
+        """Заполненность хранилища истории и счётчики вытеснения"""
+        return self.conversation_history.get_stats()
+
+    def get_retrieval_stats(self) -> Dict:
+        """Размер индексов истории и среднее время поиска"""
+        return self.retrieval.get_stats() if self.retrieval else {"enabled": False}
+
+    def get_summary_stats(self) -> Dict:
+        """Размер сводок кампаний и счётчики сворачиваний"""
+        return self.summarizer.get_stats() if self.summarizer else {"enabled": False}
+
+    def get_policy_stats(self) -> Dict:
+        """Текущая загрузка и причины выбора параметров генерации"""
+        return self.policy.get_stats()
+
+    def get_telemetry_stats(self) -> Dict:
+        """Перцентили задержек по видам запросов, токены и расходы"""
+        return self.telemetry.snapshot()
 
 
 # Глобальный экземпляр ГМ
@@ -392,26 +849,100 @@ daggerheart_gm = DaggerheartGM()
 
 
 # Функции для интеграции с ботом
-async def process_gm_action(session_id: str, player_id: str, action: str) -> Dict:
-    """Обработать действие игрока через ГМ"""
+def check_gm_admission(session_id: str) -> Optional[str]:
+    """
+    Контроль допуска перед отправкой действия ГМ
+
+    Returns:
+        Текст для игрока, если ГМ перегружен, иначе None
+    """
+    admitted, reason = daggerheart_gm.scheduler.admission_check(session_id, Priority.ACTION)
+    if admitted:
+        return None
+
+    logger.info(f"Действие сессии {session_id} отклонено планировщиком: {reason}")
+    if reason == "session_quota":
+        return "⏳ ГМ ещё отвечает на предыдущие действия вашей группы. Подожди немного!"
+    return "⏳ ГМ сейчас занят множеством историй. Попробуй через минуту!"
+
+
+async def process_gm_action(session_id: str, player_id: str, action: str,
+                            on_effect: Optional[Callable[[Dict], Awaitable[None]]] = None,
+                            action_key: Optional[str] = None) -> Dict:
+    """
+    Обработать действие игрока через ГМ
+
+    Эффекты применяются к сессии по мере появления; on_effect вызывается после
+    применения каждого (например, чтобы заранее построить кнопки бросков).
+    action_key - ключ идемпотентности действия (например, update_id): эффекты
+    получают ключи "<action_key>:<номер>" и применяются не больше одного раза.
+    """
     from game.game_session import session_manager
 
     session = session_manager.get_session(session_id)
     if not session:
         return {"error": "Сессия не найдена"}
 
-    result = await daggerheart_gm.process_player_action(session, player_id, action)
+    handle_effect = _effect_handler(session, player_id, on_effect, action_key)
+
+    return await daggerheart_gm.process_player_action(session, player_id, action, handle_effect)
+
 
-    # Применяем эффекты к сессии
-    if result.get("success") and result.get("effects"):
-        for effect in result["effects"]:
-            await apply_game_effect(session, effect, player_id)
+def narrate_locally(session_id: str, player_id: str, action: str) -> str:
+    """Мгновенное описание действия локальным рассказчиком (без запроса к API)"""
+    from game.game_session import session_manager
 
-    return result
+    session = session_manager.get_session(session_id)
+    if not session:
+        return "Мир на мгновение замирает, будто прислушиваясь к твоему решению..."
+    return daggerheart_gm.narrator.narrate(session, player_id, action)
 
 
-async def apply_game_effect(session: GameSession, effect: Dict, player_id: str):
-    """Применить игровой эффект к сессии"""
+async def narrate_roll(session_id: str, player_id: str, trait: str, difficulty: int, roll_result: Dict,
+                       on_effect: Optional[Callable[[Dict], Awaitable[None]]] = None,
+                       action_key: Optional[str] = None) -> Dict:
+    """Описание ГМ для результата запрошенного броска (с применением эффектов, как в process_gm_action)"""
+    from game.game_session import session_manager
+
+    session = session_manager.get_session(session_id)
+    if not session:
+        return {"error": "Сессия не найдена"}
+
+    handle_effect = _effect_handler(session, player_id, on_effect, action_key)
+    return await daggerheart_gm.narrate_roll_result(session, player_id, trait, difficulty, roll_result,
+                                                    handle_effect)
+
+
+def _effect_handler(session: GameSession, player_id: str,
+                    on_effect: Optional[Callable[[Dict], Awaitable[None]]],
+                    action_key: Optional[str]) -> Callable[[Dict], Awaitable[None]]:
+    """Обработчик эффектов одного действия: применить к сессии (по ключам), затем on_effect"""
+    index = 0
+
+    async def handle_effect(effect: Dict):
+        nonlocal index
+        key = f"{action_key}:{index}" if action_key else None
+        index += 1
+        # Применяем эффект к сессии
+        await apply_game_effect(session, effect, player_id, key)
+        if on_effect:
+            await on_effect(effect)
+
+    return handle_effect
+
+
+async def apply_game_effect(session: GameSession, effect: Dict, player_id: str,
+                            idempotency_key: Optional[str] = None) -> bool:
+    """
+    Применить игровой эффект к сессии
+
+    Returns:
+        False, если эффект с этим ключом уже применялся (повторная доставка действия)
+    """
+    if idempotency_key and not session.claim_effect(idempotency_key):
+        logger.warning(f"Эффект {idempotency_key} уже применён в сессии {session.session_id}, пропускаем")
+        return False
+
     effect_type = effect.get("type")
 
     if effect_type == "spend_fear":
@@ -422,11 +953,32 @@ async def apply_game_effect(session: GameSession, effect: Dict, player_id: str):
         amount = effect.get("amount", 1)
         session.deal_damage_to_character(player_id, amount, "игровое событие")
 
+    elif effect_type == "heal":
+        amount = effect.get("amount", 1)
+        session.heal_character(player_id, amount, "игровое событие")
+
+    elif effect_type == "scene_change":
+        from game.game_session import SceneType
+        session.start_scene(SceneType(effect["scene_type"]), effect.get("description", ""),
+                            list(session.characters.keys()))
+
     elif effect_type == "request_roll":
         # Это просто уведомление о необходимости броска
         # Фактический бросок игрок делает сам
         pass
 
+    return True
+
+
+def forget_session(session_id: str):
+    """Сессия закончилась - её история, сводка и заготовки ГМ больше не нужны"""
+    daggerheart_gm.clear_session_history(session_id)
+
+
+def warmup_gm():
+    """Заранее открыть соединение с API ГМ (перед первым запросом новой игры)"""
+    daggerheart_gm.warmup()
+
 
 async def start_new_scene(session_id: str, scene_type: str, location: str = "") -> str:
     """Начать новую сцену с описанием от ГМ"""
@@ -453,13 +1005,85 @@ async def start_new_scene(session_id: str, scene_type: str, location: str = "")
     return description
 
 
-# Пример использования
+# Нагрузочный прогон без расхода API-кредитов
 if __name__ == "__main__":
-    async def test_gm():
-        # Тестирование ГМ (требует настроенный API ключ)
-        print("Тестирование DeepSeek ГМ...")
+    import sys
+    import time
 
-        # Здесь будет код для тестирования
-        print("Для тестирования нужен настроенный API ключ DeepSeek")
+    from deepseek.fake_server import FakeDeepSeekServer, FakeServerConfig, parse_latency
+    from game.character import create_starting_character
+    from game.game_session import session_manager
 
-    # asyncio.run(test_gm())
\ No newline at end of file
+    async def test_gm(sessions: int = 20, actions_per_session: int = 5):
+        """Прогон пути «действие -> ГМ -> эффекты» против локального фейкового сервера"""
+        server = FakeDeepSeekServer(FakeServerConfig(
+            latency=parse_latency("lognormal:0.3,0.5"), token_rate=200, error_rate=0.05
+        ))
+        daggerheart_gm.api_url = await server.start(port=0)
+        print(f"Тестирование DeepSeek ГМ на {daggerheart_gm.api_url}: "
+              f"{sessions} сессий x {actions_per_session} действий")
+
+        traits = {"agility": 1, "strength": 2, "finesse": 0, "instinct": 1, "presence": 0, "knowledge": -1}
+        session_ids = []
+        for i in range(sessions):
+            session_id = session_manager.create_session(f"player{i}", f"Нагрузка {i}")
+            session = session_manager.get_session(session_id)
+            session.add_player(f"player{i}", create_starting_character(
+                f"Герой {i}", f"player{i}", "guardian", "dwarf", traits
+            ))
+            session.start_session()
+            session_ids.append(session_id)
+
+        latencies = []
+        roll_latencies = []
+        failures = 0
+
+        async def play(index: int, session_id: str):
+            nonlocal failures
+            for action_number in range(actions_per_session):
+                started = time.perf_counter()
+                result = await process_gm_action(session_id, f"player{index}", f"Действие {action_number}")
+                latencies.append(time.perf_counter() - started)
+                if not result.get("success"):
+                    failures += 1
+                    continue
+
+                # ГМ попросил бросок: игрок читает ответ, жмёт кнопку и ждёт описания исхода
+                roll = next((effect for effect in result["effects"]
+                             if effect["type"] == "request_roll" and effect["trait"] in TRAIT_KEYS), None)
+                if roll:
+                    await asyncio.sleep(1.0)
+                    session = session_manager.get_session(session_id)
+                    roll_result = session.make_character_roll(f"player{index}", roll["trait"], roll["difficulty"])
+                    started = time.perf_counter()
+                    await narrate_roll(session_id, f"player{index}", roll["trait"], roll["difficulty"], roll_result)
+                    roll_latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(play(i, session_id) for i, session_id in enumerate(session_ids)))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        hit_rates = [daggerheart_gm.prefix_cache_stats[sid].hit_rate for sid in session_ids
+                     if sid in daggerheart_gm.prefix_cache_stats]
+        print(f"Действий: {len(latencies)} за {elapsed:.2f} с ({len(latencies) / elapsed:.1f}/с), ошибок: {failures}")
+        print(f"Задержка p50={latencies[len(latencies) // 2]:.3f} с, "
+              f"p95={latencies[int(len(latencies) * 0.95)]:.3f} с, max={latencies[-1]:.3f} с")
+        if roll_latencies:
+            roll_latencies.sort()
+            print(f"Описание броска ({len(roll_latencies)}): p50={roll_latencies[len(roll_latencies) // 2]:.3f} с, "
+                  f"p95={roll_latencies[int(len(roll_latencies) * 0.95)]:.3f} с")
+        print("Заготовки бросков:", json.dumps(daggerheart_gm.get_speculation_stats(), ensure_ascii=False))
+        print("Сводки кампаний:", json.dumps(daggerheart_gm.get_summary_stats(), ensure_ascii=False))
+        print("Поиск по истории:", json.dumps(daggerheart_gm.get_retrieval_stats(), ensure_ascii=False))
+        print("Параметры генерации:", json.dumps(daggerheart_gm.get_policy_stats(), ensure_ascii=False))
+        print(daggerheart_gm.telemetry.render_text())
+        print(f"Кэш префикса: средняя доля попаданий {sum(hit_rates) / max(1, len(hit_rates)):.2f}")
+        print("Планировщик:", json.dumps(daggerheart_gm.scheduler.get_stats(), ensure_ascii=False))
+        print("Устойчивость:", json.dumps(daggerheart_gm.get_resilience_stats(), ensure_ascii=False))
+        print("Сервер:", json.dumps(server.stats.__dict__))
+
+        await daggerheart_gm.close()
+        await server.stop()
+
+    asyncio.run(test_gm(*(int(arg) for arg in sys.argv[1:3])))
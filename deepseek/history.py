@@ -0,0 +1,216 @@
+"""
+Ограниченное хранилище истории разговоров с ГМ
+
+Держит в памяти не больше max_sessions сессий (вытесняются давно неактивные),
+забывает сессии без активности дольше ttl_seconds и при необходимости сбрасывает
+вытесненную историю в SQLite, откуда она подгружается при следующем обращении.
+Сброшенная история, к которой не возвращались дольше spill_ttl_seconds, удаляется
+из базы - при запуске и затем раз в prune_interval секунд.
+"""
+
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class HistorySpill:
+    """Сброс вытесненной истории в SQLite"""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS gm_history (
+                session_id TEXT PRIMARY KEY,
+                messages TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS gm_history_updated_at ON gm_history (updated_at)")
+
+    def save(self, session_id: str, messages: List[Dict]):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO gm_history (session_id, messages, updated_at) VALUES (?, ?, ?)",
+            (session_id, json.dumps(messages, ensure_ascii=False), time.time())
+        )
+
+    def load(self, session_id: str) -> Optional[List[Dict]]:
+        row = self.connection.execute(
+            "SELECT messages FROM gm_history WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, session_id: str):
+        self.connection.execute("DELETE FROM gm_history WHERE session_id = ?", (session_id,))
+
+    def prune(self, max_age: float) -> int:
+        """Удалить историю, не обновлявшуюся дольше max_age секунд; сколько удалено"""
+        cursor = self.connection.execute("DELETE FROM gm_history WHERE updated_at < ?", (time.time() - max_age,))
+        return cursor.rowcount
+
+
+@dataclass
+class _Entry:
+    messages: List[Dict] = field(default_factory=list)
+    dropped: int = 0  # сколько сообщений уже вытеснено из начала (номер первого в messages)
+    last_active: float = field(default_factory=time.monotonic)
+
+
+class ConversationHistoryStore:
+    """История сообщений по сессиям с вытеснением по LRU и TTL"""
+
+    def __init__(self, max_sessions: int = 500, max_messages: int = 20,
+                 ttl_seconds: float = 3600, spill: Optional[HistorySpill] = None,
+                 spill_ttl_seconds: float = 7 * 24 * 3600, prune_interval: float = 3600):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.ttl_seconds = ttl_seconds
+        self.spill = spill
+        self.spill_ttl_seconds = spill_ttl_seconds
+        self.prune_interval = prune_interval
+
+        # Порядок = порядок активности: в начале давно неактивные сессии
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted_lru = 0
+        self.evicted_ttl = 0
+        self.spilled = 0
+        self.reloaded = 0
+        self.pruned = 0
+
+        self._pruned_at = 0.0
+        self._prune_spill()
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._entries
+
+    def get(self, session_id: str) -> List[Dict]:
+        """История сессии (подгружается из SQLite, если была вытеснена)"""
+        entry = self._touch(session_id)
+        return entry.messages if entry else []
+
+    def tail(self, session_id: str, size: int, block: int = 1) -> List[Dict]:
+        """
+        Последние сообщения для промпта: от size до size + block - 1
+
+        Начало окна сдвигается целыми блоками, а не на каждом ходу - между
+        сдвигами промпт только дописывается в конец, и кэш префикса у провайдера
+        покрывает всю историю.
+        """
+        entry = self._touch(session_id)
+        if entry is None:
+            return []
+        total = entry.dropped + len(entry.messages)
+        start = max(0, total - size) // block * block
+        return entry.messages[max(0, start - entry.dropped):]
+
+    def append(self, session_id: str, messages: List[Dict]) -> List[Dict]:
+        """
+        Добавить сообщения в историю сессии
+
+        Returns:
+            Сообщения, вытесненные из окна max_messages (самые старые)
+        """
+        entry = self._touch(session_id)
+        if entry is None:
+            entry = _Entry()
+            self._entries[session_id] = entry
+
+        entry.messages.extend(messages)
+        trimmed = []
+        if len(entry.messages) > self.max_messages:
+            trimmed = entry.messages[:-self.max_messages]
+            entry.messages = entry.messages[-self.max_messages:]
+            entry.dropped += len(trimmed)
+
+        self._evict()
+        return trimmed
+
+    def clear(self, session_id: str):
+        """Полностью забыть историю сессии (в том числе сброшенную в SQLite)"""
+        self._entries.pop(session_id, None)
+        if self.spill:
+            self.spill.delete(session_id)
+
+    def _touch(self, session_id: str) -> Optional[_Entry]:
+        self._expire()
+        if time.monotonic() - self._pruned_at >= self.prune_interval:
+            self._prune_spill()
+
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            messages = self.spill.load(session_id) if self.spill else None
+            if messages is None:
+                return None
+            self.reloaded += 1
+            entry = _Entry(messages=messages[-self.max_messages:])
+            self._entries[session_id] = entry
+            self._evict()
+
+        entry.last_active = time.monotonic()
+        self._entries.move_to_end(session_id)
+        return entry
+
+    def _expire(self):
+        """Вытеснить сессии без активности дольше TTL (они всегда в начале очереди)"""
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._entries:
+            session_id, entry = next(iter(self._entries.items()))
+            if entry.last_active >= cutoff:
+                break
+            self._drop(session_id)
+            self.evicted_ttl += 1
+
+    def _prune_spill(self):
+        """Удалить из базы давно заброшенную историю (сессии, которые уже не вернутся)"""
+        self._pruned_at = time.monotonic()
+        if not self.spill:
+            return
+        try:
+            removed = self.spill.prune(self.spill_ttl_seconds)
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось очистить старую историю: {e}")
+            return
+        if removed:
+            self.pruned += removed
+            logger.info(f"Удалена старая история ГМ: {removed} сессий")
+
+    def _evict(self):
+        while len(self._entries) > self.max_sessions:
+            session_id = next(iter(self._entries))
+            self._drop(session_id)
+            self.evicted_lru += 1
+
+    def _drop(self, session_id: str):
+        entry = self._entries.pop(session_id)
+        if self.spill and entry.messages:
+            try:
+                self.spill.save(session_id, entry.messages)
+                self.spilled += 1
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось сохранить историю сессии {session_id}: {e}")
+
+    def get_stats(self) -> Dict:
+        """Заполненность и счётчики вытеснения"""
+        return {
+            "sessions": len(self._entries),
+            "max_sessions": self.max_sessions,
+            "messages": sum(len(entry.messages) for entry in self._entries.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted_lru": self.evicted_lru,
+            "evicted_ttl": self.evicted_ttl,
+            "spilled": self.spilled,
+            "reloaded": self.reloaded,
+            "pruned": self.pruned
+        }
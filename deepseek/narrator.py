@@ -0,0 +1,116 @@
+"""
+Локальный рассказчик на шаблонах
+
+Когда DeepSeek не успевает ответить в срок (или недоступен), игрок всё равно
+получает осмысленное описание: шаблон выбирается по типу сцены, глаголу в
+действии игрока, классу персонажа и результату последнего броска.
+"""
+
+import random
+import re
+from typing import Optional
+
+from deepseek.speculation import classify_roll
+from game.game_session import GameSession, SceneType
+from game.mechanics import ActionResult
+
+# Виды действий и основы глаголов, по которым они узнаются
+ACTION_KINDS = {
+    "attack": ["атак", "бью", "удар", "руб", "стреля", "колю", "напада", "бросаюсь на", "attack"],
+    "magic": ["колду", "заклина", "магия", "магию", "чары", "призыва", "молю", "молитв", "cast"],
+    "talk": ["говор", "спрашива", "убежда", "угрожа", "прошу", "предлага", "торгу", "скажу", "кричу", "зову"],
+    "search": ["ищу", "осматрива", "исследу", "изуча", "провер", "слуша", "смотрю", "нюха", "обыскива"],
+    "sneak": ["краду", "крадусь", "прячусь", "прята", "тихо", "незаметно", "подкрад"],
+    "move": ["бегу", "иду", "прыга", "лезу", "взбира", "плыву", "отступа", "уход", "направля"],
+    "rest": ["отдыха", "сплю", "лечу", "перевязыва", "лагерь", "привал"]
+}
+
+_KIND_PATTERN = re.compile("|".join(
+    f"(?P<{kind}>{'|'.join(re.escape(stem) for stem in stems)})" for kind, stems in ACTION_KINDS.items()
+))
+
+# Что делает действие, в зависимости от его вида
+ACTION_TEMPLATES = {
+    "attack": ["{name} бросается вперёд, и {style}.", "{name} выбирает миг для удара — {style}."],
+    "magic": ["Воздух начинает дрожать — {name} взывает к силе, и {style}.", "{name} сплетает силу, и {style}."],
+    "talk": ["{name} подбирает слова, и собеседник замирает, вслушиваясь.",
+             "{name} говорит уверенно — на миг все взгляды обращаются к говорящему."],
+    "search": ["{name} внимательно осматривается, цепляясь взглядом за каждую мелочь.",
+               "{name} не спешит: детали складываются в картину одна за другой."],
+    "sneak": ["{name} растворяется в тенях, ступая так тихо, как только может.",
+              "{name} сдерживает дыхание и движется от укрытия к укрытию."],
+    "move": ["{name} устремляется вперёд, не теряя ни секунды.", "{name} меняет позицию, просчитывая каждый шаг."],
+    "rest": ["{name} позволяет себе короткую передышку — напряжение понемногу отпускает.",
+             "У костра становится чуть теплее, и {name} переводит дух."],
+    "other": ["{name} действует — и мир откликается.", "{name} решается, и события приходят в движение."]
+}
+
+# Манера класса - для силовых и магических действий
+CLASS_STYLES = {
+    "guardian": "щит принимает на себя первый натиск",
+    "warrior": "клинок описывает широкую дугу",
+    "ranger": "стрела уходит точно туда, куда смотрел глаз",
+    "rogue": "удар приходится туда, где его не ждали",
+    "seraph": "священный свет вспыхивает на оружии",
+    "sorcerer": "волна сырой магии срывается с пальцев"
+}
+DEFAULT_STYLE = "всё решают считанные мгновения"
+
+SCENE_OPENINGS = {
+    SceneType.EXPLORATION: ["Тропа петляет среди незнакомых теней.", "Вокруг тихо — слишком тихо."],
+    SceneType.SOCIAL: ["Разговор становится напряжённее.", "Собравшиеся ловят каждое слово."],
+    SceneType.ACTION: ["Бой не утихает ни на миг.", "Сталь звенит, сердце стучит в висках."],
+    SceneType.REST: ["Лагерь погружается в спокойствие.", "Время течёт медленно и мирно."]
+}
+
+# Исход последнего броска, если он был только что
+ROLL_OUTCOMES = {
+    ActionResult.CRITICAL_SUCCESS.value: "Судьба на вашей стороне: всё выходит даже лучше задуманного!",
+    ActionResult.SUCCESS_WITH_HOPE.value: "Успех окрыляет — Надежда разгорается ярче.",
+    ActionResult.SUCCESS_WITH_FEAR.value: "Получилось, но где-то рядом сгущается Страх.",
+    ActionResult.FAILURE.value: "Увы, не всё идёт по плану — ситуация осложняется."
+}
+
+CLOSINGS = ["Что ты делаешь дальше?", "Как поступишь?", "Твой ход."]
+
+
+def classify_action(action: str) -> str:
+    """Вид действия по первому узнанному глаголу"""
+    match = _KIND_PATTERN.search(action.lower())
+    return match.lastgroup if match else "other"
+
+
+def latest_roll_outcome(session: GameSession, window: int = 5) -> Optional[str]:
+    """Класс исхода броска среди последних событий, если бросок был"""
+    for event in reversed(session.events[-window:]):
+        if event.event_type == "dice_roll" and "dice_roll" in event.details:
+            return classify_roll(event.details)
+    return None
+
+
+class LocalNarrator:
+    """Описание действия без обращения к LLM"""
+
+    def __init__(self, seed: Optional[int] = None):
+        self.random = random.Random(seed)
+
+    def narrate(self, session: GameSession, player_id: str, action: str) -> str:
+        """Короткое описание действия игрока в текущей ситуации"""
+        character = session.characters.get(player_id)
+        name = character.name if character else "Герой"
+        class_id = character.character_class.name.lower() if character and character.character_class else ""
+
+        parts = []
+        if session.current_scene:
+            parts.append(self.random.choice(SCENE_OPENINGS.get(session.current_scene.type, [""])))
+
+        template = self.random.choice(ACTION_TEMPLATES[classify_action(action)])
+        parts.append(template.format(name=name, style=CLASS_STYLES.get(class_id, DEFAULT_STYLE)))
+
+        outcome = latest_roll_outcome(session)
+        if outcome:
+            parts.append(ROLL_OUTCOMES[outcome])
+
+        parts.append(self.random.choice(CLOSINGS))
+        return " ".join(part for part in parts if part)
+
@@ -0,0 +1,139 @@
+"""
+Политика параметров генерации
+
+Длина ответа, модель и температура выбираются на каждый запрос: по типу сцены
+(короткие боевые раунды, развёрнутые описания при исследовании), по длине
+действия игрока и по загрузке планировщика. Когда очередь к API растёт, ответы
+укорачиваются, а при перегрузке действия могут уходить на более быструю модель
+(если она задана) - так хвост задержек растёт медленнее. Поверх всего действует потолок расходов сессии.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from game.game_session import GameSession, SceneType
+
+
+@dataclass
+class GenerationParams:
+    """Параметры одного запроса к модели"""
+    model: str
+    max_tokens: int
+    temperature: float
+    reason: str = "default"  # что определило параметры - для логов и телеметрии
+
+
+class GenerationPolicy:
+    """Выбор параметров генерации по ситуации в игре и нагрузке"""
+
+    def __init__(self, default: GenerationParams, scene_profiles: Dict[str, Dict],
+                 scheduler, telemetry, economy_model: str, economy_max_tokens: int,
+                 short_action_chars: int = 40, long_action_chars: int = 200, min_max_tokens: int = 200,
+                 shrink_from_load: float = 1.0, shrink_full_load: float = 3.0, min_load_factor: float = 0.5,
+                 overload_model: Optional[str] = None, overload_from_load: float = 2.0, enabled: bool = True):
+        """
+        Args:
+            default: Параметры без адаптации (GM_SETTINGS)
+            scene_profiles: max_tokens и temperature по значению SceneType
+            scheduler: LLMScheduler - источник текущей загрузки
+            telemetry: GMTelemetry - расходы сессий для потолка
+            economy_model: Модель для сессий сверх потолка расходов
+            economy_max_tokens: Предел ответа для сессий сверх потолка расходов
+            overload_model: Модель для действий при загрузке от overload_from_load; None - не переключать
+        """
+        self.default = default
+        self.scene_profiles = scene_profiles
+        self.scheduler = scheduler
+        self.telemetry = telemetry
+        self.economy_model = economy_model
+        self.economy_max_tokens = economy_max_tokens
+        self.short_action_chars = short_action_chars
+        self.long_action_chars = long_action_chars
+        self.min_max_tokens = min_max_tokens
+        self.shrink_from_load = shrink_from_load
+        self.shrink_full_load = shrink_full_load
+        self.min_load_factor = min_load_factor
+        self.overload_model = overload_model or None
+        self.overload_from_load = overload_from_load
+        self.enabled = enabled
+
+        self.decisions: Dict[str, int] = {}
+        self.speculative_decisions: Dict[str, int] = {}  # заготовки бросков - не действия игроков
+
+    def load_factor(self, load: float) -> float:
+        """Множитель длины ответа: 1 до shrink_from_load, линейно до min_load_factor к shrink_full_load"""
+        if load <= self.shrink_from_load:
+            return 1.0
+        span = max(1e-9, self.shrink_full_load - self.shrink_from_load)
+        progress = min(1.0, (load - self.shrink_from_load) / span)
+        return 1.0 - (1.0 - self.min_load_factor) * progress
+
+    def for_action(self, session: GameSession, action: str, speculative: bool = False) -> GenerationParams:
+        """
+        Параметры ответа ГМ на действие игрока
+
+        Args:
+            speculative: Заготовка исхода броска - решение считается отдельно от действий
+        """
+        if not self.enabled:
+            return self.economize(session.session_id, GenerationParams(**self.default.__dict__), speculative)
+
+        scene_type = session.current_scene.type if session.current_scene else SceneType.EXPLORATION
+        profile = self.scene_profiles.get(scene_type.value, {})
+        max_tokens = profile.get("max_tokens", self.default.max_tokens)
+        reasons = [scene_type.value]
+
+        if len(action) < self.short_action_chars:
+            max_tokens *= 0.8
+            reasons.append("short_action")
+        elif len(action) > self.long_action_chars:
+            max_tokens *= 1.2
+            reasons.append("long_action")
+
+        load = self.scheduler.load()
+        factor = self.load_factor(load)
+        if factor < 1.0:
+            max_tokens *= factor
+            reasons.append("load")
+
+        model = self.default.model
+        if self.overload_model and self.overload_model != model and load >= self.overload_from_load:
+            model = self.overload_model
+            reasons.append("overload")
+
+        params = GenerationParams(
+            model=model,
+            max_tokens=max(self.min_max_tokens, min(self.default.max_tokens, int(max_tokens))),
+            temperature=profile.get("temperature", self.default.temperature),
+            reason="+".join(reasons)
+        )
+        return self.economize(session.session_id, params, speculative)
+
+    def for_scene(self, session_id: str, base: GenerationParams) -> GenerationParams:
+        """Параметры описания сцены: базовые настройки сцен, укороченные под нагрузкой"""
+        params = GenerationParams(**base.__dict__)
+        if self.enabled:
+            factor = self.load_factor(self.scheduler.load())
+            if factor < 1.0:
+                params.max_tokens = max(self.min_max_tokens, int(params.max_tokens * factor))
+                params.reason = f"{params.reason}+load"
+        return self.economize(session_id, params)
+
+    def economize(self, session_id: str, params: GenerationParams, speculative: bool = False) -> GenerationParams:
+        """Перевести сессию сверх потолка расходов на экономичные настройки"""
+        if self.telemetry.over_ceiling(session_id):
+            params.model = self.economy_model
+            params.max_tokens = min(params.max_tokens, self.economy_max_tokens)
+            params.reason = f"{params.reason}+cost_ceiling"
+        decisions = self.speculative_decisions if speculative else self.decisions
+        decisions[params.reason] = decisions.get(params.reason, 0) + 1
+        return params
+
+    def get_stats(self) -> Dict:
+        """Сколько раз какие причины определяли параметры"""
+        return {
+            "enabled": self.enabled,
+            "load": round(self.scheduler.load(), 2),
+            "decisions": dict(sorted(self.decisions.items(), key=lambda item: -item[1])),
+            "speculative_decisions": dict(sorted(self.speculative_decisions.items(), key=lambda item: -item[1]))
+        }
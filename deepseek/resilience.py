@@ -0,0 +1,300 @@
+"""
+Устойчивость клиента DeepSeek: дедлайны, повторы с джиттером, предохранитель и хеджирование
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, FrozenSet, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class GMAPIError(Exception):
+    """Ошибка ответа DeepSeek API"""
+
+    # Статусы, после которых имеет смысл повторить запрос
+    RETRYABLE_STATUSES: FrozenSet[int] = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"API Error {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status in self.RETRYABLE_STATUSES
+
+
+class GMTimeoutError(GMAPIError):
+    """Запрос не уложился в дедлайн"""
+
+    def __init__(self, message: str = "превышено время ожидания"):
+        super().__init__(408, message)
+
+
+class CircuitOpenError(GMAPIError):
+    """Предохранитель разомкнут - API считается недоступным"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(503, f"ГМ временно недоступен, повтор через {retry_in:.0f} с", retry_after=retry_in)
+
+
+@dataclass
+class RetryPolicy:
+    """Политика повторов с экспоненциальной задержкой и полным джиттером"""
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 4.0
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Задержка перед попыткой attempt + 1 (attempt считается с нуля)"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после failure_threshold ошибок подряд перестаёт пропускать запросы
+    на reset_timeout секунд, затем пропускает один пробный запрос (half-open)
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+            logger.info("Предохранитель ГМ: пробный запрос (half-open)")
+
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release_probe(self):
+        """Пробный запрос отменён, не дав ответа: состояние не меняется, следующий запрос - новая проба"""
+        self._probe_in_flight = False
+
+    def retry_in(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Предохранитель ГМ замкнут: API снова отвечает")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Предохранитель ГМ разомкнут после {self.consecutive_failures} ошибок")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+class LatencyTracker:
+    """Скользящее окно задержек успешных запросов для перцентилей"""
+
+    def __init__(self, window: int = 200):
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+@dataclass
+class ResilienceStats:
+    """Счётчики для наблюдаемости"""
+    calls: int = 0
+    attempts: int = 0
+    retries: int = 0
+    timeouts: int = 0
+    failures: int = 0
+    rejected_by_breaker: int = 0
+    hedges_fired: int = 0
+    hedges_won: int = 0
+    errors_by_status: Dict[int, int] = field(default_factory=dict)
+
+
+class ResilientCaller:
+    """Выполняет запрос с дедлайном, повторами, предохранителем и (опционально) хеджированием"""
+
+    def __init__(self, policy: Optional[RetryPolicy] = None, breaker: Optional[CircuitBreaker] = None,
+                 attempt_timeout: float = 20.0, deadline: float = 45.0,
+                 hedge: bool = False, hedge_min_samples: int = 20):
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.latency = LatencyTracker()
+        self.stats = ResilienceStats()
+
+    async def call(self, attempt: Callable[[], Awaitable[Any]], hedge: Optional[bool] = None,
+                   deadline: Optional[float] = None, defer_success: bool = False) -> Any:
+        """
+        Выполнить attempt() с учётом политики
+
+        Args:
+            attempt: Фабрика корутины одной попытки (вызывается заново при повторе)
+            hedge: Разрешить хеджирование (по умолчанию - настройка вызывающего)
+            deadline: Общий бюджет времени на все попытки, секунды
+            defer_success: Успех attempt() ещё не успех запроса (открыт поток) - итог
+                сообщит вызывающий через record_stream_success / record_stream_failure
+        """
+        self.stats.calls += 1
+        hedge = self.hedge if hedge is None else hedge
+        expires_at = time.monotonic() + (deadline or self.deadline)
+
+        for attempt_number in range(self.policy.max_attempts):
+            if not self.breaker.allow_request():
+                self.stats.rejected_by_breaker += 1
+                raise CircuitOpenError(self.breaker.retry_in())
+
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                raise GMTimeoutError("исчерпан общий дедлайн запроса")
+
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(
+                    self._run_attempt(attempt, hedge), timeout=min(self.attempt_timeout, remaining)
+                )
+            except (asyncio.TimeoutError, GMAPIError, aiohttp.ClientError, ConnectionError) as e:
+                error = self._record_failure(e)
+            except BaseException:
+                # Отмена (например, спекулятивной генерации) или неожиданная ошибка: о здоровье
+                # API она ничего не говорит, но пробный запрос half-open нужно освободить,
+                # иначе предохранитель навсегда останется в half-open и будет отклонять всё
+                self.breaker.release_probe()
+                raise
+            else:
+                self.latency.add(time.monotonic() - started)
+                if not defer_success:
+                    self.breaker.record_success()
+                return result
+
+            if not error.retryable:
+                raise error
+
+            delay = self.policy.backoff(attempt_number, error.retry_after)
+            last_attempt = attempt_number == self.policy.max_attempts - 1
+            if last_attempt or time.monotonic() + delay >= expires_at:
+                raise error
+
+            self.stats.retries += 1
+            logger.warning(f"Повтор запроса к ГМ через {delay:.2f} с: {error}")
+            await asyncio.sleep(delay)
+
+        raise GMAPIError(503, "исчерпаны попытки")
+
+    def record_stream_success(self):
+        """Поток, открытый через call(defer_success=True), дочитан (или брошен потребителем)"""
+        self.breaker.record_success()
+
+    def record_stream_failure(self, error: BaseException) -> GMAPIError:
+        """Поток оборвался на середине: учесть ошибку в предохранителе; возвращает GMAPIError"""
+        return self._record_failure(error)
+
+    def _record_failure(self, error: BaseException) -> GMAPIError:
+        """Привести ошибку к GMAPIError, посчитать её и сообщить предохранителю"""
+        if isinstance(error, GMAPIError):
+            pass
+        elif isinstance(error, asyncio.TimeoutError):
+            self.stats.timeouts += 1
+            error = GMTimeoutError()
+        elif isinstance(error, (aiohttp.ClientError, ConnectionError)):
+            error = GMAPIError(503, f"сетевая ошибка: {error}")
+        else:
+            error = GMAPIError(502, f"некорректный ответ API: {error}")
+
+        self.stats.failures += 1
+        self.stats.errors_by_status[error.status] = self.stats.errors_by_status.get(error.status, 0) + 1
+        if error.retryable:
+            self.breaker.record_failure()
+        else:
+            # Ошибка запроса (400, 401...) - API жив, предохранитель не трогаем
+            self.breaker.record_success()
+        return error
+
+    async def _run_attempt(self, attempt: Callable[[], Awaitable[Any]], hedge: bool) -> Any:
+        self.stats.attempts += 1
+        hedge_delay = self.latency.percentile(0.95)
+        if not hedge or hedge_delay is None or len(self.latency.samples) < self.hedge_min_samples:
+            return await attempt()
+
+        # Хеджирование: если первая попытка дольше p95, параллельно отправляем вторую
+        primary = asyncio.ensure_future(attempt())
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        self.stats.hedges_fired += 1
+        self.stats.attempts += 1
+        secondary = asyncio.ensure_future(attempt())
+        pending = {primary, secondary}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            self.stats.hedges_won += 1
+                        return task.result()
+            # Обе попытки упали - пробрасываем ошибку основной
+            return primary.result()
+        finally:
+            for task in (primary, secondary):
+                if not task.done():
+                    task.cancel()
+
+    def get_stats(self) -> Dict:
+        """Снимок состояния для логов и админ-команд"""
+        p50 = self.latency.percentile(0.5)
+        p95 = self.latency.percentile(0.95)
+        return {
+            "breaker_state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "calls": self.stats.calls,
+            "attempts": self.stats.attempts,
+            "retries": self.stats.retries,
+            "timeouts": self.stats.timeouts,
+            "failures": self.stats.failures,
+            "rejected_by_breaker": self.stats.rejected_by_breaker,
+            "hedges_fired": self.stats.hedges_fired,
+            "hedges_won": self.stats.hedges_won,
+            "errors_by_status": dict(self.stats.errors_by_status),
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None
+        }
@@ -0,0 +1,294 @@
+"""
+Поиск по истории сессии (BM25) для контекста ГМ
+
+Каждая сессия получает свой инвертированный индекс по story_log, событиям и
+ответам ГМ. Индекс пополняется инкрементально, а запрос по действию игрока
+укладывается в заданный бюджет времени: термины обрабатываются от самых редких
+(самых информативных) к частым, и при исчерпании бюджета оставшиеся пропускаются.
+"""
+
+import heapq
+import math
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+TOKEN_PATTERN = re.compile(r"[а-яёa-z0-9]+")
+
+STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только
+ее её мне было вот от меня еще ещё нет о из ему когда даже ну вдруг ли если уже или ни быть
+был него до вас опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней
+для мы тебя их чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот
+того потому этого какой совсем ним здесь этом один почти мой тем чтобы нее сейчас были
+куда зачем всех никогда можно при об другой хоть после над больше тот через эти нас про
+всего них какая много разве эту моя свою этой перед такой им более всегда всю между
+твой твоя твои тебе вы ваш это эта свой своих the a an of to and in on
+""".split())
+
+# Окончания русских слов, от длинных к коротким; основа не короче _MIN_STEM
+_SUFFIXES = sorted("""
+ениями ениях ением ения ение ости остью ами ями ого его ому ему ыми ими ешь ете ите
+ают яют уют ала ила ыла ела али или ыли ели ать ять ить еть ует ая яя ое ее ой ей
+ий ый ым им ом ем ов ев ах ях ую юю ия ие ии ью ья ье ет ит ут ют ат ят ал ил ла ло ли
+ть а я о е ы и у ю ь й
+""".split(), key=len, reverse=True)
+_MIN_STEM = 3
+
+# Сколько вхождений термина обрабатывать между проверками бюджета времени
+_POSTINGS_CHUNK = 256
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """Лёгкий стеммер: возвратная частица и одно окончание"""
+    if word.endswith(("ся", "сь")) and len(word) - 2 >= _MIN_STEM:
+        word = word[:-2]
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Слова текста в виде основ, без стоп-слов"""
+    return [stem(token) for token in TOKEN_PATTERN.findall(text.lower().replace("ё", "е"))
+            if len(token) > 1 and token not in STOPWORDS]
+
+
+@dataclass
+class _Document:
+    text: str
+    kind: str  # story, event, gm
+    length: int
+
+
+class SessionIndex:
+    """Инвертированный индекс BM25 по документам одной сессии (только добавление)"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents: List[_Document] = []
+        self.lengths: List[int] = []  # длины документов в терминах (отдельно - для скорости запроса)
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}  # термин -> [(doc_id, tf)]
+        self.total_length = 0
+
+    def add(self, text: str, kind: str) -> int:
+        """Проиндексировать документ; возвращает его номер"""
+        terms = tokenize(text)
+        doc_id = len(self.documents)
+        self.documents.append(_Document(text=text, kind=kind, length=len(terms)))
+        self.lengths.append(len(terms))
+        self.total_length += len(terms)
+
+        frequencies: Dict[str, int] = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, []).append((doc_id, frequency))
+        return doc_id
+
+    def search(self, query: str, limit: int = 3, budget: float = 0.002,
+               exclude: Optional[Set[str]] = None) -> List[Tuple[float, _Document]]:
+        """
+        Самые релевантные запросу документы
+
+        Args:
+            budget: Бюджет времени в секундах; термины, не успевшие обработаться, пропускаются
+            exclude: Тексты, которые уже есть в промпте
+        """
+        count = len(self.documents)
+        if not count:
+            return []
+
+        # Часть бюджета оставляем на выбор лучших документов
+        deadline = time.perf_counter() + budget * 0.6
+        k1 = self.k1
+        # Знаменатель BM25: tf + k1 * (1 - b + b * длина / средняя длина)
+        base_norm = k1 * (1 - self.b)
+        length_weight = k1 * self.b * count / max(1, self.total_length)
+
+        # Редкие термины несут больше всего информации - обрабатываем их первыми
+        terms = sorted((term for term in set(tokenize(query)) if term in self.postings),
+                       key=lambda term: len(self.postings[term]))
+
+        scores: Dict[int, float] = {}
+        lengths = self.lengths
+        out_of_time = False
+        for term in terms:
+            postings = self.postings[term]
+            frequency = len(postings)
+            if frequency * 2 > count:
+                break  # дальше только термины, встречающиеся почти везде
+            weight = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5)) * (k1 + 1)
+
+            # От новых документов к старым: если бюджет кончится посреди термина,
+            # недосчитанными останутся самые давние события
+            for end in range(frequency, 0, -_POSTINGS_CHUNK):
+                for doc_id, tf in postings[max(0, end - _POSTINGS_CHUNK):end]:
+                    scores[doc_id] = scores.get(doc_id, 0.0) + weight * tf / (
+                        tf + base_norm + length_weight * lengths[doc_id])
+                if time.perf_counter() > deadline:
+                    out_of_time = True
+                    break
+            if out_of_time:
+                break
+
+        documents = self.documents
+
+        results = []
+        for doc_id in heapq.nlargest(limit + len(exclude or ()), scores, key=scores.__getitem__):
+            document = documents[doc_id]
+            if exclude and document.text in exclude:
+                continue
+            results.append((scores[doc_id], document))
+            if len(results) == limit:
+                break
+        return results
+
+    @property
+    def size(self) -> int:
+        return len(self.documents)
+
+
+@dataclass
+class _SessionState:
+    index: SessionIndex
+    story_offset: int = 0  # сколько записей story_log уже проиндексировано
+    events_offset: int = 0
+
+
+class RetrievalIndex:
+    """Индексы всех сессий с вытеснением давно неактивных"""
+
+    def __init__(self, max_sessions: int = 500, limit: int = 3, budget_ms: float = 2.0):
+        self.max_sessions = max_sessions
+        self.limit = limit
+        self.budget = budget_ms / 1000
+        self._sessions: "OrderedDict[str, _SessionState]" = OrderedDict()
+
+        self.queries = 0
+        self.query_time = 0.0
+
+    def _state(self, session_id: str) -> _SessionState:
+        state = self._sessions.get(session_id)
+        if state is None:
+            state = _SessionState(index=SessionIndex())
+            self._sessions[session_id] = state
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        return state
+
+    def sync(self, session_id: str, story_log: List[str], event_descriptions: Iterable[str],
+             events_count: int):
+        """
+        Доиндексировать новые записи сессии
+
+        Args:
+            event_descriptions: Описания событий, начиная с ещё не проиндексированного
+            events_count: Общее число событий сессии после синхронизации
+        """
+        state = self._state(session_id)
+        for entry in story_log[state.story_offset:]:
+            state.index.add(entry, "story")
+        state.story_offset = len(story_log)
+
+        for description in event_descriptions:
+            state.index.add(description, "event")
+        state.events_offset = events_count
+
+    def events_offset(self, session_id: str) -> int:
+        """С какого события продолжать индексацию"""
+        state = self._sessions.get(session_id)
+        return state.events_offset if state else 0
+
+    def add(self, session_id: str, text: str, kind: str = "gm"):
+        """Проиндексировать отдельный текст (например, ответ ГМ)"""
+        self._state(session_id).index.add(text, kind)
+
+    def search(self, session_id: str, query: str, exclude: Optional[Set[str]] = None) -> List[str]:
+        """Тексты прошлых событий, связанных с запросом"""
+        state = self._sessions.get(session_id)
+        if state is None:
+            return []
+
+        started = time.perf_counter()
+        results = state.index.search(query, self.limit, self.budget, exclude)
+        self.queries += 1
+        self.query_time += time.perf_counter() - started
+        return [document.text for _, document in results]
+
+    def discard(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    def get_stats(self) -> Dict:
+        """Размер индексов и среднее время запроса"""
+        return {
+            "sessions": len(self._sessions),
+            "documents": sum(state.index.size for state in self._sessions.values()),
+            "terms": sum(len(state.index.postings) for state in self._sessions.values()),
+            "queries": self.queries,
+            "avg_query_ms": round(self.query_time / self.queries * 1000, 3) if self.queries else 0.0
+        }
+
+
+# Бенчмарк индекса на длинной кампании
+if __name__ == "__main__":
+    import random
+    import sys
+    import tracemalloc
+
+    from deepseek.samples import RECORDED_GM_REPLIES
+
+    def benchmark(events: int = 10000, queries: int = 500):
+        """Построение индекса и время запросов на синтетической кампании"""
+        random.seed(7)
+        names = ["Торин", "Элара", "Мирра", "Брандо", "Кассиан", "Ильва", "Гронк", "Сефина"]
+        places = ["болото", "башня", "таверна", "храм", "пещера", "рынок", "порт", "крепость",
+                  "лес", "мост", "катакомбы", "библиотека"]
+        npcs = [f"{random.choice(['старый', 'хитрый', 'молчаливый', 'раненый'])} "
+                f"{random.choice(['торговец', 'жрец', 'стражник', 'контрабандист', 'маг'])} "
+                f"{random.choice(['Ардан', 'Вельмир', 'Зорга', 'Кель', 'Орвин', 'Тасс'])}"
+                for _ in range(40)]
+        sentences = [line.strip() for reply in RECORDED_GM_REPLIES for line in reply.split("\n") if line.strip()]
+
+        def event_text() -> str:
+            return (f"{random.choice(names)} встречает {random.choice(npcs)} у места «{random.choice(places)}». "
+                    f"{random.choice(sentences)}")
+
+        texts = [event_text() for _ in range(events)]
+
+        started = time.perf_counter()
+        index = SessionIndex()
+        for number, text in enumerate(texts):
+            index.add(text, "gm" if number % 3 == 0 else "event")
+        build_time = time.perf_counter() - started
+
+        timings = []
+        for _ in range(queries):
+            query = (f"Я спрашиваю {random.choice(npcs).split()[-1]} про {random.choice(places)} "
+                     f"и {random.choice(['кражу', 'дракона', 'печать', 'туман', 'алтарь'])}")
+            started = time.perf_counter()
+            index.search(query, budget=0.002)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+
+        # Память - отдельным построением: tracemalloc искажает замеры времени
+        tracemalloc.start()
+        traced = SessionIndex()
+        for text in texts:
+            traced.add(text, "event")
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"Документов: {index.size}, терминов: {len(index.postings)}")
+        print(f"Построение: {build_time:.2f} с ({index.size / build_time:.0f} док/с), память ~{memory / 1e6:.1f} МБ")
+        print(f"Запрос: p50={timings[len(timings) // 2] * 1000:.3f} мс, "
+              f"p95={timings[int(len(timings) * 0.95)] * 1000:.3f} мс, max={timings[-1] * 1000:.3f} мс")
+
+    benchmark(*(int(arg) for arg in sys.argv[1:3]))
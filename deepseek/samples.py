@@ -0,0 +1,72 @@
+"""
+Записанные ответы ГМ для бенчмарков и локальных прогонов
+"""
+
+# Реальные по форме ответы DeepSeek ГМ: описания, запросы бросков, траты Fear, урон и лечение
+RECORDED_GM_REPLIES = [
+    """Туман над болотом сгущается, и из камышей доносится влажный хрип. Тропа впереди
+раздваивается: левая ведёт к покосившейся башне, правая теряется в трясине.
+
+Брось ловкость против сложности 12, чтобы перебраться по скользким кочкам.
+
+Что ты делаешь дальше?""",
+
+    """Стражник щурится, разглядывая твою печать. «Не видал я таких раньше», — бормочет он,
+не убирая руки с алебарды. За его спиной в караулке кто-то смеётся.
+
+Сделай проверку присутствия (13), если хочешь убедить его пропустить вас.""",
+
+    """Гоблин визжит и бросается на тебя с зазубренным ножом! Лезвие проходит по руке —
+Торин получает 3 урона. Остальные гоблины занимают позиции на уступе.
+
+Трачу 1 Fear: из темноты пещеры выползает ещё один, крупнее прочих, с факелом в руке.
+
+Брось силу против сложности 14, чтобы удержать строй.""",
+
+    """Ты касаешься алтаря, и тёплый свет разливается по залу. Элара восстанавливает 2 хита,
+а шрамы на её ладонях бледнеют. Где-то наверху звенит колокол — храм узнал вас.
+
+Проверка знания: 11 — сможешь ли ты прочитать надпись на постаменте?""",
+
+    """Мост трещит под вашим весом. Доски одна за другой срываются в пропасть.
+
+Используй ловкость! Брось agility против сложности 15.
+Использую 2 Fear: канат, на котором держится мост, начинает рваться.""",
+
+    """Таверна «Кривой рог» полна народу. Бард в углу тянет тоскливую балладу о павшем
+королевстве, трактирщик протирает кружку, не сводя с вас глаз. У камина сидит
+человек в сером плаще — он явно ждёт кого-то.
+
+Что будешь делать?""",
+
+    """Огненный элементаль разворачивается к вам. Волна жара обжигает лицо:
+Каэль получает 4 урона, а доспехи Торина раскаляются докрасна.
+Элементаль наносит 2 урона каждому, кто стоит рядом.
+
+Брось инстинкт против сложности 13, чтобы заметить слабое место в его пламени.""",
+
+    """Целительница шепчет молитву, и ваши раны затягиваются. Торин восстанавливает 3 хита,
+Каэль исцеляет 1 хит с помощью зелья.
+
+Дорога на север свободна, но в небе кружат вороны — дурной знак.""",
+
+    """Ты пытаешься взломать замок. Механизм старый и тугой.
+
+Сделай проверку точности (14). Если провалишь — сработает ловушка.
+Трачу 1 Fear: за дверью слышны тяжёлые шаги.""",
+
+    """Дракон открывает один глаз. Его голос звучит прямо у тебя в голове:
+«Смертные... Зачем вы пришли в моё логово?»
+
+Брось присутствие против сложности 16 — от твоих слов зависит, заговорит ли он с вами
+или испепелит на месте.""",
+
+    """Лесная тропа уводит вас всё глубже. Деревья смыкаются над головой, свет меркнет.
+Вдалеке слышится журчание ручья и чей-то смех — детский, звонкий, неуместный здесь.
+
+Проверка интуиции: 12 — чувствуешь ли ты, что за вами следят?""",
+
+    """Бандит получает 5 урона и падает на колени, выронив арбалет. Второй пятится к лошадям.
+Используй момент: брось finesse против сложности 10, чтобы выбить у него поводья.
+Использую 1 Fear: главарь трубит в рог, и на холме появляются всадники."""
+]
@@ -0,0 +1,255 @@
+"""
+Справедливый планировщик запросов к LLM
+
+Ограничивает общее число одновременных запросов и их частоту (token bucket),
+распределяет очередь между сессиями поровну (справедливая очередь по виртуальному
+времени окончания; весов у сессий нет - заявка с cost > 1 просто считается за
+несколько) и пропускает действия игроков раньше фоновой генерации.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+
+class Priority(IntEnum):
+    """Классы приоритета: меньше - важнее"""
+    ACTION = 0  # действие игрока, которое он ждёт прямо сейчас
+    SCENE = 1  # генерация сцены
+    BACKGROUND = 2  # спекулятивные и фоновые задачи
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, запас до capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self, amount: float = 1.0) -> bool:
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def delay_until(self, amount: float = 1.0) -> float:
+        """Через сколько секунд будет доступно amount токенов"""
+        self._refill()
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+
+@dataclass(order=True)
+class _Ticket:
+    """Заявка в очереди; сортируется по приоритету, виртуальному времени окончания и порядку"""
+    priority: int
+    virtual_finish: float
+    seq: int
+    session_id: str = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class LLMScheduler:
+    """Глобальный планировщик запросов к DeepSeek"""
+
+    def __init__(self, max_concurrency: int = 8, rate_per_second: float = 5.0, burst: int = 10,
+                 max_queue_depth: int = 50, per_session_quota: int = 3, max_expected_wait: float = 20.0):
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self.max_queue_depth = max_queue_depth
+        self.per_session_quota = per_session_quota
+        self.max_expected_wait = max_expected_wait
+
+        self._queue: List[_Ticket] = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        # WFQ: виртуальное время и последнее время окончания по (сессия, приоритет) -
+        # фоновые задачи сессии не отодвигают её же действия
+        self._virtual_time = 0.0
+        self._last_finish: Dict[Tuple[str, int], float] = {}
+
+        # Заявки по (сессия, приоритет): в очереди + выполняются
+        self._pending: Dict[Tuple[str, int], int] = {}
+
+        # Метрики
+        self.dispatched = 0
+        self.rejected = 0
+        self._waits: Dict[Priority, Deque[float]] = {p: deque(maxlen=500) for p in Priority}
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for ticket in self._queue if not ticket.future.done())
+
+    def spare_capacity(self) -> int:
+        """Сколько запросов можно начать прямо сейчас, не вставая в очередь"""
+        self.bucket._refill()
+        free_slots = self.max_concurrency - self._active - self.queue_depth
+        return max(0, min(free_slots, int(self.bucket.tokens)))
+
+    def load(self) -> float:
+        """Загрузка: (выполняющиеся + ожидающие) / max_concurrency; больше 1 - запросы ждут в очереди"""
+        return (self._active + self.queue_depth) / self.max_concurrency
+
+    def admission_check(self, session_id: str,
+                        priority: Priority = Priority.ACTION) -> Tuple[bool, Optional[str]]:
+        """
+        Стоит ли принимать новый запрос
+
+        Returns:
+            (принят, причина отказа)
+        """
+        # Квота считает только заявки того же или более важного класса
+        pending = sum(self._pending.get((session_id, p), 0) for p in Priority if p <= priority)
+        if pending >= self.per_session_quota:
+            self.rejected += 1
+            return False, "session_quota"
+
+        depth = self.queue_depth
+        if depth >= self.max_queue_depth:
+            self.rejected += 1
+            return False, "queue_full"
+
+        # Оценка ожидания: заявки того же или более высокого приоритета впереди / пропускная способность
+        ahead = sum(1 for ticket in self._queue
+                    if ticket.priority <= priority and not ticket.future.done())
+        if ahead and ahead / self.bucket.rate > self.max_expected_wait:
+            self.rejected += 1
+            return False, "expected_wait"
+
+        return True, None
+
+    async def acquire(self, session_id: str, priority: Priority = Priority.ACTION, cost: float = 1.0):
+        """
+        Дождаться своей очереди на запрос
+
+        Args:
+            session_id: Сессия, между сессиями очередь делится поровну
+            priority: Класс приоритета
+            cost: Во сколько обычных заявок обходится эта (по умолчанию все равны)
+        """
+        loop = asyncio.get_running_loop()
+        key = (session_id, int(priority))
+        start = max(self._virtual_time, self._last_finish.get(key, 0.0))
+        finish = start + cost
+        self._last_finish[key] = finish
+
+        ticket = _Ticket(
+            priority=int(priority),
+            virtual_finish=finish,
+            seq=next(self._seq),
+            session_id=session_id,
+            enqueued_at=time.monotonic(),
+            future=loop.create_future()
+        )
+        heapq.heappush(self._queue, ticket)
+        self._pending[key] = self._pending.get(key, 0) + 1
+        self._dispatch()
+
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Слот уже выдан, но ожидающий отменён - возвращаем слот
+                self.release(session_id, priority)
+            else:
+                ticket.future.cancel()
+                self._decrement_pending(key)
+            raise
+
+        self._waits[priority].append(time.monotonic() - ticket.enqueued_at)
+
+    def release(self, session_id: str, priority: Priority = Priority.ACTION):
+        """Освободить слот после завершения запроса"""
+        self._active -= 1
+        self._decrement_pending((session_id, int(priority)))
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, session_id: str, priority: Priority = Priority.ACTION,
+                   cost: float = 1.0) -> AsyncIterator[None]:
+        """Контекст: занять слот на время запроса"""
+        await self.acquire(session_id, priority, cost)
+        try:
+            yield
+        finally:
+            self.release(session_id, priority)
+
+    def _decrement_pending(self, key: Tuple[str, int]):
+        remaining = self._pending.get(key, 0) - 1
+        if remaining > 0:
+            self._pending[key] = remaining
+        else:
+            self._pending.pop(key, None)
+            # Бездействующая сессия не должна накапливать «долг» в WFQ
+            if self._last_finish.get(key, 0.0) <= self._virtual_time:
+                self._last_finish.pop(key, None)
+
+    def _dispatch(self):
+        """Выдать слоты заявкам из головы очереди, пока позволяют лимиты"""
+        while self._queue and self._active < self.max_concurrency:
+            ticket = self._queue[0]
+            if ticket.future.done():
+                heapq.heappop(self._queue)
+                continue
+
+            if not self.bucket.try_take():
+                self._schedule_retry(self.bucket.delay_until())
+                return
+
+            heapq.heappop(self._queue)
+            self._virtual_time = max(self._virtual_time, ticket.virtual_finish)
+            self._active += 1
+            self.dispatched += 1
+            ticket.future.set_result(None)
+
+    def _schedule_retry(self, delay: float):
+        if self._timer is not None and not self._timer.cancelled():
+            return
+
+        def retry():
+            self._timer = None
+            self._dispatch()
+
+        self._timer = asyncio.get_running_loop().call_later(delay, retry)
+
+    def get_stats(self) -> Dict:
+        """Глубина очереди, занятость и время ожидания по классам приоритета"""
+        depth_by_priority = {p.name.lower(): 0 for p in Priority}
+        for ticket in self._queue:
+            if not ticket.future.done():
+                depth_by_priority[Priority(ticket.priority).name.lower()] += 1
+
+        waits = {}
+        for priority, samples in self._waits.items():
+            ordered = sorted(samples)
+            waits[priority.name.lower()] = {
+                "p50": round(ordered[len(ordered) // 2], 3) if ordered else None,
+                "p95": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 3) if ordered else None
+            }
+
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": sum(depth_by_priority.values()),
+            "queue_depth_by_priority": depth_by_priority,
+            "sessions_waiting": len({session_id for session_id, _ in self._pending}),
+            "dispatched": self.dispatched,
+            "rejected": self.rejected,
+            "wait_seconds": waits
+        }
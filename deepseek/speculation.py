@@ -0,0 +1,213 @@
+"""
+Спекулятивная генерация исходов бросков
+
+Как только ГМ просит бросок, в фоне заранее генерируются описания для вероятных
+исходов (критический успех, успех с Надеждой, успех со Страхом, неудача). После
+броска игрок сразу получает подходящее описание, остальные отбрасываются.
+Расход токенов ограничен бюджетом в час и минимальной вероятностью исхода.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from deepseek.effects import TRAIT_NAMES_RU
+from deepseek.scheduler import TokenBucket
+from game.mechanics import ActionResult
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_NAMES_RU = {
+    ActionResult.CRITICAL_SUCCESS.value: "критический успех",
+    ActionResult.SUCCESS_WITH_HOPE.value: "успех с Надеждой",
+    ActionResult.SUCCESS_WITH_FEAR.value: "успех со Страхом",
+    ActionResult.FAILURE.value: "неудача"
+}
+
+
+def classify_roll(roll_result: Dict) -> str:
+    """Класс исхода броска из результата Character.make_action_roll"""
+    result_type = roll_result["dice_roll"].result_type
+    if result_type == ActionResult.CRITICAL_SUCCESS:
+        return ActionResult.CRITICAL_SUCCESS.value
+    if not roll_result["success"]:
+        return ActionResult.FAILURE.value
+    return result_type.value
+
+
+def outcome_probabilities(trait_value: int, difficulty: int) -> Dict[str, float]:
+    """Точные вероятности классов исхода для 2d12 + характеристика против сложности"""
+    counts = {outcome: 0 for outcome in OUTCOME_NAMES_RU}
+    for hope_die in range(1, 13):
+        for fear_die in range(1, 13):
+            if hope_die == fear_die:
+                outcome = ActionResult.CRITICAL_SUCCESS
+            elif hope_die + fear_die + trait_value < difficulty:
+                outcome = ActionResult.FAILURE
+            elif hope_die > fear_die:
+                outcome = ActionResult.SUCCESS_WITH_HOPE
+            else:
+                outcome = ActionResult.SUCCESS_WITH_FEAR
+            counts[outcome.value] += 1
+    return {outcome: count / 144 for outcome, count in counts.items()}
+
+
+def roll_action_text(trait: str, difficulty: int, outcome: str) -> str:
+    """Текст действия «результат броска» - одинаковый для спекулятивного и обычного пути"""
+    return (f"🎲 Бросок ({TRAIT_NAMES_RU.get(trait, trait)}) против сложности {difficulty}: "
+            f"{OUTCOME_NAMES_RU[outcome]}. Опиши, что происходит.")
+
+
+@dataclass
+class _Speculation:
+    """Набор фоновых генераций для одного запроса броска"""
+    player_id: str
+    trait: str
+    difficulty: int
+    tasks: Dict[str, asyncio.Task] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class SpeculationStats:
+    """Счётчики спекуляций"""
+    scheduled: int = 0
+    generations: int = 0
+    hits: int = 0
+    misses: int = 0
+    discarded: int = 0
+    skipped_budget: int = 0
+    skipped_capacity: int = 0
+    reserved_tokens: int = 0
+
+
+class RollSpeculator:
+    """Фоновые генерации исходов бросков с ограничением расхода"""
+
+    def __init__(self, max_tokens: int = 250, token_budget_per_hour: int = 60000,
+                 min_probability: float = 0.05, ttl_seconds: float = 300):
+        """
+        Args:
+            max_tokens: Лимит токенов одного спекулятивного ответа
+            token_budget_per_hour: Сколько токенов в час можно потратить на спекуляции
+            min_probability: Исходы с меньшей вероятностью не генерируются
+            ttl_seconds: Через сколько неиспользованная спекуляция отбрасывается
+        """
+        self.max_tokens = max_tokens
+        self.budget = TokenBucket(token_budget_per_hour / 3600, token_budget_per_hour)
+        self.min_probability = min_probability
+        self.ttl_seconds = ttl_seconds
+        self.stats = SpeculationStats()
+        self._active: Dict[str, _Speculation] = {}  # session_id -> спекуляция
+        self._closed = False
+
+    def schedule(self, session_id: str, player_id: str, trait: str, trait_value: int, difficulty: int,
+                 generate: Callable[[str], Awaitable[str]], limit: int = 4):
+        """
+        Запустить фоновые генерации для вероятных исходов запрошенного броска
+
+        Args:
+            generate: Корутина: текст действия (roll_action_text) -> сырой ответ ГМ
+            limit: Сколько исходов генерировать (свободная ёмкость планировщика)
+        """
+        self.discard(session_id)
+        if self._closed:
+            return
+
+        probabilities = outcome_probabilities(trait_value, difficulty)
+        outcomes: List[Tuple[str, float]] = sorted(
+            ((outcome, p) for outcome, p in probabilities.items() if p >= self.min_probability),
+            key=lambda item: item[1], reverse=True
+        )[:limit]
+
+        speculation = _Speculation(player_id=player_id, trait=trait, difficulty=difficulty)
+        for outcome, _ in outcomes:
+            # Самые вероятные исходы первыми - пока хватает бюджета
+            if not self.budget.try_take(self.max_tokens):
+                self.stats.skipped_budget += 1
+                break
+
+            task = asyncio.create_task(generate(roll_action_text(trait, difficulty, outcome)))
+            task.add_done_callback(_consume_exception)
+            speculation.tasks[outcome] = task
+            self.stats.generations += 1
+            self.stats.reserved_tokens += self.max_tokens
+
+        if speculation.tasks:
+            self._active[session_id] = speculation
+            self.stats.scheduled += 1
+            logger.info(f"Спекуляция броска {trait} ({difficulty}) для сессии {session_id}: "
+                        f"{', '.join(speculation.tasks)}")
+
+    async def take(self, session_id: str, player_id: str, trait: str, difficulty: int,
+                   outcome: str) -> Optional[str]:
+        """
+        Забрать заранее сгенерированное описание исхода
+
+        Если генерация ещё идёт - дожидается её (это всё равно быстрее нового запроса).
+        Остальные исходы отменяются. Возвращает None при промахе.
+        """
+        speculation = self._active.pop(session_id, None)
+        if speculation is None:
+            self.stats.misses += 1
+            return None
+
+        matches = (speculation.player_id == player_id and speculation.trait == trait
+                   and speculation.difficulty == difficulty
+                   and time.monotonic() - speculation.created_at <= self.ttl_seconds)
+        task = speculation.tasks.pop(outcome, None) if matches else None
+        self._cancel(speculation)
+
+        if task is None:
+            if matches:
+                logger.info(f"Исход {outcome} не спекулировался для сессии {session_id}")
+            self.stats.misses += 1
+            return None
+
+        try:
+            narration = await task
+        except Exception as e:
+            logger.warning(f"Спекулятивная генерация не удалась: {e}")
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        return narration
+
+    def discard(self, session_id: str):
+        """Отбросить спекуляции сессии (например, игрок сделал другое действие)"""
+        speculation = self._active.pop(session_id, None)
+        if speculation:
+            self._cancel(speculation)
+
+    async def close(self):
+        """Отменить все фоновые генерации и дождаться их завершения"""
+        self._closed = True
+        tasks = [task for speculation in self._active.values() for task in speculation.tasks.values()]
+        for session_id in list(self._active):
+            self.discard(session_id)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _cancel(self, speculation: _Speculation):
+        for task in speculation.tasks.values():
+            if not task.done():
+                task.cancel()
+            self.stats.discarded += 1
+        speculation.tasks.clear()
+
+    def get_stats(self) -> Dict:
+        lookups = self.stats.hits + self.stats.misses
+        return {
+            **self.stats.__dict__,
+            "active": len(self._active),
+            "hit_rate": round(self.stats.hits / lookups, 3) if lookups else 0.0
+        }
+
+
+def _consume_exception(task: asyncio.Task):
+    """Не оставлять исключения фоновых задач «неполученными»"""
+    if not task.cancelled():
+        task.exception()
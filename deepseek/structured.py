@@ -0,0 +1,293 @@
+"""
+Структурированный (JSON) режим ответов ГМ
+
+Модель отвечает объектом {"effects": [...], "narration": "..."}. Парсер разбирает
+поток по мере поступления: каждый эффект отдаётся сразу после закрытия его объекта,
+а повествование - кусками, поэтому эффекты можно применять и строить кнопки ещё до
+того, как ГМ закончит описание.
+"""
+
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from deepseek.effects import TRAIT_NAMES_RU, extract_game_effects, resolve_trait
+
+logger = logging.getLogger(__name__)
+
+SCENE_TYPES = ("exploration", "social", "action", "rest")
+
+# Схема эффектов: тип -> обязательные поля и их типы
+EFFECT_SCHEMA: Dict[str, Dict[str, type]] = {
+    "request_roll": {"trait": str, "difficulty": int},
+    "spend_fear": {"amount": int},
+    "damage": {"amount": int},
+    "heal": {"amount": int},
+    "scene_change": {"scene_type": str, "description": str}
+}
+
+STRUCTURED_OUTPUT_INSTRUCTIONS = """
+
+ФОРМАТ ВЫВОДА (JSON):
+Отвечай ТОЛЬКО одним JSON-объектом без пояснений вокруг. Сначала массив effects, затем narration:
+{"effects": [ ... ], "narration": "описание происходящего для игрока"}
+
+Допустимые эффекты:
+- {"type": "request_roll", "trait": "agility|strength|finesse|instinct|presence|knowledge", "difficulty": 5-30}
+- {"type": "spend_fear", "amount": 1-5}
+- {"type": "damage", "amount": 1-20}
+- {"type": "heal", "amount": 1-20}
+- {"type": "scene_change", "scene_type": "exploration|social|action|rest", "description": "кратко о новой сцене"}
+
+Если эффектов нет - передай пустой массив. Не дублируй эффекты в тексте narration."""
+
+
+@dataclass
+class StructuredReply:
+    """Разобранный ответ ГМ"""
+    narration: str
+    effects: List[Dict] = field(default_factory=list)
+    structured: bool = True  # False, если модель не соблюла формат и сработал текстовый разбор
+
+
+def validate_effect(record: Any) -> Optional[Dict]:
+    """Проверить запись эффекта по схеме и привести к виду, который ждёт apply_game_effect"""
+    if not isinstance(record, dict):
+        return None
+
+    effect_type = record.get("type")
+    schema = EFFECT_SCHEMA.get(effect_type)
+    if schema is None:
+        return None
+
+    for name, expected in schema.items():
+        value = record.get(name)
+        # bool - подкласс int, его не принимаем
+        if not isinstance(value, expected) or isinstance(value, bool):
+            return None
+
+    if effect_type == "request_roll":
+        trait = resolve_trait(record["trait"])
+        difficulty = record["difficulty"]
+        if not trait or not 1 <= difficulty <= 30:
+            return None
+        return {
+            "type": "request_roll",
+            "trait": trait,
+            "difficulty": difficulty,
+            "description": f"Требуется проверка: {TRAIT_NAMES_RU[trait]}"
+        }
+
+    if effect_type == "scene_change":
+        if record["scene_type"] not in SCENE_TYPES:
+            return None
+        return {
+            "type": "scene_change",
+            "scene_type": record["scene_type"],
+            "description": record["description"]
+        }
+
+    amount = record["amount"]
+    if not 1 <= amount <= 20:
+        return None
+
+    descriptions = {
+        "spend_fear": f"ГМ тратит {amount} Fear",
+        "damage": f"Урон: {amount}",
+        "heal": f"Исцеление: {amount}"
+    }
+    return {"type": effect_type, "amount": amount, "description": descriptions[effect_type]}
+
+
+# Простые escape-последовательности JSON
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class IncrementalGMParser:
+    """
+    Потоковый разбор JSON-ответа ГМ
+
+    feed() принимает очередной фрагмент текста и возвращает события
+    ("effect", dict) и ("narration", str) в порядке их появления в потоке.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._complete = False
+
+        # Состояние строки
+        self._in_string = False
+        self._escape = False
+        self._unicode: Optional[str] = None
+        self._high_surrogate: Optional[int] = None
+
+        # Ключи верхнего уровня
+        self._expect_key = False
+        self._key_chars: Optional[List[str]] = None
+        self._current_key: Optional[str] = None
+
+        # Захват значений
+        self._narration_active = False
+        self._element_start: Optional[int] = None
+
+        self._narration_parts: List[str] = []
+        self._pending_narration: List[str] = []
+        self.effects: List[Dict] = []
+        self.rejected = 0
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Обработать очередной фрагмент потока"""
+        self._text += chunk
+        events: List[Tuple[str, Any]] = []
+
+        while self._pos < len(self._text) and not self._complete:
+            char = self._text[self._pos]
+            if self._in_string:
+                self._consume_string_char(char)
+            else:
+                self._consume_structural_char(char, events)
+            self._pos += 1
+
+        self._flush_narration(events)
+        return events
+
+    def finish(self) -> StructuredReply:
+        """
+        Завершить разбор; если модель нарушила формат - разобрать ответ как обычный текст
+
+        Повествование может оказаться пустым (JSON оборван до narration или модель его
+        не написала) - тогда описание подставляет вызывающий.
+        """
+        if self._complete or self._narration_parts:
+            return StructuredReply(narration="".join(self._narration_parts), effects=self.effects)
+
+        if self._text.lstrip().startswith("{"):
+            # Ответ упёрся в max_tokens до narration: эффекты уже разобраны, сырой JSON игроку не нужен
+            logger.warning("Ответ ГМ оборван до описания")
+            return StructuredReply(narration="", effects=self.effects)
+
+        logger.warning("Ответ ГМ не в JSON-формате, используется текстовый разбор")
+        text = self._text.strip()
+        return StructuredReply(narration=text, effects=extract_game_effects(text), structured=False)
+
+    def _consume_string_char(self, char: str):
+        if self._unicode is not None:
+            self._unicode += char
+            if len(self._unicode) == 4:
+                self._emit_string_char(self._decode_unicode(int(self._unicode, 16)))
+                self._unicode = None
+            return
+
+        if self._escape:
+            self._escape = False
+            if char == "u":
+                self._unicode = ""
+            else:
+                self._emit_string_char(_ESCAPES.get(char, char))
+            return
+
+        if char == "\\":
+            self._escape = True
+        elif char == '"':
+            self._end_string()
+        else:
+            self._emit_string_char(char)
+
+    def _decode_unicode(self, code: int) -> str:
+        # Суррогатные пары (эмодзи и т.п.) склеиваем в один символ
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+            return ""
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        return chr(code)
+
+    def _emit_string_char(self, char: str):
+        if self._key_chars is not None:
+            self._key_chars.append(char)
+        elif self._narration_active:
+            self._pending_narration.append(char)
+
+    def _end_string(self):
+        self._in_string = False
+        if self._key_chars is not None:
+            self._current_key = "".join(self._key_chars)
+            self._key_chars = None
+        self._narration_active = False
+
+    def _consume_structural_char(self, char: str, events: List[Tuple[str, Any]]):
+        depth = len(self._stack)
+
+        if char == '"':
+            self._in_string = True
+            if depth == 1 and self._expect_key:
+                self._key_chars = []
+            elif depth == 1 and self._current_key == "narration":
+                self._narration_active = True
+
+        elif char in "{[":
+            self._stack.append(char)
+            if char == "{" and depth == 0:
+                self._expect_key = True
+            elif char == "{" and depth == 2 and self._current_key == "effects":
+                self._element_start = self._pos
+
+        elif char in "}]":
+            if not self._stack:
+                return
+            self._stack.pop()
+            if char == "}" and depth == 3 and self._element_start is not None:
+                self._emit_effect(self._text[self._element_start:self._pos + 1], events)
+                self._element_start = None
+            elif depth == 1:
+                self._complete = True
+
+        elif depth == 1 and char == ":":
+            self._expect_key = False
+
+        elif depth == 1 and char == ",":
+            self._expect_key = True
+            self._current_key = None
+
+    def _emit_effect(self, raw: str, events: List[Tuple[str, Any]]):
+        try:
+            effect = validate_effect(json.loads(raw))
+        except json.JSONDecodeError:
+            effect = None
+
+        if effect is None:
+            self.rejected += 1
+            logger.warning(f"Отклонён эффект ГМ: {raw}")
+            return
+
+        self._flush_narration(events)
+        self.effects.append(effect)
+        events.append(("effect", effect))
+
+    def _flush_narration(self, events: List[Tuple[str, Any]]):
+        if self._pending_narration:
+            text = "".join(self._pending_narration)
+            self._pending_narration = []
+            self._narration_parts.append(text)
+            events.append(("narration", text))
+
+
+# Пример использования
+if __name__ == "__main__":
+    reply = json.dumps({
+        "effects": [
+            {"type": "damage", "amount": 3},
+            {"type": "request_roll", "trait": "сила", "difficulty": 14}
+        ],
+        "narration": "Гоблин бьёт тебя дубиной! \"Ха!\" - визжит он. 🎲"
+    }, ensure_ascii=True)
+
+    parser = IncrementalGMParser()
+    for start in range(0, len(reply), 7):
+        for event in parser.feed(reply[start:start + 7]):
+            print(event)
+    print(parser.finish())
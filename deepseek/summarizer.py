@@ -0,0 +1,160 @@
+"""
+Скользящее краткое содержание кампании
+
+Старые записи story_log и сообщения, вышедшие из окна истории промпта, копятся
+по сессиям и на контрольных точках (каждые checkpoint_items записей) в фоне
+сворачиваются в одно краткое содержание. Промпт ГМ получает сводку вместо всей
+истории, поэтому его размер не растёт с длиной кампании.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_PROMPT = """Ты ведёшь летопись кампании Daggerheart.
+Тебе дают текущее краткое содержание и новые события. Перепиши краткое содержание так,
+чтобы оно включало новые события: важные решения героев, встреченных персонажей,
+места, найденные предметы, незакрытые сюжетные линии. Пиши по-русски, сжато,
+не больше 150 слов, без вступлений и оценок."""
+
+
+def format_summary_request(summary: str, items: List[str]) -> str:
+    """Текст запроса на обновление сводки"""
+    return (f"КРАТКОЕ СОДЕРЖАНИЕ:\n{summary or 'Пока пусто - это начало кампании.'}\n\n"
+            f"НОВЫЕ СОБЫТИЯ:\n" + "\n".join(f"- {item}" for item in items))
+
+
+@dataclass
+class _SessionSummary:
+    text: str = ""
+    pending: List[str] = field(default_factory=list)  # ещё не свёрнутые записи
+    story_offset: int = 0  # сколько записей story_log уже передано в сводку
+    task: Optional[asyncio.Task] = None
+    checkpoints: int = 0
+
+
+class StorySummarizer:
+    """Фоновое сворачивание истории сессий в краткое содержание"""
+
+    def __init__(self, summarize: Callable[[str, str, List[str]], Awaitable[str]],
+                 checkpoint_items: int = 8, max_pending: int = 64, max_sessions: int = 500):
+        """
+        Args:
+            summarize: Корутина (session_id, текущая сводка, новые записи) -> новая сводка
+            checkpoint_items: Сколько записей копить перед сворачиванием
+            max_pending: Предел накопленных записей, если сворачивание раз за разом не удаётся
+            max_sessions: Сколько сводок держать в памяти (вытесняются давно неактивные)
+        """
+        self.summarize = summarize
+        self.checkpoint_items = checkpoint_items
+        self.max_pending = max_pending
+        self.max_sessions = max_sessions
+
+        self._sessions: "OrderedDict[str, _SessionSummary]" = OrderedDict()
+        self._closed = False
+
+        self.runs = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def get(self, session_id: str) -> str:
+        """Текущее краткое содержание сессии (пустая строка, если его ещё нет)"""
+        state = self._sessions.get(session_id)
+        return state.text if state else ""
+
+    def observe_story(self, session_id: str, story_log: List[str], keep_recent: int = 3):
+        """Передать в сводку записи story_log, которые уже не попадают в промпт напрямую"""
+        state = self._state(session_id)
+        folded_until = len(story_log) - keep_recent
+        if folded_until > state.story_offset:
+            state.pending.extend(f"Сцена: {entry}" for entry in story_log[state.story_offset:folded_until])
+            state.story_offset = folded_until
+            self._maybe_checkpoint(session_id, state)
+
+    def add_messages(self, session_id: str, messages: List[Dict]):
+        """Передать в сводку сообщения, вышедшие из окна истории промпта"""
+        if not messages:
+            return
+        state = self._state(session_id)
+        for message in messages:
+            speaker = "ГМ" if message["role"] == "assistant" else "Игрок"
+            state.pending.append(f"{speaker}: {message['content']}")
+        self._maybe_checkpoint(session_id, state)
+
+    def discard(self, session_id: str):
+        """Забыть сводку сессии и отменить её сворачивание"""
+        state = self._sessions.pop(session_id, None)
+        if state and state.task and not state.task.done():
+            state.task.cancel()
+
+    async def close(self):
+        """Отменить сворачивания и дождаться их завершения; новые не запускаются"""
+        self._closed = True
+        tasks = [state.task for state in self._sessions.values() if state.task and not state.task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _state(self, session_id: str) -> _SessionSummary:
+        state = self._sessions.get(session_id)
+        if state is None:
+            state = _SessionSummary()
+            self._sessions[session_id] = state
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                if evicted.task and not evicted.task.done():
+                    evicted.task.cancel()
+        self._sessions.move_to_end(session_id)
+        return state
+
+    def _maybe_checkpoint(self, session_id: str, state: _SessionSummary):
+        if len(state.pending) > self.max_pending:
+            # Сворачивание долго не удаётся - жертвуем самыми старыми записями
+            overflow = len(state.pending) - self.max_pending
+            del state.pending[:overflow]
+            self.dropped += overflow
+
+        if len(state.pending) < self.checkpoint_items:
+            return
+        if state.task and not state.task.done():
+            return  # по окончании текущего сворачивания проверим снова
+        if self._closed:
+            return
+        state.task = asyncio.create_task(self._fold(session_id, state))
+
+    async def _fold(self, session_id: str, state: _SessionSummary):
+        """Свернуть накопленные записи в сводку (вне пути обработки запроса)"""
+        items = state.pending
+        state.pending = []
+        self.runs += 1
+        try:
+            state.text = (await self.summarize(session_id, state.text, items)).strip()
+            state.checkpoints += 1
+            logger.info(f"Сводка сессии {session_id} обновлена ({len(items)} записей)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Не удалось обновить сводку сессии {session_id}: {e}")
+            # Вернём записи: они свернутся на следующей контрольной точке
+            state.pending = items + state.pending
+            return
+
+        if not self._closed and self._sessions.get(session_id) is state and len(state.pending) >= self.checkpoint_items:
+            state.task = asyncio.create_task(self._fold(session_id, state))
+
+    def get_stats(self) -> Dict:
+        """Число сводок, их суммарный размер и счётчики сворачиваний"""
+        return {
+            "sessions": len(self._sessions),
+            "summary_chars": sum(len(state.text) for state in self._sessions.values()),
+            "pending_items": sum(len(state.pending) for state in self._sessions.values()),
+            "runs": self.runs,
+            "failures": self.failures,
+            "dropped": self.dropped
+        }
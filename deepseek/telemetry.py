@@ -0,0 +1,363 @@
+"""
+Телеметрия запросов к ГМ
+
+Для каждого запроса к DeepSeek записываются ожидание в очереди планировщика,
+установка соединения, время до заголовков ответа и полное время, а также токены
+и оценка стоимости. Задержки складываются в гистограммы по виду запроса
+(action, scene, speculation, summary) и исходу, расходы - в журнал по сессиям.
+Сводка доступна админ-команде /gmstats и эндпоинту /metrics.
+
+Гистограммы нужны и инфраструктуре бота (очереди апдейтов и отправки), поэтому
+aiohttp и deepseek.resilience импортируются только там, где нужны: модуль не
+тянет HTTP-клиент в холодный старт бота.
+"""
+
+import asyncio
+import bisect
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    import aiohttp
+    from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 60.0)
+
+LATENCY_METRICS = ("queue_wait", "connect", "ttfb", "total")
+
+
+def parse_prompt_cache_usage(usage: Optional[Dict]) -> Tuple[int, int]:
+    """
+    Извлечь из блока usage количество закэшированных и незакэшированных токенов промпта
+
+    Поддерживаются поля DeepSeek (prompt_cache_hit_tokens / prompt_cache_miss_tokens)
+    и OpenAI-совместимый формат (prompt_tokens_details.cached_tokens).
+    """
+    if not usage:
+        return 0, 0
+
+    if "prompt_cache_hit_tokens" in usage or "prompt_cache_miss_tokens" in usage:
+        return usage.get("prompt_cache_hit_tokens", 0), usage.get("prompt_cache_miss_tokens", 0)
+
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+    return cached, max(0, prompt_tokens - cached)
+
+
+def classify_outcome(error: Optional[BaseException]) -> str:
+    """Исход запроса для меток метрик: ok, timeout, circuit_open, cancelled, error"""
+    if error is None:
+        return "ok"
+    from deepseek.resilience import CircuitOpenError, GMTimeoutError
+
+    if isinstance(error, GMTimeoutError):
+        return "timeout"
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        return "cancelled"  # в том числе потребитель бросил поток, не дочитав
+    return "error"
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (как в Prometheus)"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя - всё, что больше верхней границы
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 4) if self.count else None,
+            "p50": _round(self.quantile(0.5)),
+            "p95": _round(self.quantile(0.95)),
+            "p99": _round(self.quantile(0.99))
+        }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 4) if value is not None else None
+
+
+@dataclass
+class RequestTrace:
+    """Замеры одного запроса к ГМ (передаётся в aiohttp как trace_request_ctx)"""
+    session_id: str
+    kind: str
+    model: str
+    started: float = field(default_factory=time.monotonic)
+    queue_wait: Optional[float] = None
+    connect: Optional[float] = None
+    ttfb: Optional[float] = None
+    attempt_started: Optional[float] = None
+    connect_started: Optional[float] = None
+
+    def mark_dispatched(self):
+        """Слот планировщика получен - дальше идёт сам запрос"""
+        self.queue_wait = time.monotonic() - self.started
+
+
+@dataclass
+class SessionLedger:
+    """Расход токенов и денег одной сессии"""
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+
+
+class GMTelemetry:
+    """Хранилище гистограмм задержек, счётчиков и журнала расходов"""
+
+    def __init__(self, pricing: Dict[str, Dict[str, float]], session_cost_ceiling: float = 0.0,
+                 max_sessions: int = 500):
+        """
+        Args:
+            pricing: Цены за миллион токенов по моделям: input_cache_hit, input_cache_miss, output
+            session_cost_ceiling: Расход сессии, после которого она переводится на дешёвые
+                настройки (0 - без ограничения)
+        """
+        self.pricing = pricing
+        self.session_cost_ceiling = session_cost_ceiling
+        self.max_sessions = max_sessions
+
+        self.histograms: Dict[Tuple[str, str, str], Histogram] = {}  # (метрика, вид, исход)
+        self.requests: Dict[Tuple[str, str], int] = {}  # (вид, исход) -> число
+        self.tokens: Dict[Tuple[str, str], int] = {}  # (вид, prompt|cached|completion) -> токены
+        self.cost_by_kind: Dict[str, float] = {}
+        self.ledgers: "OrderedDict[str, SessionLedger]" = OrderedDict()
+        # Сессии сверх потолка, чей журнал уже вытеснен: вытеснение не должно обнулять их расход
+        self.capped: Set[str] = set()
+
+    def start(self, session_id: str, kind: str, model: str) -> RequestTrace:
+        return RequestTrace(session_id=session_id, kind=kind, model=model)
+
+    def estimate_cost(self, model: str, usage: Optional[Dict]) -> float:
+        """Оценка стоимости запроса в долларах по блоку usage"""
+        prices = self.pricing.get(model) or next(iter(self.pricing.values()), None)
+        if not usage or not prices:
+            return 0.0
+        cached, uncached = parse_prompt_cache_usage(usage)
+        completion = usage.get("completion_tokens", 0)
+        return (cached * prices["input_cache_hit"] + uncached * prices["input_cache_miss"]
+                + completion * prices["output"]) / 1_000_000
+
+    def finish(self, trace: RequestTrace, outcome: str, usage: Optional[Dict] = None):
+        """Записать завершённый запрос"""
+        total = time.monotonic() - trace.started
+        for metric, value in (("queue_wait", trace.queue_wait), ("connect", trace.connect),
+                              ("ttfb", trace.ttfb), ("total", total)):
+            if value is not None:
+                key = (metric, trace.kind, outcome)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.observe(value)
+
+        request_key = (trace.kind, outcome)
+        self.requests[request_key] = self.requests.get(request_key, 0) + 1
+
+        if not usage:
+            return
+
+        cached, uncached = parse_prompt_cache_usage(usage)
+        completion = usage.get("completion_tokens", 0)
+        cost = self.estimate_cost(trace.model, usage)
+        for name, value in (("prompt", cached + uncached), ("cached", cached), ("completion", completion)):
+            self.tokens[(trace.kind, name)] = self.tokens.get((trace.kind, name), 0) + value
+        self.cost_by_kind[trace.kind] = self.cost_by_kind.get(trace.kind, 0.0) + cost
+
+        ledger = self.ledgers.get(trace.session_id)
+        if ledger is None:
+            ledger = self.ledgers[trace.session_id] = SessionLedger()
+            while len(self.ledgers) > self.max_sessions:
+                evicted_id, evicted = self.ledgers.popitem(last=False)
+                if self.session_cost_ceiling and evicted.cost >= self.session_cost_ceiling:
+                    self.capped.add(evicted_id)
+        self.ledgers.move_to_end(trace.session_id)
+        was_over = self.over_ceiling(trace.session_id)
+        ledger.requests += 1
+        ledger.prompt_tokens += cached + uncached
+        ledger.cached_tokens += cached
+        ledger.completion_tokens += completion
+        ledger.cost += cost
+        if not was_over and self.over_ceiling(trace.session_id):
+            logger.warning(f"Сессия {trace.session_id} превысила потолок расходов "
+                           f"${self.session_cost_ceiling:.2f} - переход на экономичные настройки")
+
+    def session_cost(self, session_id: str) -> float:
+        ledger = self.ledgers.get(session_id)
+        return ledger.cost if ledger else 0.0
+
+    def over_ceiling(self, session_id: str) -> bool:
+        """Исчерпала ли сессия свой лимит расходов"""
+        if not self.session_cost_ceiling:
+            return False
+        return session_id in self.capped or self.session_cost(session_id) >= self.session_cost_ceiling
+
+    def forget(self, session_id: str):
+        """Сессия закончилась - её отметка о превышении потолка больше не нужна"""
+        self.capped.discard(session_id)
+
+    def trace_config(self) -> "aiohttp.TraceConfig":
+        """Хуки aiohttp: время установки соединения и получения заголовков ответа"""
+        import aiohttp
+
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context: SimpleNamespace, params):
+            trace = context.trace_request_ctx
+            if isinstance(trace, RequestTrace):
+                trace.attempt_started = time.monotonic()
+
+        async def on_connection_create_start(session, context: SimpleNamespace, params):
+            trace = context.trace_request_ctx
+            if isinstance(trace, RequestTrace):
+                trace.connect_started = time.monotonic()
+
+        async def on_connection_create_end(session, context: SimpleNamespace, params):
+            trace = context.trace_request_ctx
+            if isinstance(trace, RequestTrace) and trace.connect_started is not None:
+                trace.connect = time.monotonic() - trace.connect_started
+
+        async def on_request_end(session, context: SimpleNamespace, params):
+            trace = context.trace_request_ctx
+            if isinstance(trace, RequestTrace) and trace.attempt_started is not None:
+                trace.ttfb = time.monotonic() - trace.attempt_started
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_request_end.append(on_request_end)
+        return trace_config
+
+    def snapshot(self, top_sessions: int = 5) -> Dict:
+        """Все метрики одним словарём"""
+        latency: Dict[str, Dict] = {}
+        for (metric, kind, outcome), histogram in sorted(self.histograms.items()):
+            latency.setdefault(f"{kind}/{outcome}", {})[metric] = histogram.to_dict()
+
+        top = sorted(self.ledgers.items(), key=lambda item: item[1].cost, reverse=True)[:top_sessions]
+        return {
+            "requests": {f"{kind}/{outcome}": count for (kind, outcome), count in sorted(self.requests.items())},
+            "latency": latency,
+            "tokens": {f"{kind}/{name}": count for (kind, name), count in sorted(self.tokens.items())},
+            "cost_usd": {kind: round(cost, 6) for kind, cost in sorted(self.cost_by_kind.items())},
+            "top_sessions": [{"session_id": session_id, **ledger.__dict__, "cost": round(ledger.cost, 6)}
+                             for session_id, ledger in top],
+            "sessions_over_ceiling": len(self.capped.union(session_id for session_id in self.ledgers
+                                                            if self.over_ceiling(session_id)))
+        }
+
+    def render_text(self) -> str:
+        """Короткая сводка для админ-команды"""
+        lines = ["📈 Телеметрия ГМ"]
+        for key, count in sorted(self.requests.items()):
+            kind, outcome = key
+            total = self.histograms.get(("total", kind, outcome))
+            ttfb = self.histograms.get(("ttfb", kind, outcome))
+            wait = self.histograms.get(("queue_wait", kind, outcome))
+            lines.append(
+                f"• {kind}/{outcome}: {count} запр., total p50={_format_seconds(total, 0.5)} "
+                f"p95={_format_seconds(total, 0.95)}, ttfb p95={_format_seconds(ttfb, 0.95)}, "
+                f"очередь p95={_format_seconds(wait, 0.95)}"
+            )
+
+        total_cost = sum(self.cost_by_kind.values())
+        prompt = sum(count for (_, name), count in self.tokens.items() if name == "prompt")
+        cached = sum(count for (_, name), count in self.tokens.items() if name == "cached")
+        completion = sum(count for (_, name), count in self.tokens.items() if name == "completion")
+        lines.append(f"🪙 Токены: промпт {prompt} (из кэша {cached}), ответ {completion}")
+        lines.append(f"💵 Расход: ${total_cost:.4f}")
+
+        for session_id, ledger in sorted(self.ledgers.items(), key=lambda item: item[1].cost, reverse=True)[:5]:
+            marker = " ⚠️ лимит" if self.over_ceiling(session_id) else ""
+            lines.append(f"  {session_id[:8]}: ${ledger.cost:.4f}, {ledger.requests} запр.{marker}")
+        return "\n".join(lines)
+
+    def render_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in LATENCY_METRICS:
+            name = f"gm_request_{metric}_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            for (histogram_metric, kind, outcome), histogram in sorted(self.histograms.items()):
+                if histogram_metric != metric:
+                    continue
+                labels = f'kind="{kind}",outcome="{outcome}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        lines.append("# TYPE gm_requests_total counter")
+        for (kind, outcome), count in sorted(self.requests.items()):
+            lines.append(f'gm_requests_total{{kind="{kind}",outcome="{outcome}"}} {count}')
+        lines.append("# TYPE gm_tokens_total counter")
+        for (kind, name), count in sorted(self.tokens.items()):
+            lines.append(f'gm_tokens_total{{kind="{kind}",type="{name}"}} {count}')
+        lines.append("# TYPE gm_cost_usd_total counter")
+        for kind, cost in sorted(self.cost_by_kind.items()):
+            lines.append(f'gm_cost_usd_total{{kind="{kind}"}} {cost:.6f}')
+        lines.append("# TYPE gm_sessions_over_cost_ceiling gauge")
+        lines.append(f"gm_sessions_over_cost_ceiling {self.snapshot(0)['sessions_over_ceiling']}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_seconds(histogram: Optional[Histogram], q: float) -> str:
+    value = histogram.quantile(q) if histogram else None
+    return f"{value:.2f}с" if value is not None else "—"
+
+
+async def start_metrics_server(telemetry: GMTelemetry, host: str = "0.0.0.0", port: int = 9090) -> "web.AppRunner":
+    """Поднять HTTP-эндпоинт /metrics (Prometheus) и /metrics.json в текущем цикле событий"""
+    from aiohttp import web
+
+    async def metrics(request: "web.Request") -> "web.Response":
+        return web.Response(text=telemetry.render_prometheus(), content_type="text/plain")
+
+    async def metrics_json(request: "web.Request") -> "web.Response":
+        return web.json_response(telemetry.snapshot())
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/metrics.json", metrics_json)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики ГМ доступны на http://{host}:{port}/metrics")
+    return runner
@@ -246,8 +246,8 @@ class Character:
             }
         }
 
-    def to_json(self) -> str:
-        """Сериализация персонажа в JSON"""
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        """Сериализация персонажа в JSON (indent=None - компактно и заметно быстрее)"""
         data = {
             "name": self.name,
             "player_id": self.player_id,
@@ -269,7 +269,7 @@ class Character:
             "is_alive": self.is_alive,
             "conditions": self.conditions
         }
-        return json.dumps(data, ensure_ascii=False, indent=2)
+        return json.dumps(data, ensure_ascii=False, indent=indent)
 
     @classmethod
     def from_json(cls, json_data: str):
@@ -4,6 +4,7 @@
 
 import json
 import uuid
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from dataclasses import dataclass, asdict
 from typing import Dict, List, Optional, Any
@@ -77,6 +78,18 @@ class GameSession:
         self.events: List[GameEvent] = []
         self.story_log: List[str] = []
 
+        # Ревизии частей состояния: растут при каждом изменении, по ним ГМ
+        # понимает, какие заранее собранные фрагменты контекста устарели
+        self.roster_revision = 0  # состав группы
+        self.hp_revision = 0  # хиты персонажей
+        self.scene_revision = 0  # текущая сцена
+        self.pools_revision = 0  # Hope/Fear
+
+        # Ключи уже применённых побочных эффектов (бросков, урона): повторно
+        # доставленный апдейт не наносит урон и не двигает пулы второй раз
+        self.applied_effects: "OrderedDict[str, None]" = OrderedDict()
+        self.max_applied_effects = 1024
+
         # Настройки сессии
         self.settings = {
             "auto_save": True,
@@ -94,6 +107,7 @@ class GameSession:
             return False
 
         self.characters[player_id] = character
+        self.roster_revision += 1
         self._log_event("player_joined", None, f"{character.name} присоединился к игре")
         return True
 
@@ -104,6 +118,7 @@ class GameSession:
 
         character_name = self.characters[player_id].name
         del self.characters[player_id]
+        self.roster_revision += 1
         self._log_event("player_left", None, f"{character_name} покинул игру")
         return True
 
@@ -136,6 +151,7 @@ class GameSession:
         # В боевой сцене определяем порядок ходов
         if scene_type == SceneType.ACTION and character_ids:
             self.current_scene.current_turn = character_ids[0]
+        self.scene_revision += 1
 
         self._log_event("scene_started", None, f"Начата сцена: {description}")
 
@@ -144,6 +160,7 @@ class GameSession:
         if self.current_scene:
             scene_desc = self.current_scene.description
             self.current_scene = None
+            self.scene_revision += 1
             self._log_event("scene_ended", None, f"Завершена сцена: {scene_desc}")
 
     def next_turn(self):
@@ -172,20 +189,35 @@ class GameSession:
         character_name = self.characters[active_chars[next_index]].name
         self._log_event("turn_started", active_chars[next_index], f"Ход {character_name}")
 
+    def claim_effect(self, key: str) -> bool:
+        """Отметить эффект с ключом идемпотентности применённым; False - он уже применялся"""
+        if key in self.applied_effects:
+            return False
+        self.applied_effects[key] = None
+        while len(self.applied_effects) > self.max_applied_effects:
+            self.applied_effects.popitem(last=False)
+        return True
+
     def make_character_roll(self, player_id: str, trait_name: str, difficulty: int = 12,
-                            advantage: bool = False, disadvantage: bool = False) -> Dict:
-        """Персонаж совершает бросок"""
+                            advantage: bool = False, disadvantage: bool = False,
+                            idempotency_key: Optional[str] = None) -> Dict:
+        """Персонаж совершает бросок (с ключом - не больше одного раза на ключ)"""
         if player_id not in self.characters:
             return {"error": "Персонаж не найден"}
 
+        if idempotency_key and not self.claim_effect(idempotency_key):
+            return {"error": "Этот бросок уже сделан"}
+
         character = self.characters[player_id]
         result = character.make_action_roll(trait_name, difficulty, advantage, disadvantage)
 
         # Обновляем пулы Hope/Fear
         if result["dice_roll"].result_type == ActionResult.SUCCESS_WITH_HOPE:
             self.global_hope += 1
+            self.pools_revision += 1
         elif result["dice_roll"].result_type == ActionResult.SUCCESS_WITH_FEAR:
             self.global_fear += 1
+            self.pools_revision += 1
 
         # Логируем событие
         self._log_event(
@@ -204,6 +236,7 @@ class GameSession:
 
         character = self.characters[player_id]
         damage_result = character.take_damage(damage)
+        self.hp_revision += 1
 
         description = f"{character.name} получает {damage_result['damage_dealt']} урона"
         if damage_result['damage_blocked'] > 0:
@@ -228,6 +261,7 @@ class GameSession:
         old_hp = character.current_hp
         character.heal(amount)
         actual_healing = character.current_hp - old_hp
+        self.hp_revision += 1
 
         description = f"{character.name} восстанавливает {actual_healing} хитов"
         if source:
@@ -251,6 +285,7 @@ class GameSession:
         """Потратить Hope из глобального пула"""
         if self.global_hope >= amount:
             self.global_hope -= amount
+            self.pools_revision += 1
             self._log_event("hope_spent", None, f"Потрачено {amount} Hope")
             return True
         return False
@@ -259,6 +294,7 @@ class GameSession:
         """Потратить Fear из пула ГМ"""
         if self.global_fear >= amount:
             self.global_fear -= amount
+            self.pools_revision += 1
             self._log_event("fear_spent", None, f"ГМ тратит {amount} Fear")
             return True
         return False
@@ -0,0 +1,37 @@
+"""
+Долговременное хранение в SQLite
+"""
+
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+from config import DATABASE_URL
+
+_connections: Dict[str, sqlite3.Connection] = {}
+_lock = threading.Lock()
+
+
+def get_sqlite_path(database_url: str = DATABASE_URL) -> str:
+    """Путь к файлу базы из URL вида sqlite:///daggerheart.db"""
+    prefix = "sqlite:///"
+    if not database_url.startswith(prefix):
+        raise ValueError(f"Поддерживается только SQLite: {database_url}")
+    return database_url[len(prefix):] or ":memory:"
+
+
+def get_connection(path: Optional[str] = None) -> sqlite3.Connection:
+    """
+    Общее соединение с базой (одно на файл)
+
+    WAL позволяет процессу Mini App читать базу, пока бот пишет.
+    """
+    path = path or get_sqlite_path()
+    with _lock:
+        connection = _connections.get(path)
+        if connection is None:
+            connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            _connections[path] = connection
+        return connection
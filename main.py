@@ -1,15 +1,38 @@
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+from bot.startup import startup
+from telegram import Update, InlineKeyboardMarkup, Message
+from telegram.ext import (
+    Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes, CallbackQueryHandler
+)
 import asyncio
+import importlib
 import json
 import os
-from config import BOT_TOKEN, WEBAPP_URL
+import signal
+import sys
+from typing import Awaitable, Dict, Optional, Tuple
+from config import (
+    BOT_TOKEN, WEBAPP_URL, PORT, GM_FALLBACK, GM_TELEMETRY, ADMIN_IDS, BOT_PERSISTENCE, BOT_MODE, WEBHOOK_SETTINGS,
+    BOT_CONCURRENCY, BOT_SEND_QUEUE, BOT_CALLBACKS, BOT_DEBOUNCE, BOT_TABLES, BOT_DEDUP
+)
 
 # Импорты игровой механики
 from game.game_session import session_manager, GameSession, SceneType
 from game.character import Character, create_starting_character
-from deepseek.gm_api import process_gm_action, start_new_scene
+from deepseek.effects import TRAIT_KEYS, TRAIT_NAMES_RU
+# deepseek.gm_api (aiohttp, промпты, глобальный DaggerheartGM) и bot.webhook импортируются
+# там, где нужны: ГМ догружается в фоне после старта, и бот отвечает на /start, не дожидаясь его
+from deepseek.telemetry import start_metrics_server
+from game.storage import get_connection
+from bot.persistence import SQLitePersistence
+from bot.updates import ChatOrderedUpdateProcessor
+from bot.send_queue import SendQueue
+from bot.callbacks import CallbackPayload, CallbackRouter, CallbackStore
+from bot.debounce import MessageDebouncer
+from bot.dedup import UpdateDeduplicator
+from bot.tables import TableFanout, is_table_chat, table_text
+from bot.keyboards import (HELP_TEXT, NO_CHARACTER_TEXT, ROLL_COMMAND_TEXT, ROLL_MENU_TEXT, StaticUI,
+                           MAX_DIFFICULTY, roll_request)
 
 # Настройка логирования
 logging.basicConfig(
@@ -17,94 +40,104 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+startup.mark("bot_imported")
+
+# Обычные сообщения - действия игроков для ГМ
+ACTION_MESSAGES = filters.TEXT & ~filters.COMMAND
 
 
 class DaggerheartBot:
     def __init__(self):
-        self.application = Application.builder().token(BOT_TOKEN).build()
+        # Данные игроков (context.user_data: "character", "session_id") переживают перезапуск
+        self.persistence = SQLitePersistence(get_connection(), sessions=session_manager, **BOT_PERSISTENCE)
+        # Долгий ответ ГМ одному игроку не задерживает апдейты других чатов
+        self.update_processor = ChatOrderedUpdateProcessor(**BOT_CONCURRENCY, tracker=self.persistence)
+        # Исходящие сообщения - в пределах лимитов Telegram, без 429 под нагрузкой
+        self.send_queue = SendQueue(**BOT_SEND_QUEUE)
+        self.application = (Application.builder().token(BOT_TOKEN).persistence(self.persistence)
+                            .concurrent_updates(self.update_processor).rate_limiter(self.send_queue)
+                            .post_init(self.on_startup).post_stop(self.on_stop)
+                            .post_shutdown(self.on_shutdown).build())
+        # Повторно доставленный апдейт (переподключение, повтор вебхука) не обрабатывается дважды
+        self.dedup = UpdateDeduplicator(**BOT_DEDUP)
+        self.callbacks = CallbackRouter(
+            CallbackStore(BOT_CALLBACKS["state_ttl"], BOT_CALLBACKS["max_states"]),
+            dedup_window=BOT_CALLBACKS["dedup_window"]
+        )
         self.setup_handlers()
-
-        # Хранилище пользовательских данных
-        self.user_sessions = {}  # user_id -> session_id
-        self.user_characters = {}  # user_id -> Character
+        # Клавиатуры и тексты, одинаковые для всех игроков, собираются один раз
+        self.ui = StaticUI(self.callbacks, WEBAPP_URL)
+        # Несколько быстрых сообщений игрока - одно действие для ГМ
+        self.debouncer = MessageDebouncer(**BOT_DEBOUNCE)
+        # Столы в групповых чатах: общее - одним сообщением в чат, личное - пачкой
+        self.tables = TableFanout(**BOT_TABLES)
+        self.metrics_runner = None
+        self.gm_preload: Optional[asyncio.Future] = None
+        startup.mark("bot_created")
 
     def setup_handlers(self):
         """Настройка обработчиков команд"""
+        self.application.add_handler(TypeHandler(Update, startup.on_update), group=-3)
+        self.application.add_handler(TypeHandler(Update, self.dedup.check), group=-2)
+        self.application.add_handler(TypeHandler(Update, self.drain_actions), group=-1)
         self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(CommandHandler("help", self.help))
         self.application.add_handler(CommandHandler("game", self.start_game))
         self.application.add_handler(CommandHandler("session", self.session_info))
         self.application.add_handler(CommandHandler("roll", self.roll_dice))
         self.application.add_handler(CommandHandler("character", self.character_info))
-        self.application.add_handler(CallbackQueryHandler(self.button_callback))
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+        self.application.add_handler(CommandHandler("gmstats", self.gm_stats))
+        self.application.add_handler(CallbackQueryHandler(self.callbacks.dispatch))
+        self.setup_callbacks()
+        self.application.add_handler(MessageHandler(ACTION_MESSAGES, self.handle_message))
+
+    def setup_callbacks(self):
+        """Настройка обработчиков кнопок (префикс callback_data -> обработчик)"""
+        self.callbacks.route("start_game", lambda update, context, payload: self.start_game(update, context))
+        self.callbacks.route("session_status", lambda update, context, payload: self.session_info(update, context))
+        self.callbacks.route("quick_roll", self.on_quick_roll)
+        self.callbacks.route("roll", self.on_roll)
+        # Бросок, запрошенный ГМ, делается один раз
+        self.callbacks.route("gm_roll", self.on_gm_roll, once=True)
+        self.callbacks.route("join_table", self.on_join_table)
+
+    async def drain_actions(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Команда или кнопка ждёт действий, уже написанных в этом чате: склеенные
+        сообщения обрабатываются вне очереди чата, и без этого /roll сразу после
+        сообщения обогнал бы само действие
+        """
+        if update.effective_chat and not ACTION_MESSAGES.check_update(update):
+            await self.debouncer.drain(update.effective_chat.id)
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
-        user = update.effective_user
-        welcome_text = f"""
-🗡️ Добро пожаловать в Daggerheart Bot, {user.first_name}!
-
-Я помогу тебе играть в Daggerheart с ИИ Гейммастером на базе DeepSeek.
-
-🎮 Основные команды:
-/game - Начать новую игру или продолжить
-/character - Информация о персонаже
-/session - Статус игровой сессии
-/roll - Бросить кости
-/help - Подробная помощь
-
-Готов к приключениям? 🎲
-        """
-
-        keyboard = [
-            [InlineKeyboardButton("🎮 Начать игру", callback_data="start_game")],
-            [InlineKeyboardButton("🎯 Открыть Mini App", web_app=WebAppInfo(url=WEBAPP_URL))],
-            [InlineKeyboardButton("📚 Правила", url="https://ru.daggerheart.su/rule")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
+        welcome_text = self.ui.welcome_text(update.effective_user.first_name)
+        reply_markup = self.ui.group_start_markup if is_table_chat(update.effective_chat) else self.ui.start_markup
         await update.message.reply_text(welcome_text, reply_markup=reply_markup)
 
     async def help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /help"""
-        help_text = """
-📖 Подробная помощь по Daggerheart Bot
-
-🎮 **Основные команды:**
-/start - Главное меню
-/game - Управление игрой
-/character - Информация о персонаже
-/session - Статус сессии
-/roll [характеристика] - Бросок костей
-
-🎲 **Броски костей:**
-/roll strength - Бросок силы
-/roll agility - Бросок ловкости
-/roll finesse - Бросок точности
-/roll instinct - Бросок интуиции
-/roll presence - Бросок присутствия
-/roll knowledge - Бросок знаний
-
-🎭 **Как играть:**
-1. Создай персонажа в Mini App
-2. Пиши свои действия обычными сообщениями
-3. ИИ Гейммастер отреагирует на твои действия
-4. Используй /roll когда нужны проверки
-5. Следи за Hope и Fear
-
-📚 **Правила:** https://ru.daggerheart.su/rule
-🐛 **Проблемы?** Напиши @support или попробуй /start
-        """
-        await update.message.reply_text(help_text, parse_mode='Markdown')
-
-    async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик нажатий на кнопки"""
-        query = update.callback_query
-        await query.answer()
-
-        if query.data == "start_game":
-            await self.start_game(update, context)
+        await update.message.reply_text(HELP_TEXT, parse_mode='Markdown')
+
+    async def on_quick_roll(self, update: Update, context: ContextTypes.DEFAULT_TYPE, payload: CallbackPayload):
+        """Кнопка "Бросок" - меню выбора характеристики"""
+        await update.effective_message.reply_text(
+            ROLL_MENU_TEXT, reply_markup=self.ui.roll_menu_markup, parse_mode='Markdown'
+        )
+
+    async def on_roll(self, update: Update, context: ContextTypes.DEFAULT_TYPE, payload: CallbackPayload):
+        """Кнопка характеристики из меню бросков: roll:<характеристика>"""
+        await self._perform_roll(update, context, payload.args[0])
+
+    async def on_gm_roll(self, update: Update, context: ContextTypes.DEFAULT_TYPE, payload: CallbackPayload):
+        """Бросок, запрошенный ГМ: gm_roll:<характеристика>:<сложность>"""
+        roll = roll_request(*payload.args) if len(payload.args) == 2 else None
+        if roll is None:
+            logger.warning(f"Некорректная кнопка броска: {payload.args}")
+            await update.effective_message.reply_text("❌ Кнопка устарела. Брось через /roll.")
+            return
+        await self._perform_roll(update, context, *roll, narrate=True)
 
     async def start_game(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Запуск игровой сессии"""
@@ -113,27 +146,14 @@ class DaggerheartBot:
 
         logger.info(f"🎮 Запуск игры для {user_name} (ID: {user_id})")
 
-        # Проверяем, есть ли уже персонаж
-        if user_id not in self.user_characters:
-            game_text = """
-🎮 **Создание персонажа**
-
-У тебя еще нет персонажа! Нажми кнопку ниже, чтобы открыть создание персонажа в Mini App.
-
-В интерфейсе ты сможешь:
-✨ Выбрать класс и происхождение
-🎯 Распределить характеристики
-⚔️ Получить стартовое снаряжение
-🃏 Выбрать способности
-
-После создания персонажа возвращайся сюда!
-            """
+        if is_table_chat(update.effective_chat):
+            await self._start_table(update, context)
+            return
 
-            keyboard = [
-                [InlineKeyboardButton("🎨 Создать персонажа", web_app=WebAppInfo(url=WEBAPP_URL))],
-                [InlineKeyboardButton("📖 Правила создания", url="https://ru.daggerheart.su/rule")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        # Проверяем, есть ли уже персонаж
+        if "character" not in context.user_data:
+            game_text = NO_CHARACTER_TEXT
+            reply_markup = self.ui.no_character_markup
 
             if update.callback_query:
                 await update.callback_query.edit_message_text(game_text, reply_markup=reply_markup,
@@ -143,42 +163,44 @@ class DaggerheartBot:
             return
 
         # Есть персонаж, проверяем сессию
-        character = self.user_characters[user_id]
-        session_id = self.user_sessions.get(user_id)
+        character = context.user_data["character"]
+        session_id = context.user_data.get("session_id")
+        if session_id and not session_manager.get_session(session_id):
+            # Персонаж сохранился, а сессии живут в памяти и не пережили перезапуск
+            await self._forget_session(session_id)
+            session_id = None
+
+        reply_markup = self.ui.game_markup
 
         if not session_id:
-            # Создаем новую сессию
+            # Создаем новую сессию (только в памяти - это быстро)
             session_id = session_manager.create_session(user_id, f"Приключение {character.name}")
             session = session_manager.get_session(session_id)
             session.add_player(user_id, character)
             session.start_session()
-            self.user_sessions[user_id] = session_id
+            context.user_data["session_id"] = session_id
 
             logger.info(f"✨ Создана новая сессия {session_id} для {user_name}")
 
-            # Генерируем начальную сцену
-            try:
-                scene_description = await start_new_scene(session_id, "exploration", "начальная локация")
+            # Конвейер: сцена генерируется и соединение с API прогревается, пока
+            # игрок уже читает заголовок; сцена вписывается в него по готовности
+            await self._gm_loaded()
+            from deepseek.gm_api import start_new_scene, warmup_gm
 
-                game_text = f"""
-🎭 **Игра началась!**
-
-**Твой персонаж:** {character.name}
-**Класс:** {character.character_class.name_ru if character.character_class else 'Неизвестно'}
-**Происхождение:** {character.ancestry.name_ru if character.ancestry else 'Неизвестно'}
-
----
-
-{scene_description}
-
----
-
-💫 **Hope:** {character.progress.hope}/{character.progress.max_hope}
-❤️ **Хиты:** {character.current_hp}/{character.hit_points}
+            warmup_gm()
+            scene_task = asyncio.ensure_future(start_new_scene(session_id, "exploration", "начальная локация"))
 
-*Опиши, что хочешь сделать! ИИ Гейммастер среагирует на твои действия.*
-                """
+            try:
+                header = await self._send_game_text(update, self._new_game_text(character), reply_markup)
+                await header.chat.send_action("typing")
+            except BaseException:
+                # Заголовок не ушёл - сцену некуда вписать: генерацию не ждём, её ошибку не теряем
+                if not scene_task.cancel() and not scene_task.cancelled():
+                    scene_task.exception()
+                raise
 
+            try:
+                game_text = self._new_game_text(character, await scene_task)
             except Exception as e:
                 logger.error(f"Ошибка генерации сцены: {e}")
                 game_text = f"""
@@ -190,10 +212,17 @@ class DaggerheartBot:
 Опиши, что хочешь сделать!
                 """
 
+            await header.edit_text(game_text, reply_markup=reply_markup, parse_mode='Markdown')
+
         else:
             # Продолжаем существующую сессию
             session = session_manager.get_session(session_id)
             if session:
+                # Игрок, скорее всего, сейчас напишет действие - соединение понадобится
+                await self._gm_loaded()
+                from deepseek.gm_api import warmup_gm
+
+                warmup_gm()
                 status = session.get_session_status()
                 recent_events = session.get_recent_events(3)
 
@@ -218,30 +247,163 @@ class DaggerheartBot:
             else:
                 game_text = "❌ Ошибка: сессия не найдена. Попробуй /start"
 
-        keyboard = [
-            [InlineKeyboardButton("🎲 Бросить кости", callback_data="quick_roll")],
-            [InlineKeyboardButton("📊 Статус сессии", callback_data="session_status")],
-            [InlineKeyboardButton("🎨 Редактировать персонажа", web_app=WebAppInfo(url=WEBAPP_URL))]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+            await self._send_game_text(update, game_text, reply_markup)
+
+    async def _start_table(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/game в группе: один стол (сессия) на чат, игроки садятся за него кнопкой"""
+        chat = update.effective_chat
+        session_id = context.chat_data.get("session_id")
+        session = session_manager.get_session(session_id) if session_id else None
+
+        if not session:
+            if session_id:
+                await self._forget_session(session_id)  # прежний стол закрыт
+            session_id = session_manager.create_session(str(chat.id), f"Стол «{chat.title or chat.id}»")
+            session = session_manager.get_session(session_id)
+            context.chat_data["session_id"] = session_id
+            self.tables.track(session)
+            logger.info(f"✨ Создан стол {session_id} в чате {chat.id}")
+
+        # Тот, кто позвал /game, садится за стол сразу, если у него есть персонаж
+        if "character" in context.user_data:
+            self._seat_player(session, str(update.effective_user.id), context.user_data["character"])
+
+        table_message = await self._send_game_text(update, table_text(session), self.ui.table_markup)
+        if session.start_session():
+            await self._open_table_scene(table_message, session)
 
+    async def on_join_table(self, update: Update, context: ContextTypes.DEFAULT_TYPE, payload: CallbackPayload):
+        """Кнопка "Присоединиться" под сообщением стола"""
+        message = update.effective_message
+        user = update.effective_user
+        session_id = context.chat_data.get("session_id")
+        session = session_manager.get_session(session_id) if session_id else None
+        if not session:
+            await message.reply_text("❌ Этот стол уже закрыт. Начните новую игру: /game")
+            return
+
+        if "character" not in context.user_data:
+            await message.reply_text(
+                f"🎨 {user.first_name}, сначала создай персонажа в личном чате со мной, "
+                f"потом нажми «Присоединиться»."
+            )
+            return
+
+        user_id = str(user.id)
+        if user_id in session.characters:
+            return
+        if not self._seat_player(session, user_id, context.user_data["character"]):
+            await message.reply_text("❌ За столом нет свободных мест.")
+            return
+
+        # Несколько игроков садятся почти одновременно - очередь отправки склеит правки состава
+        await message.edit_text(table_text(session), reply_markup=self.ui.table_markup, parse_mode='Markdown')
+        if session.start_session():
+            await self._open_table_scene(message, session)
+
+    @staticmethod
+    def _seat_player(session: GameSession, user_id: str, character: Character) -> bool:
+        """Посадить игрока за стол; в идущей сцене он ходит после остальных"""
+        if not session.add_player(user_id, character):
+            return False
+        scene = session.current_scene
+        if scene and user_id not in scene.active_characters:
+            scene.active_characters.append(user_id)
+        return True
+
+    async def _open_table_scene(self, table_message: Message, session: GameSession):
+        """Начальная сцена стола: генерируется один раз и показывается всем в чате"""
+        await self._gm_loaded()
+        from deepseek.gm_api import start_new_scene, warmup_gm
+
+        warmup_gm()
+        await table_message.chat.send_action("typing")
+        try:
+            scene = await start_new_scene(session.session_id, "exploration", "начальная локация")
+        except Exception as e:
+            logger.error(f"Ошибка генерации сцены: {e}")
+            scene = "Приключение начинается... (Гейммастер готовится)"
+        await table_message.reply_text(
+            f"🎭 **Игра началась!**\n\n{scene}\n\n"
+            f"*Отвечайте на сообщения ГМ своими действиями - он ответит всему столу.*",
+            reply_markup=self.ui.gm_reply_markup(()), parse_mode='Markdown'
+        )
+
+    async def _forget_session(self, session_id: str):
+        """Сессии больше нет - забыть её стол и историю ГМ (в том числе сброшенную в базу)"""
+        await self._gm_loaded()
+        from deepseek.gm_api import forget_session
+
+        self.tables.forget(session_id)
+        forget_session(session_id)
+
+    @staticmethod
+    def _session_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[str]:
+        """Сессия апдейта: в группе - стол чата, в личке - своя игра игрока"""
+        data = context.chat_data if is_table_chat(update.effective_chat) else context.user_data
+        return data.get("session_id")
+
+    async def _table_lines(self, update: Update, session_id: str, user_id: str, end_turn: bool) -> str:
+        """
+        События стола после действия: смена хода - строками к ответу в чат,
+        личное игрокам уходит пачкой в личку. Вне групп - пустая строка.
+
+        Args:
+            end_turn: Действие игрока, чей сейчас ход, - ход переходит к следующему
+        """
+        if not is_table_chat(update.effective_chat):
+            return ""
+        session = session_manager.get_session(session_id)
+        if not session:
+            await self._forget_session(session_id)
+            return ""
+        if end_turn and session.current_scene and session.current_scene.current_turn == user_id:
+            session.next_turn()
+        return "".join(f"\n{line}" for line in self.tables.collect(session, update.get_bot()))
+
+    @staticmethod
+    def _new_game_text(character: Character, scene_description: Optional[str] = None) -> str:
+        """Сообщение о начале игры; без описания сцены - заголовок, пока ГМ её готовит"""
+        scene = scene_description or "⏳ _Гейммастер описывает начальную сцену..._"
+        return f"""
+🎭 **Игра началась!**
+
+**Твой персонаж:** {character.name}
+**Класс:** {character.character_class.name_ru if character.character_class else 'Неизвестно'}
+**Происхождение:** {character.ancestry.name_ru if character.ancestry else 'Неизвестно'}
+
+---
+
+{scene}
+
+---
+
+💫 **Hope:** {character.progress.hope}/{character.progress.max_hope}
+❤️ **Хиты:** {character.current_hp}/{character.hit_points}
+
+*Опиши, что хочешь сделать! ИИ Гейммастер среагирует на твои действия.*
+                """
+
+    @staticmethod
+    async def _send_game_text(update: Update, text: str, reply_markup: InlineKeyboardMarkup) -> Message:
+        """Показать сообщение игры: заменить сообщение с кнопкой или ответить на команду"""
         if update.callback_query:
-            await update.callback_query.edit_message_text(game_text, reply_markup=reply_markup, parse_mode='Markdown')
-        else:
-            await update.message.reply_text(game_text, reply_markup=reply_markup, parse_mode='Markdown')
+            return await update.callback_query.edit_message_text(text, reply_markup=reply_markup,
+                                                                 parse_mode='Markdown')
+        return await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
     async def session_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Информация о текущей сессии"""
-        user_id = str(update.effective_user.id)
-        session_id = self.user_sessions.get(user_id)
+        message = update.effective_message  # команда /session или кнопка "Статус"
+        session_id = self._session_id(update, context)
 
         if not session_id:
-            await update.message.reply_text("❌ У тебя нет активной игровой сессии. Используй /game для начала игры.")
+            await message.reply_text("❌ У тебя нет активной игровой сессии. Используй /game для начала игры.")
             return
 
         session = session_manager.get_session(session_id)
         if not session:
-            await update.message.reply_text("❌ Сессия не найдена. Попробуй начать новую игру с /game")
+            await message.reply_text("❌ Сессия не найдена. Попробуй начать новую игру с /game")
             return
 
         status = session.get_session_status()
@@ -273,18 +435,16 @@ class DaggerheartBot:
             for event in recent_events:
                 session_text += f"• {event['description']}\n"
 
-        await update.message.reply_text(session_text, parse_mode='Markdown')
+        await message.reply_text(session_text, parse_mode='Markdown')
 
     async def roll_dice(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Бросок костей"""
-        user_id = str(update.effective_user.id)
-
         # Проверяем, есть ли персонаж и сессия
-        if user_id not in self.user_characters:
+        if "character" not in context.user_data:
             await update.message.reply_text("❌ У тебя нет персонажа! Используй /game для создания.")
             return
 
-        session_id = self.user_sessions.get(user_id)
+        session_id = self._session_id(update, context)
         if not session_id:
             await update.message.reply_text("❌ У тебя нет активной сессии! Используй /game для начала игры.")
             return
@@ -298,64 +458,118 @@ class DaggerheartBot:
         args = context.args
         if not args:
             # Показываем меню выбора характеристики
-            keyboard = [
-                [InlineKeyboardButton("💪 Сила", callback_data="roll_strength"),
-                 InlineKeyboardButton("🤸 Ловкость", callback_data="roll_agility")],
-                [InlineKeyboardButton("🎯 Точность", callback_data="roll_finesse"),
-                 InlineKeyboardButton("👁️ Интуиция", callback_data="roll_instinct")],
-                [InlineKeyboardButton("👑 Присутствие", callback_data="roll_presence"),
-                 InlineKeyboardButton("📚 Знания", callback_data="roll_knowledge")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
             await update.message.reply_text(
-                "🎲 **Выбери характеристику для броска:**\n\n"
-                "Или используй: `/roll [характеристика]`\n"
-                "Например: `/roll strength`",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
+                ROLL_COMMAND_TEXT, reply_markup=self.ui.roll_menu_markup, parse_mode='Markdown'
             )
             return
 
         trait_name = args[0].lower()
-        difficulty = int(args[1]) if len(args) > 1 else 12
+        difficulty = 12
+        if len(args) > 1:
+            roll = roll_request(trait_name, args[1])
+            if roll is None and trait_name in TRAIT_KEYS:
+                await update.message.reply_text(f"❌ Сложность - целое число от 1 до {MAX_DIFFICULTY}")
+                return
+            difficulty = roll[1] if roll else 12
+
+        await self._perform_roll(update, context, trait_name, difficulty)
+
+    async def _perform_roll(self, update: Update, context: ContextTypes.DEFAULT_TYPE, trait_name: str,
+                            difficulty: int = 12, narrate: bool = False):
+        """
+        Бросок характеристики (команда /roll или кнопка)
 
-        # Проверяем валидность характеристики
-        valid_traits = ['strength', 'agility', 'finesse', 'instinct', 'presence', 'knowledge']
-        trait_names_ru = {
-            'strength': 'сила', 'agility': 'ловкость', 'finesse': 'точность',
-            'instinct': 'интуиция', 'presence': 'присутствие', 'knowledge': 'знания'
-        }
+        Args:
+            narrate: Бросок запрошен ГМ - после результата отправить описание исхода
+        """
+        user_id = str(update.effective_user.id)
+        message = update.effective_message
 
-        if trait_name not in valid_traits:
-            await update.message.reply_text(
+        session_id = self._session_id(update, context)
+        session = session_manager.get_session(session_id) if session_id else None
+        if not session:
+            await message.reply_text("❌ У тебя нет активной сессии! Используй /game для начала игры.")
+            return
+
+        # Проверяем валидность характеристики
+        if trait_name not in TRAIT_KEYS:
+            await message.reply_text(
                 f"❌ Неизвестная характеристика: {trait_name}\n"
-                f"Доступные: {', '.join(valid_traits)}"
+                f"Доступные: {', '.join(TRAIT_KEYS)}"
             )
             return
 
         # Совершаем бросок
-        result = session.make_character_roll(user_id, trait_name, difficulty)
+        result = session.make_character_roll(user_id, trait_name, difficulty,
+                                             idempotency_key=f"{update.update_id}:roll")
 
         if 'error' in result:
-            await update.message.reply_text(f"❌ Ошибка: {result['error']}")
+            await message.reply_text(f"❌ Ошибка: {result['error']}")
             return
 
         # Форматируем результат
-        trait_ru = trait_names_ru.get(trait_name, trait_name)
+        trait_ru = TRAIT_NAMES_RU.get(trait_name, trait_name)
         roll_text = f"🎲 **Бросок {trait_ru}**\n\n{result['formatted_result']}"
 
-        await update.message.reply_text(roll_text, parse_mode='Markdown')
+        await message.reply_text(roll_text, parse_mode='Markdown')
+
+        if not narrate:
+            return
+
+        # Описание исхода обычно заготовлено заранее, пока игрок читал ответ ГМ
+        await self._gm_loaded()
+        from deepseek.gm_api import narrate_roll
+
+        await message.chat.send_action("typing")
+        action = f"бросок ({trait_ru}) против сложности {difficulty}"
+        gm_result, placeholder = await self._await_gm_reply(
+            message, session_id, user_id, action,
+            narrate_roll(session_id, user_id, trait_name, difficulty, result,
+                         action_key=f"{update.update_id}:narrate")
+        )
+        if gm_result.get("success"):
+            table_lines = await self._table_lines(update, session_id, user_id, end_turn=False)
+            gm_response = gm_result["gm_response"] + table_lines
+            await self._send_gm_text(message, placeholder, gm_response)
+        else:
+            fallback = gm_result.get("fallback_response", "ГМ временно недоступен...")
+            await self._send_gm_text(message, placeholder, f"🎭 {fallback}")
+
+    async def _await_gm_reply(self, message: Message, session_id: str, user_id: str, action: str,
+                              gm_call: Awaitable[Dict]) -> Tuple[Dict, Optional[Message]]:
+        """
+        Дождаться ответа ГМ, не оставляя игрока без ответа дольше SLO
+
+        Если ГМ не успевает, сразу отправляется описание локального рассказчика;
+        это сообщение возвращается, чтобы потом заменить его настоящим ответом.
+        """
+        task = asyncio.ensure_future(gm_call)
+        placeholder = None
+        if GM_FALLBACK["enabled"]:
+            done, _ = await asyncio.wait({task}, timeout=GM_FALLBACK["latency_slo"])
+            if not done:
+                from deepseek.gm_api import narrate_locally
+
+                local_text = narrate_locally(session_id, user_id, action)
+                placeholder = await message.reply_text(f"🎭 {local_text}\n\n⏳ ГМ продолжает описание...")
+                await message.chat.send_action("typing")
+        return await task, placeholder
+
+    async def _send_gm_text(self, message: Message, placeholder: Optional[Message], text: str,
+                            reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """Отправить ответ ГМ или заменить им уже показанное локальное описание"""
+        if placeholder:
+            await placeholder.edit_text(text, reply_markup=reply_markup)
+        else:
+            await message.reply_text(text, reply_markup=reply_markup)
 
     async def character_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Информация о персонаже"""
-        user_id = str(update.effective_user.id)
-
-        if user_id not in self.user_characters:
+        if "character" not in context.user_data:
             await update.message.reply_text("❌ У тебя нет персонажа! Используй /game для создания.")
             return
 
-        character = self.user_characters[user_id]
+        character = context.user_data["character"]
         char_sheet = character.get_character_sheet()
 
         char_text = f"""
@@ -389,28 +603,27 @@ class DaggerheartBot:
 {chr(10).join([f"• {card}" for card in char_sheet['domain_cards']]) if char_sheet['domain_cards'] else "Нет"}
         """
 
-        keyboard = [
-            [InlineKeyboardButton("🎨 Редактировать", web_app=WebAppInfo(url=WEBAPP_URL))],
-            [InlineKeyboardButton("🎲 Бросить кости", callback_data="quick_roll")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
+        reply_markup = None if is_table_chat(update.effective_chat) else self.ui.character_markup
         await update.message.reply_text(char_text, reply_markup=reply_markup, parse_mode='Markdown')
 
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка обычных сообщений - взаимодействие с ГМ"""
-        user_id = str(update.effective_user.id)
-        user_message = update.message.text
+        if is_table_chat(update.effective_chat):
+            # В группе действия пишут только игроки за столом, остальное - обычная переписка чата
+            session_id = context.chat_data.get("session_id")
+            session = session_manager.get_session(session_id) if session_id else None
+            if not session or str(update.effective_user.id) not in session.characters:
+                return
 
         # Проверяем, есть ли персонаж и сессия
-        if user_id not in self.user_characters:
+        elif "character" not in context.user_data:
             await update.message.reply_text(
                 "🎭 Чтобы играть, сначала создай персонажа!\n"
                 "Используй /game для начала."
             )
             return
 
-        session_id = self.user_sessions.get(user_id)
+        session_id = self._session_id(update, context)
         if not session_id:
             await update.message.reply_text(
                 "🎭 У тебя нет активной игровой сессии!\n"
@@ -418,14 +631,51 @@ class DaggerheartBot:
             )
             return
 
-        # Показываем индикатор печати
-        await update.message.chat.send_action("typing")
+        if not self.debouncer.enabled:
+            # Показываем индикатор печати
+            await update.message.chat.send_action("typing")
+            await self._process_action(update, session_id, update.message.text)
+            return
+
+        # Сообщения, пришедшие в окне склейки, уйдут ГМ одним действием; обработчик
+        # не ждёт окна, чтобы следующие сообщения чата обрабатывались сразу. Действия
+        # одного чата (стола) отдаются ГМ по очереди - у них одна сессия
+        self.debouncer.submit(
+            (update.effective_chat.id, update.effective_user.id), update.message.text,
+            lambda text: self._process_action(update, session_id, text),
+            keepalive=lambda: update.message.chat.send_action("typing"),
+            turn=update.effective_chat.id
+        )
+
+    async def _process_action(self, update: Update, session_id: str, user_message: str):
+        """Отправить действие игрока ГМ и показать ответ"""
+        await self._gm_loaded()
+        from deepseek.gm_api import check_gm_admission, process_gm_action
+
+        user_id = str(update.effective_user.id)
+
+        # Контроль допуска: при перегрузке сразу говорим игроку, а не висим в очереди
+        busy_message = check_gm_admission(session_id)
+        if busy_message:
+            await update.message.reply_text(busy_message)
+            return
 
         try:
             # Отправляем действие ИИ Гейммастеру
             logger.info(f"🎭 Действие игрока {user_id}: {user_message}")
 
-            gm_result = await process_gm_action(session_id, user_id, user_message)
+            # Запрошенные броски собираем по мере разбора эффектов (в JSON-режиме - до конца ответа)
+            roll_requests = []
+
+            async def on_effect(effect):
+                roll = roll_request(effect.get("trait"), effect.get("difficulty"))
+                if effect.get("type") == "request_roll" and roll:
+                    roll_requests.append(roll)
+
+            gm_result, placeholder = await self._await_gm_reply(
+                update.message, session_id, user_id, user_message,
+                process_gm_action(session_id, user_id, user_message, on_effect, action_key=str(update.update_id))
+            )
 
             if gm_result.get("success"):
                 gm_response = gm_result["gm_response"]
@@ -437,33 +687,18 @@ class DaggerheartBot:
                     fear = context_info.get("fear", 0)
                     gm_response += f"\n\n💫 Hope: {hope} | ⚡ Fear: {fear}"
 
-                # Проверяем, нужны ли дополнительные кнопки
-                effects = gm_result.get("effects", [])
-                keyboard = []
-
-                for effect in effects:
-                    if effect.get("type") == "request_roll":
-                        trait = effect.get("trait", "strength")
-                        difficulty = effect.get("difficulty", 12)
-                        keyboard.append([InlineKeyboardButton(
-                            f"🎲 Бросить {trait} ({difficulty})",
-                            callback_data=f"roll_{trait}_{difficulty}"
-                        )])
-
-                # Всегда добавляем общие кнопки
-                keyboard.extend([
-                    [InlineKeyboardButton("🎲 Бросок", callback_data="quick_roll"),
-                     InlineKeyboardButton("📊 Статус", callback_data="session_status")]
-                ])
+                # За столом в группе: смена хода - в этом же сообщении, личное - пачкой в личку
+                gm_response += await self._table_lines(update, session_id, user_id, end_turn=True)
 
-                reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+                # Кнопки бросков и общие кнопки - из кэша по набору бросков
+                reply_markup = self.ui.gm_reply_markup(tuple(roll_requests))
 
-                await update.message.reply_text(gm_response, reply_markup=reply_markup)
+                await self._send_gm_text(update.message, placeholder, gm_response, reply_markup)
 
             else:
-                # Ошибка ИИ - используем запасной ответ
+                # Ошибка ИИ - описание локального рассказчика
                 fallback = gm_result.get("fallback_response", "ГМ временно недоступен...")
-                await update.message.reply_text(f"🎭 {fallback}")
+                await self._send_gm_text(update.message, placeholder, f"🎭 {fallback}")
 
         except Exception as e:
             logger.error(f"Ошибка обработки сообщения: {e}")
@@ -502,7 +737,7 @@ class DaggerheartBot:
                     traits
                 )
 
-                self.user_characters[user_id] = character
+                context.user_data["character"] = character
 
                 await update.message.reply_text(
                     f"✨ Персонаж **{character.name}** создан!\n"
@@ -534,166 +769,108 @@ class DaggerheartBot:
                 "Попробуй /start или обратись к администратору."
             )
 
-    def run(self):
-        """Запуск бота"""
-        logger.info("🚀 Запуск Daggerheart Bot...")
-        self.application.add_error_handler(self.error_handler)
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
-
-
-if __name__ == "__main__":
-    bot = DaggerheartBot()
-    bot.run()
-    import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-import asyncio
-import os
-from config import BOT_TOKEN, WEBAPP_URL
-
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
-logger = logging.getLogger(__name__)
-
-
-class DaggerheartBot:
-    def __init__(self):
-        self.application = Application.builder().token(BOT_TOKEN).build()
-        self.setup_handlers()
-
-    def setup_handlers(self):
-        """Настройка обработчиков команд"""
-        self.application.add_handler(CommandHandler("start", self.start))
-        self.application.add_handler(CommandHandler("help", self.help))
-        self.application.add_handler(CommandHandler("game", self.start_game))
-        self.application.add_handler(CallbackQueryHandler(self.button_callback))
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
-
-    async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик команды /start"""
-        user = update.effective_user
-        welcome_text = f"""
-🗡️ Добро пожаловать в Daggerheart Bot, {user.first_name}!
-
-Я помогу тебе играть в Daggerheart с ГМ на базе ИИ.
-
-Команды:
-/game - Начать новую игру
-/help - Помощь
-
-Готов к приключениям? 🎲
-        """
-
-        keyboard = [
-            [InlineKeyboardButton("🎮 Начать игру", callback_data="start_game")],
-            [InlineKeyboardButton("🎯 Открыть Mini App", web_app=WebAppInfo(url=WEBAPP_URL))],
-            [InlineKeyboardButton("📚 Правила", url="https://ru.daggerheart.su/rule")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await update.message.reply_text(welcome_text, reply_markup=reply_markup)
-
-    async def help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик команды /help"""
-        help_text = """
-📖 Помощь по боту Daggerheart
-
-🎮 Основные команды:
-/start - Начать работу с ботом
-/game - Запустить игровую сессию
-/help - Показать эту справку
-
-🎲 Как играть:
-1. Нажми /game или кнопку "Начать игру"
-2. Создай персонажа в веб-интерфейсе
-3. Взаимодействуй с ГМ через чат
-
-📚 Правила игры: https://ru.daggerheart.su/rule
-        """
-        await update.message.reply_text(help_text)
-
-    async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик нажатий на кнопки"""
-        query = update.callback_query
-        await query.answer()
-
-        if query.data == "start_game":
-            # Переадресуем на команду /game
-            await self.start_game(update, context)
-
-    async def start_game(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Запуск игровой сессии"""
-        user_id = update.effective_user.id
-        logger.info(f"🎮 Открытие игры для пользователя {user_id}")
-        logger.info(f"📱 Используемый WEBAPP_URL: {WEBAPP_URL}")
-
-        # Проверяем URL
-        if "your-replit" in WEBAPP_URL or not WEBAPP_URL.startswith("https://"):
-            error_msg = f"❌ Неправильный WEBAPP_URL: {WEBAPP_URL}"
-            logger.error(error_msg)
-            await update.message.reply_text(
-                "❌ Ошибка конфигурации бота!\n"
-                "Администратор должен настроить WEBAPP_URL в переменных окружения."
-            )
-            return
-
-        try:
-            keyboard = [
-                [InlineKeyboardButton(
-                    "🎮 Открыть игру",
-                    web_app=WebAppInfo(url=WEBAPP_URL)
-                )]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            logger.info(f"✅ Кнопка Mini App создана с URL: {WEBAPP_URL}")
-        except Exception as e:
-            logger.error(f"❌ Ошибка создания кнопки Mini App: {e}")
-            await update.message.reply_text("❌ Ошибка создания игрового интерфейса!")
+    async def gm_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /gmstats - телеметрия ГМ (только для администраторов)"""
+        if update.effective_user.id not in ADMIN_IDS:
             return
+        await self._gm_loaded()
+        from deepseek.gm_api import daggerheart_gm
+
+        await update.message.reply_text(
+            "\n\n".join([daggerheart_gm.telemetry.render_text(), self.update_processor.render_text(),
+                         self.dedup.render_text(), self.send_queue.render_text(), self.debouncer.render_text(),
+                         self.tables.render_text(), startup.render_text()])
+        )
+
+    async def on_startup(self, application: Application):
+        """Фоновая загрузка ГМ и запуск эндпоинта метрик, если задан порт"""
+        startup.mark("bot_ready")
+        if GM_TELEMETRY["metrics_port"]:
+            from deepseek.gm_api import daggerheart_gm
+
+            self.metrics_runner = await start_metrics_server(
+                daggerheart_gm.telemetry, port=GM_TELEMETRY["metrics_port"]
+            )
+        # Импорт идёт в потоке, пока бот уже принимает апдейты; обработчик, которому ГМ
+        # понадобится раньше, дождётся конца импорта (_gm_loaded)
+        self.gm_preload = asyncio.get_running_loop().run_in_executor(None, self._load_gm)
 
-        game_text = """
-🎮 Игровая сессия Daggerheart
-
-Нажми кнопку ниже, чтобы открыть игровой интерфейс.
-В нем ты сможешь:
-- Создать персонажа
-- Взаимодействовать с ГМ
-- Использовать игровые механики
+    @staticmethod
+    def _load_gm():
+        importlib.import_module("deepseek.gm_api")
+        startup.mark("gm_loaded")
 
-Удачи в приключениях! 🗡️
+    async def _gm_loaded(self):
         """
+        Дождаться фоновой загрузки ГМ, не останавливая цикл событий
 
-        # Определяем, откуда пришел запрос
-        if update.callback_query:
-            await update.callback_query.edit_message_text(game_text, reply_markup=reply_markup)
-        else:
-            await update.message.reply_text(game_text, reply_markup=reply_markup)
-
-    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработка обычных сообщений"""
-        # Пока что просто эхо
-        user_message = update.message.text
-
-        # Здесь будет логика обработки игровых команд
-        response = f"Получил сообщение: {user_message}\n\n(Пока что это заглушка, скоро здесь будет ГМ!)"
-
-        await update.message.reply_text(response)
-
-    async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработка ошибок"""
-        logger.error(f"Update {update} caused error {context.error}")
+        Импорт deepseek.gm_api, пока его выполняет поток загрузки, встал бы на блокировке
+        импорта прямо в цикле событий - и остановил бы обработку апдейтов всех чатов.
+        Если загрузка не удалась, следующий импорт повторит её и покажет ошибку.
+        """
+        if self.gm_preload and not self.gm_preload.done():
+            await asyncio.wait({self.gm_preload})
+
+    async def on_stop(self, application: Application):
+        """Апдейты больше не принимаются, но бот ещё может отправлять сообщения"""
+        # Накопленные сообщения игроков отдаём ГМ, а уведомления - игрокам до закрытия
+        # HTTP-клиента бота (после Application.shutdown ответы уже не уйдут)
+        await self.debouncer.close()
+        await self.tables.close()
+
+    async def on_shutdown(self, application: Application):
+        """Освобождение ресурсов при остановке"""
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
+        if self.gm_preload:
+            try:
+                await self.gm_preload
+            except Exception as e:
+                logger.error(f"ГМ так и не загрузился: {e}")
+        gm_api = sys.modules.get("deepseek.gm_api")
+        if gm_api:
+            await gm_api.daggerheart_gm.close()
+
+    async def run_webhook(self):
+        """Приём апдейтов через вебхук на PORT (там же отдаётся Mini App)"""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        from bot.webhook import WebhookServer
+
+        server = WebhookServer(self.application, WEBHOOK_SETTINGS["path"], WEBHOOK_SETTINGS["secret_token"])
+        async with self.application:
+            await self.on_startup(self.application)
+            await self.application.start()
+            try:
+                await server.start(port=PORT)
+                startup.mark("webapp_ready")
+                await self.application.bot.set_webhook(
+                    WEBHOOK_SETTINGS["url"].rstrip("/") + WEBHOOK_SETTINGS["path"],
+                    secret_token=WEBHOOK_SETTINGS["secret_token"],
+                    allowed_updates=Update.ALL_TYPES,
+                    max_connections=WEBHOOK_SETTINGS["max_connections"]
+                )
+                logger.info("🔗 Вебхук установлен, ждём апдейты")
+                await stop.wait()
+            finally:
+                await server.stop()
+                await self.application.stop()
+                await self.on_stop(self.application)
+                await self.on_shutdown(self.application)
 
     def run(self):
         """Запуск бота"""
-        logger.info("Запуск Daggerheart Bot...")
+        logger.info("🚀 Запуск Daggerheart Bot...")
         self.application.add_error_handler(self.error_handler)
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if BOT_MODE == "webhook":
+            asyncio.run(self.run_webhook())
+        else:
+            self.application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
     bot = DaggerheartBot()
-    bot.run()
\ No newline at end of file
+    bot.run()
@@ -1,14 +1,22 @@
+from bot.startup import startup  # первым: от него считается время запуска
 import threading
-import time
 import logging
-from main import DaggerheartBot
-from webapp_server import run_webapp
-from config import WEBAPP_URL, PORT
+from config import WEBAPP_URL, PORT, BOT_MODE
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
+logger = logging.getLogger(__name__)
+
+
+def start_webapp():
+    """Mini App (Flask) в фоновом потоке; готовность сообщает сам сервер"""
+    try:
+        from webapp_server import run_webapp
+        run_webapp(on_ready=lambda: startup.mark("webapp_ready"))
+    except Exception as e:
+        logger.error(f"Веб-сервер Mini App не запустился: {e}")
 
 
 def main():
@@ -17,19 +25,22 @@ def main():
     print(f"📱 WEBAPP_URL: {WEBAPP_URL}")
     print(f"🌐 PORT: {PORT}")
 
-    # Запуск веб-сервера в отдельном потоке
-    webapp_thread = threading.Thread(target=run_webapp, daemon=True)
-    webapp_thread.start()
-    print("🌐 Веб-сервер запущен в фоновом режиме")
-
-    # Задержка для запуска веб-сервера
-    time.sleep(3)
-
-    # Запуск бота
+    if BOT_MODE == "webhook":
+        # Mini App отдаёт сервер вебхука на том же порту
+        print("🔗 Режим вебхука: Mini App и вебхук на одном сервере")
+    else:
+        # Бот не ждёт веб-сервер: Telegram обращается к Mini App только по кнопке,
+        # а о готовности сервер сообщит сам (startup.mark)
+        webapp_thread = threading.Thread(target=start_webapp, daemon=True)
+        webapp_thread.start()
+        print("🌐 Веб-сервер запускается в фоновом режиме")
+
+    # Запуск бота; тяжёлые модули (telegram, ГМ) импортируются только здесь
     print("🤖 Запуск Telegram бота...")
+    from main import DaggerheartBot
     bot = DaggerheartBot()
     bot.run()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -14,6 +14,7 @@ def create_directories():
     directories = [
         'game',
         'deepseek',
+        'bot',
         'logs',
         'temp'
     ]
@@ -22,7 +23,7 @@ def create_directories():
         os.makedirs(directory, exist_ok=True)
 
         # Создание __init__.py для Python пакетов
-        if directory in ['game', 'deepseek']:
+        if directory in ['game', 'deepseek', 'bot']:
             init_file = os.path.join(directory, '__init__.py')
             if not os.path.exists(init_file):
                 with open(init_file, 'w') as f:
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# config требует BOT_TOKEN при импорте; база - временный файл, а не daggerheart.db
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
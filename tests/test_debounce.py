@@ -0,0 +1,44 @@
+import asyncio
+
+from bot.debounce import MessageDebouncer
+
+
+def test_players_of_one_chat_reach_gm_one_at_a_time():
+    async def scenario():
+        debouncer = MessageDebouncer(window=0.01)
+        active, log = [], []
+
+        def action(player: str):
+            async def call(text: str):
+                active.append(player)
+                log.append(len(active))
+                await asyncio.sleep(0.02)  # ответ ГМ
+                active.remove(player)
+            return call
+
+        for player in ("alice", "bob"):
+            debouncer.submit(("chat", player), "действие", action(player), turn="chat")
+        await debouncer.close()
+        return log
+
+    assert asyncio.run(scenario()) == [1, 1]
+
+
+def test_drain_runs_pending_actions_before_returning():
+    async def scenario():
+        debouncer = MessageDebouncer(window=10.0, max_wait=10.0)
+        order = []
+
+        async def act(text: str):
+            await asyncio.sleep(0.01)
+            order.append(text)
+
+        debouncer.submit(("chat", 1), "подхожу", act, turn="chat")
+        debouncer.submit(("chat", 1), "и бью", act, turn="chat")
+        await debouncer.drain("chat")  # например, /roll сразу после сообщения
+        order.append("roll")
+        await debouncer.drain("other")  # в другом чате ждать нечего
+        await debouncer.close()
+        return order
+
+    assert asyncio.run(scenario()) == ["подхожу\nи бью", "roll"]
@@ -0,0 +1,21 @@
+from deepseek.effects import extract_game_effects, resolve_trait
+
+
+def test_strength_matches_only_its_own_forms():
+    for word in ("сила", "Силу", "силой", "сил", "strength"):
+        assert resolve_trait(word) == "strength"
+    for word in ("сильнее", "сильный", "силуэт", "силач"):
+        assert resolve_trait(word) is None
+
+
+def test_stems_still_resolve_any_case():
+    assert resolve_trait("ловкости") == "agility"
+    assert resolve_trait("Знаниями") == "knowledge"
+
+
+def test_only_resolved_traits_become_roll_requests():
+    effects = extract_game_effects("Брось силу против сложности 14, а потом проверка сильнее: 12. "
+                                   "Сделай проверку ловкости (10)")
+    assert [(effect["trait"], effect["difficulty"]) for effect in effects] == [("strength", 14), ("agility", 10)]
+    assert [effect["description"] for effect in effects] == ["Требуется проверка: сила",
+                                                             "Требуется проверка: ловкость"]
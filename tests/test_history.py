@@ -0,0 +1,39 @@
+import sqlite3
+import time
+
+from deepseek.history import ConversationHistoryStore, HistorySpill
+
+MESSAGES = [{"role": "user", "content": "Иду к воротам"}, {"role": "assistant", "content": "Стража молчит"}]
+
+
+def test_stale_spilled_history_is_pruned():
+    spill = HistorySpill(sqlite3.connect(":memory:", isolation_level=None))
+    spill.save("old", MESSAGES)
+    spill.save("fresh", MESSAGES)
+    spill.connection.execute("UPDATE gm_history SET updated_at = ? WHERE session_id = 'old'",
+                             (time.time() - 3 * 24 * 3600,))
+
+    # При запуске удаляется только заброшенная история
+    store = ConversationHistoryStore(spill=spill, spill_ttl_seconds=24 * 3600, prune_interval=0)
+    assert store.get("old") == []
+    assert store.get("fresh") == MESSAGES
+    assert store.get_stats()["pruned"] == 1
+
+    # Закончившаяся сессия удаляется сразу, не дожидаясь срока
+    store.clear("fresh")
+    assert spill.load("fresh") is None
+
+
+def test_prompt_window_moves_in_blocks():
+    store = ConversationHistoryStore(max_messages=20)
+    prompts = []
+    for turn in range(12):
+        store.append("s", [{"role": "user", "content": f"ход {turn}"},
+                           {"role": "assistant", "content": f"ответ {turn}"}])
+        prompts.append(store.tail("s", size=6, block=6))
+
+    assert [len(prompt) for prompt in prompts] == [2, 4, 6, 8, 10, 6, 8, 10, 6, 8, 10, 6]
+    # Между сдвигами промпт только дописывается - начало истории то же
+    assert prompts[6][:6] == prompts[5] and prompts[7][:8] == prompts[6]
+    # После вытеснения из max_messages окно считается от того же начала
+    assert prompts[11][0]["content"] == "ход 9"
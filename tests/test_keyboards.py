@@ -0,0 +1,36 @@
+from bot.callbacks import CallbackPayload, CallbackRouter
+from bot.keyboards import StaticUI, roll_request
+
+
+async def noop(update, context, payload: CallbackPayload):
+    pass
+
+
+def make_ui() -> StaticUI:
+    router = CallbackRouter()
+    for prefix in ("start_game", "quick_roll", "session_status", "roll", "gm_roll", "join_table"):
+        router.route(prefix, noop)
+    return StaticUI(router, "https://example.org/app")
+
+
+def test_inline_roll_keyboards_are_cached():
+    ui = make_ui()
+    rolls = (("agility", 12),)
+    assert ui.gm_reply_markup(rolls) is ui.gm_reply_markup(rolls)
+
+
+def test_keyboards_backed_by_callback_store_are_not_cached():
+    ui = make_ui()
+    # Не помещается в 64 байта callback_data - кнопка ссылается на ключ хранилища с TTL
+    rolls = (("agility:" + "x" * 60, 12),)
+    first, second = ui.gm_reply_markup(rolls), ui.gm_reply_markup(rolls)
+    assert first is not second
+    assert first.inline_keyboard[0][0].callback_data != second.inline_keyboard[0][0].callback_data
+    assert ui.get_stats()["uncached"] == 2
+
+
+def test_roll_request_rejects_bad_button_fields():
+    assert roll_request("agility", "12") == ("agility", 12)
+    assert roll_request("agility", "12.5") is None
+    assert roll_request("сила", 12) is None
+    assert roll_request("strength", 99) is None
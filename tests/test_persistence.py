@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+from telegram import Update
+
+from bot.persistence import SQLitePersistence
+from game.character import create_starting_character
+from game.game_session import SessionManager
+from game.storage import get_connection
+
+TRAITS = {"agility": 1, "strength": 2, "finesse": 0, "instinct": 1, "presence": 0, "knowledge": -1}
+
+
+def make_update(update_id: int, user_id: int) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": user_id, "is_bot": False, "first_name": "Игрок"}, "text": "/game"}
+    }, None)
+
+
+def test_data_in_flight_is_not_unloaded(tmp_path):
+    """Долгий обработчик (генерация сцены) не теряет user_data из-за выгрузки неактивных"""
+    async def scenario():
+        persistence = SQLitePersistence(get_connection(str(tmp_path / "p.db")), update_interval=0.01,
+                                        max_cached_users=1)
+        character = create_starting_character("Герой", "1", "guardian", "dwarf", TRAITS)
+        await persistence.update_user_data(1, {"character": character, "session_id": "s1"})
+        await persistence.flush()
+
+        # Обработчик /game игрока 1 начался и ждёт ГМ дольше 2 * update_interval
+        slow = make_update(1, 1)
+        persistence.begin_update(slow)
+        live = {}
+        await persistence.refresh_user_data(1, live)
+        time.sleep(0.05)
+
+        # Тем временем приходят апдейты других игроков и переполняют кэш
+        for user_id in (2, 3):
+            other = make_update(user_id, user_id)
+            persistence.begin_update(other)
+            await persistence.refresh_user_data(user_id, {})
+            persistence.end_update(other)
+        assert live["session_id"] == "s1"
+
+        # Обработчик закончил - Application сохраняет словарь целиком
+        live["session_id"] = "s2"
+        persistence.end_update(slow)
+        await persistence.update_user_data(1, live)
+        await persistence.flush()
+        return persistence
+
+    persistence = asyncio.run(scenario())
+    stored = persistence.load_user_data(1)
+    assert stored["session_id"] == "s2"
+    assert stored["character"].name == "Герой"
+
+
+def test_idle_data_is_unloaded_and_reloaded(tmp_path):
+    async def scenario():
+        persistence = SQLitePersistence(get_connection(str(tmp_path / "p.db")), update_interval=0,
+                                        max_cached_users=1)
+        await persistence.update_user_data(1, {"session_id": "s1"})
+        await persistence.flush()
+        first = {}
+        await persistence.refresh_user_data(1, first)
+        await persistence.refresh_user_data(2, {})
+        assert first == {}  # выгружен: обработки нет, изменения записаны
+        again = {}
+        await persistence.refresh_user_data(1, again)
+        return persistence, again
+
+    persistence, again = asyncio.run(scenario())
+    assert again == {"session_id": "s1"}
+    assert persistence.users.unloaded >= 1
+
+
+def test_reloaded_player_keeps_seated_character(tmp_path):
+    """После выгрузки и подгрузки урон через сессию виден в user_data"""
+    async def scenario():
+        sessions = SessionManager()
+        persistence = SQLitePersistence(get_connection(str(tmp_path / "p.db")), update_interval=0,
+                                        max_cached_users=1, sessions=sessions)
+        character = create_starting_character("Герой", "1", "guardian", "dwarf", TRAITS)
+        session = sessions.get_session(sessions.create_session("1", "Стол"))
+        session.add_player("1", character)
+        await persistence.update_user_data(1, {"character": character})
+        await persistence.flush()
+
+        first = {}
+        await persistence.refresh_user_data(1, first)
+        await persistence.refresh_user_data(2, {})
+        assert first == {}  # выгружен
+        again = {}
+        await persistence.refresh_user_data(1, again)
+
+        damage = session.deal_damage_to_character("1", 20, "гоблин")
+        return character, again, damage
+
+    character, again, damage = asyncio.run(scenario())
+    assert again["character"] is character
+    assert again["character"].current_hp == damage["new_hp"] < damage["old_hp"]
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import time
+
+import pytest
+from aiohttp import web
+
+from deepseek.fake_server import FakeDeepSeekServer, FakeServerConfig
+from deepseek.gm_api import DaggerheartGM
+from deepseek.policy import GenerationParams
+from deepseek.resilience import (CircuitBreaker, CircuitOpenError, GMAPIError, GMTimeoutError,
+                                 ResilientCaller, RetryPolicy)
+
+MESSAGES = [{"role": "user", "content": "Осматриваюсь"}]
+PARAMS = GenerationParams("deepseek-chat", 300, 0.7)
+REPLY = "Ветер гонит туман над болотом. " * 8
+
+
+class FlakyServer(FakeDeepSeekServer):
+    """Первые failures запросов - 503, поток обрывается мусором, если broken_stream"""
+
+    def __init__(self, failures: int = 0, broken_stream: bool = False, **config):
+        super().__init__(FakeServerConfig(replies=[REPLY], **config))
+        self.failures = failures
+        self.broken_stream = broken_stream
+
+    async def handle_completion(self, request: web.Request) -> web.StreamResponse:
+        if self.failures:
+            self.failures -= 1
+            await request.read()
+            return web.json_response({"error": {"message": "overloaded"}}, status=503)
+        return await super().handle_completion(request)
+
+    async def _stream_reply(self, request, payload, reply, usage):
+        if not self.broken_stream:
+            return await super()._stream_reply(request, payload, reply, usage)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        chunk = {"choices": [{"index": 0, "delta": {"content": reply[:8]}}]}
+        await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await response.write(b"data: {\"choices\": [\n\n")
+        await response.write_eof()
+        return response
+
+
+def run_with_gm(server: FlakyServer, scenario, deadline: float = 10.0, failure_threshold: int = 5):
+    """Запустить scenario(gm) против server с быстрыми повторами"""
+    async def main():
+        gm = DaggerheartGM()
+        gm.api_url = await server.start(port=0)
+        gm.resilience = ResilientCaller(
+            policy=RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.02),
+            breaker=CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=60),
+            attempt_timeout=5, deadline=deadline
+        )
+        try:
+            return await scenario(gm)
+        finally:
+            await gm.close()
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+async def read_stream(gm: DaggerheartGM) -> str:
+    return "".join([delta async for delta in gm._stream_completion("s", MESSAGES, PARAMS)])
+
+
+def test_failed_attempts_are_retried():
+    async def scenario(gm):
+        text = await gm._request_completion("s", MESSAGES, PARAMS)
+        streamed = await read_stream(gm)
+        return text, streamed, gm.get_resilience_stats()
+
+    text, streamed, stats = run_with_gm(FlakyServer(failures=2), scenario)
+    assert text == REPLY and streamed == REPLY
+    assert stats["retries"] == 2 and stats["errors_by_status"] == {503: 2}
+    assert stats["breaker_state"] == "closed" and stats["consecutive_failures"] == 0
+
+
+def test_broken_stream_opens_breaker():
+    async def scenario(gm):
+        with pytest.raises(GMAPIError) as broken:
+            await read_stream(gm)
+        # Поток открылся успешно, но оборвался - предохранитель должен это увидеть
+        with pytest.raises(CircuitOpenError):
+            await read_stream(gm)
+        return broken.value, gm.get_resilience_stats()
+
+    error, stats = run_with_gm(FlakyServer(broken_stream=True), scenario, failure_threshold=1)
+    assert error.retryable
+    assert stats["breaker_state"] == "open" and stats["rejected_by_breaker"] == 1
+
+
+def test_deadline_bounds_whole_stream():
+    async def scenario(gm):
+        started = time.monotonic()
+        with pytest.raises(GMTimeoutError):
+            await read_stream(gm)
+        return time.monotonic() - started, gm.get_resilience_stats()
+
+    # Первый байт сразу, но весь ответ (~60 токенов по 20 в секунду) дольше дедлайна
+    elapsed, stats = run_with_gm(FlakyServer(token_rate=20), scenario, deadline=0.5)
+    assert elapsed < 1.5
+    assert stats["timeouts"] == 1 and stats["consecutive_failures"] == 1
+
+
+def test_cancelled_probe_releases_half_open_breaker():
+    async def main():
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        caller = ResilientCaller(policy=RetryPolicy(max_attempts=1), breaker=breaker)
+        breaker.record_failure()
+
+        started = asyncio.Event()
+
+        async def hanging():
+            started.set()
+            await asyncio.sleep(60)
+
+        async def answer():
+            return "ok"
+
+        # Пробный запрос half-open отменяют (новое действие снимает спекулятивную генерацию)
+        probe = asyncio.ensure_future(caller.call(hanging))
+        await started.wait()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        return await caller.call(answer), breaker.state
+
+    result, state = asyncio.run(main())
+    assert result == "ok" and state == CircuitBreaker.CLOSED
+
+
+def test_stream_without_usage_still_succeeds():
+    from game.character import create_starting_character
+    from game.game_session import GameSession
+
+    class NoUsageServer(FlakyServer):
+        async def _stream_reply(self, request, payload, reply, usage):
+            payload.pop("stream_options", None)  # провайдер не прислал блок usage
+            return await super()._stream_reply(request, payload, reply, usage)
+
+    async def scenario(gm):
+        session = GameSession("no-usage", "1", "Без usage")
+        session.add_player("1", create_starting_character(
+            "Герой", "1", "guardian", "dwarf",
+            {"agility": 1, "strength": 2, "finesse": 0, "instinct": 1, "presence": 0, "knowledge": -1}
+        ))
+        session.start_session()
+        gm.structured_output = True  # ответ идёт потоком
+        return await gm.process_player_action(session, "1", "Осматриваюсь")
+
+    result = run_with_gm(NoUsageServer(), scenario)
+    assert result["success"] and result["context"]["prefix_cache_hit_rate"] == 0.0
@@ -0,0 +1,21 @@
+from deepseek.structured import IncrementalGMParser
+
+
+def parse(text: str, chunk: int = 7):
+    parser = IncrementalGMParser()
+    for start in range(0, len(text), chunk):
+        parser.feed(text[start:start + chunk])
+    return parser.finish()
+
+
+def test_reply_cut_before_narration_keeps_effects_without_raw_json():
+    reply = parse('{"effects": [{"type": "damage", "amount": 3}, {"type": "request_roll", "trai')
+    assert reply.narration == ""
+    assert reply.effects == [{"type": "damage", "amount": 3, "description": "Урон: 3"}]
+
+
+def test_plain_text_reply_falls_back_to_text_parsing():
+    reply = parse("Гоблин наносит 2 урона.")
+    assert not reply.structured
+    assert reply.narration == "Гоблин наносит 2 урона."
+    assert reply.effects[0]["type"] == "damage"
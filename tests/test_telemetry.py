@@ -0,0 +1,24 @@
+from deepseek.telemetry import GMTelemetry
+
+PRICING = {"deepseek-chat": {"input_cache_hit": 0.0, "input_cache_miss": 0.0, "output": 1_000_000.0}}
+
+
+def spend(telemetry: GMTelemetry, session_id: str, completion_tokens: int):
+    trace = telemetry.start(session_id, "action", "deepseek-chat")
+    telemetry.finish(trace, "ok", {"prompt_tokens": 0, "completion_tokens": completion_tokens})
+
+
+def test_evicted_session_stays_over_ceiling():
+    telemetry = GMTelemetry(PRICING, session_cost_ceiling=5.0, max_sessions=2)
+    spend(telemetry, "expensive", 10)
+    assert telemetry.over_ceiling("expensive")
+
+    # Журнал дорогой сессии вытесняют другие - потолок всё равно действует
+    for session_id in ("a", "b", "c"):
+        spend(telemetry, session_id, 1)
+    assert "expensive" not in telemetry.ledgers
+    assert telemetry.over_ceiling("expensive") and not telemetry.over_ceiling("a")
+    assert telemetry.snapshot()["sessions_over_ceiling"] == 1
+
+    telemetry.forget("expensive")
+    assert not telemetry.over_ceiling("expensive")
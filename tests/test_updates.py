@@ -0,0 +1,72 @@
+import asyncio
+
+from telegram import Update
+
+from bot.updates import SHED_TEXT, ChatOrderedUpdateProcessor
+
+
+class RecordingBot:
+    """Вместо Bot API: запоминает ответы на пропущенные апдейты"""
+
+    def __init__(self):
+        self.sent = []
+        self.answered = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+    async def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        self.answered.append(callback_query_id)
+
+
+def make_update(update_id: int, chat_id: int, bot=None) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "private"},
+                    "from": {"id": chat_id, "is_bot": False, "first_name": "Игрок"}, "text": "действие"}
+    }, bot)
+
+
+def make_button_press(update_id: int, chat_id: int, bot) -> Update:
+    user = {"id": chat_id, "is_bot": False, "first_name": "Игрок"}
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {"id": str(update_id), "from": user, "chat_instance": "1", "data": "roll",
+                           "message": {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"},
+                                       "text": "ГМ"}}
+    }, bot)
+
+
+def test_flooding_chat_is_shed_and_others_proceed():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(4, max_chat_queue=3)
+        await processor.initialize()
+        bot = RecordingBot()
+        release = asyncio.Event()
+        handled = []
+
+        async def handle(update: Update):
+            if update.effective_chat.id == 1:
+                await release.wait()  # долгий ответ ГМ
+            handled.append(update.update_id)
+
+        flood = [asyncio.ensure_future(processor.process_update(update, handle(update)))
+                 for update in (make_update(i, 1, bot) for i in range(8))]
+        presses = [asyncio.ensure_future(processor.process_update(update, handle(update)))
+                   for update in (make_button_press(i, 1, bot) for i in (8, 9))]
+        await asyncio.sleep(0.01)
+        # Флуд одного чата не задерживает другой
+        await processor.process_update(make_update(100, 2), handle(make_update(100, 2)))
+        assert handled == [100]
+
+        release.set()
+        await asyncio.gather(*flood, *presses)
+        return handled, processor.get_stats(), bot
+
+    handled, stats, bot = asyncio.run(scenario())
+    # Один в работе и трое в очереди, остальные шесть потеряны; порядок сохранён
+    assert handled == [100, 0, 1, 2, 3]
+    assert stats["shed"] == 6 and stats["max_in_flight"] == 32
+    # Потерянные не исчезают молча: одно "подождите" в чат и ответ на каждое нажатие кнопки
+    assert bot.sent == [(1, SHED_TEXT)]
+    assert bot.answered == ["8", "9"]
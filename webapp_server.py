@@ -1,6 +1,8 @@
 from flask import Flask, render_template_string, request, jsonify
+from werkzeug.serving import make_server
 import threading
 import os
+from typing import Callable, Optional
 from config import PORT
 
 app = Flask(__name__)
@@ -871,42 +873,19 @@ def health_check():
     return jsonify({"status": "ok", "message": "Daggerheart WebApp is running"})
 
 
-def run_webapp():
-    """Запуск веб-приложения"""
+def run_webapp(on_ready: Optional[Callable[[], None]] = None):
+    """
+    Запуск веб-приложения
+
+    Args:
+        on_ready: Вызывается, когда сервер уже слушает порт (вместо паузы "на всякий случай")
+    """
     print(f"🌐 Запуск веб-сервера на порту {PORT}")
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    server = make_server('0.0.0.0', PORT, app, threaded=True)
+    if on_ready:
+        on_ready()
+    server.serve_forever()
 
 
 if __name__ == "__main__":
     run_webapp()
-
-
-@app.route('/')
-def index():
-    """Главная страница Mini App"""
-    return render_template_string(WEBAPP_HTML)
-
-
-@app.route('/api/character', methods=['POST'])
-def create_character():
-    """API для создания персонажа"""
-    data = request.json
-    # Пока что просто возвращаем данные
-    return jsonify({"status": "success", "character": data})
-
-
-@app.route('/api/action', methods=['POST'])
-def game_action():
-    """API для игровых действий"""
-    data = request.json
-    # Здесь будет интеграция с DeepSeek
-    return jsonify({"status": "success", "gm_response": "Пока что заглушка ГМ"})
-
-
-def run_webapp():
-    """Запуск веб-приложения"""
-    app.run(host='0.0.0.0', port=PORT, debug=False)
-
-
-if __name__ == "__main__":
-    run_webapp()
\ No newline at end of file